@@ -9,11 +9,24 @@ from atlassian.bitbucket.cloud import Cloud
 from requests.exceptions import HTTPError
 
 from cgitize.repo import Repo, Visibility
+from cgitize.session import make_session
 
 
 class Bitbucket:
-    def __init__(self, email=None, token=None):
-        self._impl = Cloud(username=email, password=token, cloud=True)
+    DEFAULT_BASE_URL = "https://api.bitbucket.org/"
+
+    def __init__(self, email=None, token=None, cache=None, limiter=None, base_url=None):
+        if base_url is None:
+            base_url = Bitbucket.DEFAULT_BASE_URL
+        self.limiter = limiter
+        self.session = make_session(cache, limiter, provider="bitbucket")
+        self._impl = Cloud(
+            url=base_url,
+            username=email,
+            password=token,
+            cloud=True,
+            session=self.session,
+        )
 
     def get_repo(self, repo):
         try:
@@ -28,6 +41,10 @@ class Bitbucket:
             logging.error("Couldn't fetch repository: %s", repo.id)
             raise
 
+    def get_repos(self, repos):
+        for repo in repos:
+            yield repo, self.get_repo(repo)
+
     def get_user_repos(self, user, visibility=Visibility.ALL):
         try:
             workspace = self._impl.workspaces.get(user.name)
@@ -36,6 +53,10 @@ class Bitbucket:
             logging.error("Couldn't fetch user repositories: %s", user.name)
             raise
 
+    @staticmethod
+    def get_repo_id(repo):
+        return repo.data["full_name"]
+
     @staticmethod
     def convert_repo(repo, *args, **kwargs):
         return Repo.from_bitbucket(repo, *args, **kwargs)
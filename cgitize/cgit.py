@@ -6,9 +6,20 @@
 import logging
 import os
 import shutil
+import threading
+import time
 
-from cgitize.git import Git
-from cgitize.utils import chdir
+from cgitize.git import GIT_ENV, ConnectionLimiter, Git
+from cgitize.metrics import (
+    AGEFILE_WRITES,
+    REPO_FETCH_DURATION,
+    REPO_RECEIVED_BYTES,
+    REPO_UPDATES,
+)
+from cgitize.pools import ObjectPools
+from cgitize.state import State
+from cgitize.trace import span
+from cgitize.utils import collect_errors, replace_file
 
 
 class CGitServer:
@@ -30,11 +41,12 @@ class CGitRCWriter:
         return os.path.join(repo_dir, "cgitrc")
 
     def write(self, repo_dir, repo):
-        with open(self.get_path(repo_dir), "w") as fd:
-            self._write_field(fd, "clone-url", self._build_clone_url(repo))
-            self._write_field(fd, "owner", repo.owner)
-            self._write_field(fd, "desc", repo.desc)
-            self._write_field(fd, "homepage", repo.homepage)
+        with span("cgitrc", "write", path=repo_dir):
+            with open(self.get_path(repo_dir), "w") as fd:
+                self._write_field(fd, "clone-url", self.build_clone_url(repo))
+                self._write_field(fd, "owner", repo.owner)
+                self._write_field(fd, "desc", repo.desc)
+                self._write_field(fd, "homepage", repo.homepage)
 
     @staticmethod
     def _write_field(fd, field, value):
@@ -42,7 +54,7 @@ class CGitRCWriter:
             return
         fd.write(f"{field}={value}\n")
 
-    def _build_clone_url(self, repo):
+    def build_clone_url(self, repo):
         clone_urls = []
         cgit_clone_url = self.cgit_server.get_clone_url(repo)
         if cgit_clone_url is not None:
@@ -55,34 +67,106 @@ class CGitRCWriter:
         return clone_urls
 
 
+class CGitRepoList:
+    # A cgit config file with the repo.* settings of every repository, which
+    # can be included from cgitrc instead of using scan-path. That way, cgit
+    # doesn't have to crawl the output directory on every request.
+
+    def __init__(self, cgitrc):
+        self.cgitrc = cgitrc
+        self._repos = {}
+        self._lock = threading.Lock()
+
+    def add(self, repo_dir, repo):
+        with self._lock:
+            self._repos[repo.dir] = (repo_dir, repo)
+
+    def remove(self, repo):
+        with self._lock:
+            self._repos.pop(repo.dir, None)
+
+    def __len__(self):
+        return len(self._repos)
+
+    def build(self):
+        with self._lock:
+            repos = list(self._repos.values())
+        # section= applies to every repo.url that follows it, so repositories
+        # are grouped by section, with the top-level ones going first.
+        repos.sort(key=lambda x: (self._get_section(x[1]), x[1].url_path))
+        lines = []
+        section = ""
+        for repo_dir, repo in repos:
+            if self._get_section(repo) != section:
+                section = self._get_section(repo)
+                lines.append("")
+                lines.append(f"section={section}")
+            lines.append("")
+            lines += self._build_repo(repo_dir, repo)
+        return "\n".join(["# Generated by cgitize, do not edit."] + lines) + "\n"
+
+    @staticmethod
+    def _get_section(repo):
+        return os.path.dirname(repo.dir)
+
+    def _build_repo(self, repo_dir, repo):
+        lines = []
+        fields = [
+            ("url", repo.url_path),
+            ("path", repo_dir),
+            ("desc", repo.desc),
+            ("owner", repo.owner),
+            ("clone-url", self.cgitrc.build_clone_url(repo)),
+            ("homepage", repo.homepage),
+        ]
+        for field, value in fields:
+            if value is None:
+                continue
+            # Values can't span multiple lines.
+            value = " ".join(str(value).splitlines())
+            lines.append(f"repo.{field}={value}")
+        return lines
+
+    def write(self, path):
+        with span("repo list", "write", path=path):
+            changed = replace_file(path, self.build())
+        if changed:
+            logging.info("Updated repository list: %s", path)
+        else:
+            logging.info("Repository list hasn't changed: %s", path)
+
+
 class AgeFile:
     @staticmethod
     def write(repo_dir):
-        timestamp = AgeFile.get_age(repo_dir)
-        if timestamp:
-            os.makedirs(AgeFile.get_dir(repo_dir), exist_ok=True)
-            with open(AgeFile.get_path(repo_dir), mode="w") as fd:
-                fd.write(f"{timestamp}")
+        start = time.monotonic()
+        with span("agefile", "write", path=repo_dir):
+            timestamp = AgeFile.get_age(repo_dir)
+            if timestamp:
+                os.makedirs(AgeFile.get_dir(repo_dir), exist_ok=True)
+                with open(AgeFile.get_path(repo_dir), mode="w") as fd:
+                    fd.write(f"{timestamp}")
+        AGEFILE_WRITES.observe(time.monotonic() - start)
 
     @staticmethod
     def get_age(repo_dir):
         # https://git.zx2c4.com/cgit/tree/contrib/hooks/post-receive.agefile
         # Except I think that the committer date, not author date  better
         # represents activity.
-        with chdir(repo_dir):
-            success, output = Git.capture(
-                "for-each-ref",
-                "--sort=-committerdate",
-                "--count=1",
-                "--format=%(committerdate:iso8601)",
+        success, output = Git.capture(
+            "for-each-ref",
+            "--sort=-committerdate",
+            "--count=1",
+            "--format=%(committerdate:iso8601)",
+            cwd=repo_dir,
+        )
+        if not success:
+            logging.error(
+                "Couldn't get the timestamp of the newest commit in repository: %s",
+                repo_dir,
             )
-            if not success:
-                logging.error(
-                    "Couldn't get the timestamp of the newest commit in repository: %s",
-                    repo_dir,
-                )
-                return None
-            return output
+            return None
+        return output
 
     @staticmethod
     def get_dir(repo_dir):
@@ -94,10 +178,52 @@ class AgeFile:
 
 
 class CGitRepositories:
-    def __init__(self, output_dir, cgit_server, force=False):
+    # Used to estimate how long it takes to clone a repository that's never
+    # been mirrored, in bytes per second. Only the order of the estimates
+    # matters, so this doesn't need to be accurate.
+    CLONE_THROUGHPUT = 10 * 1024 * 1024
+
+    def __init__(
+        self,
+        output_dir,
+        cgit_server,
+        state=None,
+        force=False,
+        full=False,
+        maintenance=None,
+        pools=None,
+        seed=None,
+        clone_timeout=None,
+        fetch_timeout=None,
+        connections=None,
+        git_env=GIT_ENV,
+        metrics=False,
+    ):
         self.dir = self._make_dir(output_dir)
         self.cgitrc = CGitRCWriter(cgit_server)
+        self.repo_list = CGitRepoList(self.cgitrc)
+        if state is None:
+            state = State.in_memory()
+        self.state = state
         self.force = force
+        self.full = full
+        self.maintenance = maintenance
+        self.pools = pools
+        self.seed = seed
+        # The git processes that take longer than this are killed (None means
+        # no timeout).
+        self.clone_timeout = clone_timeout
+        self.fetch_timeout = fetch_timeout
+        if connections is None:
+            connections = ConnectionLimiter()
+        self.connections = connections
+        # The environment of the git processes talking to the remotes (see
+        # SSHMultiplexer).
+        self.git_env = git_env
+        # Measuring the amount of data received means walking the object
+        # store before & after every fetch, so it's only done if the metrics
+        # are exported.
+        self.metrics = metrics
 
     @staticmethod
     def _make_dir(rel_path):
@@ -108,80 +234,372 @@ class CGitRepositories:
     def get_repo_dir(self, repo):
         return os.path.join(self.dir, repo.dir)
 
-    def update(self, repo):
-        success = self._mirror_or_update(repo)
-        if success:
-            self.cgitrc.write(self.get_repo_dir(repo), repo)
-            AgeFile.write(self.get_repo_dir(repo))
-        return success
+    def update(self, repo, full=False):
+        # If full is set, the repository is updated even if it hasn't
+        # changed upstream (as far as the state DB knows).
+        try:
+            return self._update(repo, full or self.full)
+        except BaseException:
+            REPO_UPDATES.inc(repo=repo.url_path, result="failure")
+            raise
+        finally:
+            # Even if the update failed, the old mirror can still be served.
+            self.skip(repo)
+
+    def skip(self, repo):
+        # The existing mirror is still listed.
+        repo_dir = self.get_repo_dir(repo)
+        if os.path.isdir(repo_dir):
+            self.repo_list.add(repo_dir, repo)
+
+    def _is_current(self, repo, mirror, full):
+        # The update can be skipped.
+        return (
+            not full
+            and mirror.is_current(repo)
+            and os.path.isdir(self.get_repo_dir(repo))
+        )
+
+    def estimate(self, repo, full=False):
+        # Returns the expected duration of the update in seconds, or None if
+        # there's no telling. The longest updates are started first, so that
+        # a huge repository doesn't end up being the last one to start.
+        mirror = self.state.get(repo)
+        if self._is_current(repo, mirror, full or self.full):
+            return 0
+        if mirror.fetch_duration is not None:
+            # The last update should be representative enough.
+            return mirror.fetch_duration
+        if repo.size is not None:
+            return repo.size / self.CLONE_THROUGHPUT
+        return None
+
+    def _update(self, repo, full):
+        repo_dir = self.get_repo_dir(repo)
+        mirror = self.state.get(repo)
+
+        if self._is_current(repo, mirror, full):
+            logging.info("Repository '%s' hasn't changed, skipping", repo.name)
+            REPO_UPDATES.inc(repo=repo.url_path, result="unchanged")
+            self.cgitrc.write(repo_dir, repo)
+            self._maintain(repo, repo_dir, mirror.refs_hash, mirror)
+            return True
+
+        # The time spent waiting for a connection slot doesn't count: the
+        # duration is used to estimate the next update.
+        with self.connections.connect(repo.clone_url):
+            start = time.monotonic()
+            size = self._get_objects_size(repo_dir) if self.metrics else None
+            with collect_errors() as errors:
+                try:
+                    success = self._mirror_or_update(repo, mirror)
+                except Exception as e:
+                    self.state.record_failure(repo, str(e))
+                    raise
+            duration = time.monotonic() - start
+        REPO_FETCH_DURATION.set(duration, repo=repo.url_path)
+
+        if not success:
+            error = errors[-1] if errors else "unknown error, see the logs"
+            self.state.record_failure(repo, error)
+            REPO_UPDATES.inc(repo=repo.url_path, result="failure")
+            return False
+
+        # git doesn't report how much it's downloaded, but the new objects
+        # end up in the repository's object store (the object pool is updated
+        # later).
+        if size is not None:
+            received = max(0, self._get_objects_size(repo_dir) - size)
+            REPO_RECEIVED_BYTES.set(received, repo=repo.url_path)
+
+        if self.pools is not None and not self.pools.update(repo, repo_dir):
+            # The mirror is still fine, it just keeps its own objects.
+            logging.warning("Couldn't update the object pool of: %s", repo.name)
+
+        refs_hash = Git.hash_refs(repo_dir)
+        self.cgitrc.write(repo_dir, repo)
+        if refs_hash != mirror.refs_hash or not os.path.exists(
+            AgeFile.get_path(repo_dir)
+        ):
+            AgeFile.write(repo_dir)
+        self.state.record_success(repo, duration, refs_hash)
+        REPO_UPDATES.inc(repo=repo.url_path, result="success")
+        self._maintain(repo, repo_dir, refs_hash, mirror)
+        return True
+
+    @staticmethod
+    def _get_objects_size(repo_dir):
+        size = 0
+        for dir, _, names in os.walk(os.path.join(repo_dir, "objects")):
+            for name in names:
+                try:
+                    size += os.path.getsize(os.path.join(dir, name))
+                except FileNotFoundError:
+                    pass
+        return size
+
+    def _maintain(self, repo, repo_dir, refs_hash, mirror):
+        # Maintenance failures are logged, but the mirror is still usable.
+        if self.maintenance is None:
+            return
+        refs_changed = refs_hash != mirror.maintained_refs_hash
+        if self.maintenance.run(repo_dir, refs_changed):
+            self.state.record_maintenance(repo, refs_hash)
 
-    def _mirror_or_update(self, repo):
+    def _mirror_or_update(self, repo, mirror):
         repo_dir = self.get_repo_dir(repo)
 
         if not os.path.isdir(repo_dir):
             # The local directory doesn't exist, mirror the new repository.
             return self._mirror(repo)
 
-        with chdir(repo_dir):
-            success, output = Git.capture("rev-parse", "--is-inside-work-tree")
-            if not success:
-                # Overwrite the existing directory if it's not a Git repository.
-                logging.warning(
-                    "Local directory is not a repository, going to overwrite it: %s",
-                    repo_dir,
-                )
-                return self._mirror(repo)
-
-            success, output = Git.capture("config", "--get", "remote.origin.url")
-            if not success:
-                # Every repository managed by this script should have the
-                # 'origin' remote. If it doesn't, it's trash. Overwrite the
-                # existing directory, mirroring the repository in it.
-                logging.warning(
-                    "Local repository doesn't have remote 'origin', going to overwrite it: %s",
-                    repo_dir,
-                )
-                return self._mirror(repo)
-
-            if f"{repo.clone_url}" != output:
-                # Jeez, there's a proper local repository in the target
-                # directory already with a different upstream; something's
-                # wrong, fix it manually.
-                logging.warning(
-                    "Existing repository '%s' doesn't match the specified clone URL: %s",
-                    repo.name,
-                    repo.clone_url,
+        if (
+            mirror.healthy
+            and mirror.clone_url == repo.clone_url
+            and mirror.refspecs == repo.refs.refspecs
+        ):
+            # The last update went fine, no need to spawn git to check that
+            # the directory is still a proper mirror of the same upstream.
+            return self._update_existing(repo)
+
+        success, output = Git.capture(
+            "rev-parse", "--is-inside-work-tree", cwd=repo_dir
+        )
+        if not success:
+            # Overwrite the existing directory if it's not a Git repository.
+            logging.warning(
+                "Local directory is not a repository, going to overwrite it: %s",
+                repo_dir,
+            )
+            return self._mirror(repo)
+
+        success, output = Git.capture(
+            "config", "--get", "remote.origin.url", cwd=repo_dir
+        )
+        if not success:
+            # Every repository managed by this script should have the
+            # 'origin' remote. If it doesn't, it's trash. Overwrite the
+            # existing directory, mirroring the repository in it.
+            logging.warning(
+                "Local repository doesn't have remote 'origin', going to overwrite it: %s",
+                repo_dir,
+            )
+            return self._mirror(repo)
+
+        if f"{repo.clone_url}" != output:
+            # Jeez, there's a proper local repository in the target
+            # directory already with a different upstream; something's
+            # wrong, fix it manually.
+            logging.warning(
+                "Existing repository '%s' doesn't match the specified clone URL: %s",
+                repo.name,
+                repo.clone_url,
+            )
+            if self.force:
+                # Unless --force was specified, in which case we overwrite
+                # the repository.
+                return (
+                    self._fix_upstream_url(repo)
+                    and self._apply_ref_filter(repo)
+                    and self._update_existing(repo)
                 )
-                if self.force:
-                    # Unless --force was specified, in which case we overwrite
-                    # the repository.
-                    return self._fix_upstream_url(repo) and self._update_existing(repo)
-                return False
+            return False
 
-            # The local directory contains the local version of the upstream,
-            # update it.
-            return self._update_existing(repo)
+        # The local directory contains the local version of the upstream,
+        # update it.
+        return self._apply_ref_filter(repo) and self._update_existing(repo)
 
     def _mirror(self, repo):
         logging.info("Mirroring repository '%s' from: %s", repo.name, repo.clone_url)
         repo_dir = self.get_repo_dir(repo)
-        if os.path.isdir(repo_dir):
-            try:
-                shutil.rmtree(repo_dir)
-            except Exception as e:
-                logging.exception(e)
+        if not self._remove(repo):
+            return False
+        pool_dir = None
+        if self.pools is not None:
+            pool_dir = self.pools.get(repo)
+        seed = self._find_seed(repo)
+        if seed is not None:
+            success = self._mirror_from_seed(repo, seed, pool_dir)
+            if success is not None:
+                return success
+        if not repo.refs.is_default:
+            return self._mirror_filtered(repo, pool_dir)
+        args = []
+        if pool_dir is not None:
+            # Only download the objects the pool doesn't have.
+            args += ["--reference", pool_dir]
+        return Git.check(
+            "clone",
+            "--mirror",
+            "--quiet",
+            *args,
+            repo.clone_url,
+            repo_dir,
+            env=Git.auth_env(repo, self.git_env),
+            timeout=self.clone_timeout,
+        )
+
+    def _remove(self, repo):
+        repo_dir = self.get_repo_dir(repo)
+        if not os.path.isdir(repo_dir):
+            return True
+        try:
+            shutil.rmtree(repo_dir)
+            return True
+        except Exception as e:
+            logging.exception(e)
+            return False
+
+    def _find_seed(self, repo):
+        # The seed is either a directory with <repo>.bundle files, or another
+        # cgitize output directory (possibly a remote one, specified as a
+        # URL).
+        if self.seed is None:
+            return None
+        if "://" in self.seed:
+            return f"{self.seed.rstrip('/')}/{repo.dir}"
+        bundle = os.path.join(self.seed, f"{repo.url_path}.bundle")
+        if os.path.isfile(bundle):
+            return bundle
+        mirror = os.path.join(self.seed, repo.dir)
+        if os.path.isdir(mirror):
+            # The file:// prefix makes git copy the objects using the regular
+            # transport, instead of hardlinking them (along with the seed's
+            # alternates, if it has any).
+            return f"file://{os.path.abspath(mirror)}"
+        return None
+
+    def _mirror_from_seed(self, repo, seed, pool_dir):
+        # Clone the seed first, then fetch whatever is missing from the
+        # upstream. Returns None if the seed couldn't be cloned, in which
+        # case the repository is mirrored from scratch.
+        logging.info("Seeding repository '%s' from: %s", repo.name, seed)
+        repo_dir = self.get_repo_dir(repo)
+        args = []
+        if pool_dir is not None:
+            args += ["--reference", pool_dir]
+        if not Git.check(
+            "clone",
+            "--mirror",
+            "--quiet",
+            *args,
+            seed,
+            repo_dir,
+            env=self.git_env,
+            timeout=self.clone_timeout,
+        ):
+            logging.warning("Couldn't seed repository '%s'", repo.name)
+            if not self._remove(repo):
                 return False
-        with Git.setup_auth(repo):
-            return Git.check("clone", "--mirror", "--quiet", repo.clone_url, repo_dir)
+            return None
+        return (
+            self._fix_upstream_url(repo)
+            and self._apply_ref_filter(repo)
+            and self._update_existing(repo)
+            and self._set_head(repo)
+        )
+
+    def _mirror_filtered(self, repo, pool_dir):
+        # `git clone --mirror` fetches every ref, and ignores additional
+        # refspecs during the initial fetch. Set up the remote manually
+        # instead.
+        repo_dir = self.get_repo_dir(repo)
+        env = Git.auth_env(repo, self.git_env)
+        if not Git.check("init", "--bare", "--quiet", repo_dir):
+            return False
+        if not Git.check(
+            "config", "remote.origin.url", repo.clone_url, cwd=repo_dir
+        ) or not Git.check("config", "remote.origin.mirror", "true", cwd=repo_dir):
+            return False
+        if not self._set_refspecs(repo):
+            return False
+        if pool_dir is not None:
+            ObjectPools.add_alternate(repo_dir, pool_dir)
+        if not Git.check(
+            "fetch",
+            "--quiet",
+            "--prune",
+            "origin",
+            cwd=repo_dir,
+            env=env,
+            timeout=self.clone_timeout,
+        ):
+            return False
+        return self._set_head(repo)
+
+    def _set_head(self, repo):
+        # Point HEAD to the upstream's default branch, like clone does.
+        repo_dir = self.get_repo_dir(repo)
+        success, output = Git.capture(
+            "ls-remote",
+            "--symref",
+            "origin",
+            "HEAD",
+            cwd=repo_dir,
+            env=Git.auth_env(repo, self.git_env),
+            timeout=self.fetch_timeout,
+        )
+        if not success:
+            return False
+        for line in output.splitlines():
+            if line.startswith("ref: ") and line.endswith("\tHEAD"):
+                head = line[len("ref: ") : -len("\tHEAD")]
+                return Git.check("symbolic-ref", "HEAD", head, cwd=repo_dir)
+        return True
+
+    def _set_refspecs(self, repo):
+        repo_dir = self.get_repo_dir(repo)
+        first, *rest = repo.refs.refspecs
+        if not Git.check(
+            "config", "--replace-all", "remote.origin.fetch", first, cwd=repo_dir
+        ):
+            return False
+        for refspec in rest:
+            if not Git.check(
+                "config", "--add", "remote.origin.fetch", refspec, cwd=repo_dir
+            ):
+                return False
+        # Otherwise, the tags pointing to the fetched commits are fetched too,
+        # even if they're filtered out.
+        return Git.check("config", "remote.origin.tagOpt", "--no-tags", cwd=repo_dir)
+
+    def _apply_ref_filter(self, repo):
+        # If the ref filter has changed since the mirror was created, update
+        # the refspecs & delete the refs that are filtered out now. The next
+        # fetch takes care of the refs that are no longer filtered out.
+        repo_dir = self.get_repo_dir(repo)
+        success, output = Git.capture(
+            "config", "--get-all", "remote.origin.fetch", cwd=repo_dir
+        )
+        if success and output.splitlines() == repo.refs.refspecs:
+            return True
+        logging.info("Ref filter of repository '%s' has changed", repo.name)
+        if not self._set_refspecs(repo):
+            return False
+        success, output = Git.capture(
+            "for-each-ref", "--format=%(refname)", cwd=repo_dir
+        )
+        if not success:
+            return False
+        deleted = [ref for ref in output.splitlines() if not repo.refs.matches(ref)]
+        if not deleted:
+            return True
+        logging.info("Deleting %d ref(s) filtered out", len(deleted))
+        commands = "".join(f"delete {ref}\n" for ref in deleted)
+        return Git.check("update-ref", "--stdin", input=commands, cwd=repo_dir)
 
     def _fix_upstream_url(self, repo):
         repo_dir = self.get_repo_dir(repo)
-        with chdir(repo_dir):
-            return Git.check("remote", "set-url", "origin", repo.clone_url)
+        return Git.check("remote", "set-url", "origin", repo.clone_url, cwd=repo_dir)
 
     def _update_existing(self, repo):
         logging.info("Updating repository '%s'", repo.name)
         repo_dir = self.get_repo_dir(repo)
-        with chdir(repo_dir):
-            with Git.setup_auth(repo):
-                return Git.check("remote", "update", "--prune")
+        return Git.check(
+            "remote",
+            "update",
+            "--prune",
+            cwd=repo_dir,
+            env=Git.auth_env(repo, self.git_env),
+            timeout=self.fetch_timeout,
+        )
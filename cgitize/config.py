@@ -4,15 +4,24 @@
 # Distributed under the MIT License.
 
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
+import logging
 import os
+import threading
 from urllib.parse import quote
 
 import tomli
 
 from cgitize.bitbucket import Bitbucket
 from cgitize.github import GitHub
+from cgitize.git import GIT_ENV, ConnectionLimiter, RefFilter, SSHMultiplexer
 from cgitize.gitlab import GitLab
-from cgitize.repo import Repo, Visibility
+from cgitize.maintenance import Maintenance
+from cgitize.pool import UpdatePool
+from cgitize.repo import Origin, Repo, Visibility
+from cgitize.session import RateLimiter, ResponseCache, connection_stats
+from cgitize.trace import span
+from cgitize.utils import iterate_concurrently
 
 
 class Section:
@@ -39,6 +48,8 @@ class Section:
 
 class MainSection(Section):
     DEFAULT_OUTPUT_DIR = "/mnt/cgitize"
+    DEFAULT_CLONE_TIMEOUT = 2 * 60 * 60
+    DEFAULT_FETCH_TIMEOUT = 30 * 60
 
     @property
     def output_dir(self):
@@ -46,10 +57,64 @@ class MainSection(Section):
             "output_dir", default=MainSection.DEFAULT_OUTPUT_DIR
         )
 
+    @property
+    def state_dir(self):
+        return self._get_config_path(
+            "state_dir", default=os.path.join(self.output_dir, ".cgitize")
+        )
+
+    @property
+    def api_cache_dir(self):
+        return self._get_config_path(
+            "api_cache_dir", default=os.path.join(self.state_dir, "api-cache")
+        )
+
+    @property
+    def api_cache_max_age(self):
+        return self._get_config_value(
+            "api_cache_max_age", default=ResponseCache.DEFAULT_MAX_AGE
+        )
+
+    @property
+    def api_max_wait(self):
+        return self._get_config_value(
+            "api_max_wait", default=RateLimiter.DEFAULT_MAX_WAIT
+        )
+
     @property
     def error_header_path(self):
         return os.path.join(self.output_dir, "error.html")
 
+    @property
+    def object_pools(self):
+        return self._get_config_value("object_pools", default=False)
+
+    @property
+    def object_pools_dir(self):
+        return self._get_config_path(
+            "object_pools_dir", default=os.path.join(self.state_dir, "pools")
+        )
+
+    @property
+    def seed(self):
+        seed = self._get_config_value("seed", required=False)
+        if seed is None or "://" in seed:
+            return seed
+        return os.path.abspath(seed)
+
+    @property
+    def repo_list_path(self):
+        return self._get_config_path(
+            "repo_list_path", default=os.path.join(self.output_dir, "cgitrepos")
+        )
+
+    @property
+    def metrics_path(self):
+        path = self._get_config_value("metrics_path", required=False)
+        if path is None:
+            return None
+        return os.path.abspath(path)
+
     @property
     def clone_url(self):
         return self._get_config_value("clone_url", required=False)
@@ -62,6 +127,113 @@ class MainSection(Section):
     def default_owner(self):
         return self._get_config_value("owner", required=False)
 
+    @property
+    def clone_timeout(self):
+        return self._get_timeout("clone_timeout", MainSection.DEFAULT_CLONE_TIMEOUT)
+
+    @property
+    def fetch_timeout(self):
+        return self._get_timeout("fetch_timeout", MainSection.DEFAULT_FETCH_TIMEOUT)
+
+    @property
+    def deadline(self):
+        return self._get_timeout("deadline", 0)
+
+    def _get_timeout(self, key, default):
+        # 0 means no timeout.
+        return self._get_config_value(key, default=default) or None
+
+    @property
+    def jobs(self):
+        return self._get_config_value("jobs", default=UpdatePool.DEFAULT_JOBS)
+
+
+class MaintenanceSection(Section):
+    @property
+    def enabled(self):
+        return self._get_config_value("enabled", default=False)
+
+    @property
+    def time_budget(self):
+        return self._get_config_value(
+            "time_budget", default=Maintenance.DEFAULT_TIME_BUDGET
+        )
+
+    @property
+    def max_packs(self):
+        return self._get_config_value(
+            "max_packs", default=Maintenance.DEFAULT_MAX_PACKS
+        )
+
+    @property
+    def max_loose_objects(self):
+        return self._get_config_value(
+            "max_loose_objects", default=Maintenance.DEFAULT_MAX_LOOSE_OBJECTS
+        )
+
+
+class ConnectionsSection(Section):
+    @property
+    def max_per_host(self):
+        # 0 means no limit.
+        return self._get_config_value(
+            "max_per_host", default=ConnectionLimiter.DEFAULT_MAX_PER_HOST
+        )
+
+    @property
+    def hosts(self):
+        return self._get_config_value("hosts", default={})
+
+    @property
+    def ssh_multiplexing(self):
+        return self._get_config_value("ssh_multiplexing", default=True)
+
+    @property
+    def ssh_control_persist(self):
+        return self._get_config_value(
+            "ssh_control_persist", default=SSHMultiplexer.DEFAULT_CONTROL_PERSIST
+        )
+
+
+class DaemonSection(Section):
+    DEFAULT_REFRESH_INTERVAL = 15 * 60
+    DEFAULT_UPDATE_INTERVAL = 60 * 60
+    DEFAULT_WEBHOOK_ADDRESS = "127.0.0.1"
+    DEFAULT_METRICS_ADDRESS = "127.0.0.1"
+
+    @property
+    def refresh_interval(self):
+        return self._get_config_value(
+            "refresh_interval", default=DaemonSection.DEFAULT_REFRESH_INTERVAL
+        )
+
+    @property
+    def update_interval(self):
+        return self._get_config_value(
+            "update_interval", default=DaemonSection.DEFAULT_UPDATE_INTERVAL
+        )
+
+    @property
+    def webhook_address(self):
+        return self._get_config_value(
+            "webhook_address", default=DaemonSection.DEFAULT_WEBHOOK_ADDRESS
+        )
+
+    @property
+    def webhook_port(self):
+        # The webhook listener is disabled unless the port is set.
+        return self._get_config_value("webhook_port", required=False)
+
+    @property
+    def metrics_address(self):
+        return self._get_config_value(
+            "metrics_address", default=DaemonSection.DEFAULT_METRICS_ADDRESS
+        )
+
+    @property
+    def metrics_port(self):
+        return self._get_config_value("metrics_port", required=False)
+
 
 class ServiceSection(Section, ABC):
     def __init__(self, impl):
@@ -69,34 +241,94 @@ class ServiceSection(Section, ABC):
         self.repositories = RepositoriesSection(self.impl.get("repositories", {}))
         self.users = UsersSection(self.impl.get("users", {}))
 
-    def _enum_explicit_repositories(self, cfg, api):
-        for r in self.repositories.enum_repositories():
-            r = HostedRepo(r)
-            yield api.convert_repo(api.get_repo(r), cfg, r.dir)
+    def _enum_explicit_repositories(self, cfg, api, repos=None):
+        if repos is None:
+            repos = [
+                HostedRepo(r, key) for key, r in self.repositories.enum_repositories()
+            ]
+        for r, src in api.get_repos(repos):
+            refs = self._get_ref_filter(cfg, r)
+            origin = Origin(self.PROVIDER, "repository", r.key, r.id)
+            with span(r.id, "convert"):
+                repo = api.convert_repo(
+                    src, cfg, r.dir, pool=r.pool, refs=refs, origin=origin
+                )
+            yield repo
 
-    def _enum_user_repositories(self, cfg, api, user):
-        visibility = Visibility.from_config(user.public_repos, user.private_repos)
-        for r in api.get_user_repos(user, visibility=visibility):
-            r = api.convert_repo(r, cfg, user.dir)
-            if r.name in user.skip:
+    def _convert_owned_repositories(self, cfg, api, owner, kind, repos):
+        # The repositories of a user or an organization.
+        refs = self._get_ref_filter(cfg, owner)
+        for src in repos:
+            origin = Origin(self.PROVIDER, kind, owner.key, api.get_repo_id(src))
+            with span(owner.name, "convert"):
+                r = api.convert_repo(src, cfg, owner.dir, refs=refs, origin=origin)
+            if r.name in owner.skip:
                 continue
             yield r
 
-    def _sort_repos(self, repos):
-        return sorted(repos, key=lambda repo: repo.name)
+    def _enum_user_repositories(self, cfg, api, user):
+        visibility = Visibility.from_config(user.public_repos, user.private_repos)
+        repos = api.get_user_repos(user, visibility=visibility)
+        yield from self._convert_owned_repositories(cfg, api, user, "user", repos)
+
+    @property
+    def base_url(self):
+        # The API root, for self-hosted instances (the public one by default).
+        return self._get_config_value("base_url", required=False)
+
+    @property
+    def webhook_secret(self):
+        return self._get_config_or_env(
+            "webhook_secret", f"CGITIZE_{self.PROVIDER.upper()}_WEBHOOK_SECRET"
+        )
+
+    def _get_ref_filter(self, cfg, entity):
+        return RefFilter.from_config(entity._impl, self.impl, cfg.main.impl)
 
     def enum_repositories(self, cfg):
-        api = self.connect_to_service()
-        yield from self._sort_repos(self._enum_explicit_repositories(cfg, api))
+        # The repositories are yielded as soon as they're fetched, in no
+        # particular order.
+        api = self.connect_to_service(cfg)
+        yield from self._enum_explicit_repositories(cfg, api)
         for u in self.users.enum_users():
-            yield from self._sort_repos(self._enum_user_repositories(cfg, api, u))
+            yield from self._enum_user_repositories(cfg, api, u)
+
+    def _get_owner(self, kind, key):
+        if kind == "user":
+            return self.users.get_user(key)
+        return None
+
+    def get_repository(self, cfg, origin):
+        # Fetches a single repository found earlier, using a single API request.
+        # Returns None if the config entry that listed it is gone.
+        api = self.connect_to_service(cfg)
+        if origin.kind == "repository":
+            r = self.repositories.get_repository(origin.key)
+            if r is None:
+                return None
+            repos = [HostedRepo(r, origin.key)]
+            return next(self._enum_explicit_repositories(cfg, api, repos))
+        owner = self._get_owner(origin.kind, origin.key)
+        if owner is None:
+            return None
+        _, src = next(api.get_repos([HostedRepo({"id": origin.id})]))
+        repos = self._convert_owned_repositories(cfg, api, owner, origin.kind, [src])
+        return next(repos, None)
+
+    def connect_to_service(self, cfg):
+        # The client (and so its HTTP session) is shared for the whole run
+        # between users, organizations, explicit repositories, etc.
+        key = (self.PROVIDER, self.username, self.token)
+        return cfg.clients.get(key, lambda: self._connect(cfg))
 
     @abstractmethod
-    def connect_to_service(self):
+    def _connect(self, cfg):
         pass
 
 
 class GitHubSection(ServiceSection):
+    PROVIDER = "github"
+
     def __init__(self, impl):
         super().__init__(impl)
         self.orgs = OrgsSection(self.impl.get("organizations", {}))
@@ -114,29 +346,41 @@ class GitHubSection(ServiceSection):
         return (self.token, None)
 
     def _enum_org_repositories(self, cfg, api, org):
-        for repo in api.get_org_repos(org):
-            repo = api.convert_repo(repo, cfg, org.dir)
-            if repo.name in org.skip:
-                continue
-            yield repo
+        repos = api.get_org_repos(org)
+        yield from self._convert_owned_repositories(
+            cfg, api, org, "organization", repos
+        )
+
+    def _get_owner(self, kind, key):
+        if kind == "organization":
+            return self.orgs.get_org(key)
+        return super()._get_owner(kind, key)
 
     def enum_repositories(self, cfg):
         yield from super().enum_repositories(cfg)
-        api = self.connect_to_service()
+        api = self.connect_to_service(cfg)
         for org in self.orgs.enum_orgs():
-            yield from self._sort_repos(self._enum_org_repositories(cfg, api, org))
+            yield from self._enum_org_repositories(cfg, api, org)
 
-    def connect_to_service(self):
+    def _connect(self, cfg):
         username = self.username
         token = self.token
         if (username is None) != (token is None):
             raise RuntimeError(
                 "please set either both the GitHub username & token, or neither"
             )
-        return GitHub(username, token)
+        return GitHub(
+            username,
+            token,
+            cache=cfg.api_cache,
+            limiter=cfg.make_rate_limiter(),
+            base_url=self.base_url,
+        )
 
 
 class BitbucketSection(ServiceSection):
+    PROVIDER = "bitbucket"
+
     @property
     def token(self):
         return self._get_config_or_env("token", "CGITIZE_BITBUCKET_TOKEN")
@@ -149,17 +393,25 @@ class BitbucketSection(ServiceSection):
     def url_auth(self):
         return (self.username, self.token)
 
-    def connect_to_service(self):
+    def _connect(self, cfg):
         username = self.username
         token = self.token
         if (username is None) != (token is None):
             raise RuntimeError(
                 "please set either both the Bitbucket username & token, or neither"
             )
-        return Bitbucket(username, token)
+        return Bitbucket(
+            username,
+            token,
+            cache=cfg.api_cache,
+            limiter=cfg.make_rate_limiter(),
+            base_url=self.base_url,
+        )
 
 
 class GitLabSection(ServiceSection):
+    PROVIDER = "gitlab"
+
     @property
     def token(self):
         return self._get_config_or_env("token", "CGITIZE_GITLAB_TOKEN")
@@ -172,29 +424,48 @@ class GitLabSection(ServiceSection):
     def url_auth(self):
         return (self.username, self.token)
 
-    def connect_to_service(self):
+    def _connect(self, cfg):
         username = self.username
         token = self.token
         if (username is None) != (token is None):
             raise RuntimeError(
                 "please set either both the GitLab username & token, or neither"
             )
-        return GitLab(token)
+        return GitLab(
+            token,
+            cache=cfg.api_cache,
+            limiter=cfg.make_rate_limiter(),
+            base_url=self.base_url,
+        )
 
 
 class UsersSection(Section):
     def enum_users(self):
-        return map(User, self.impl.values())
+        return [User(impl, key) for key, impl in self.impl.items()]
+
+    def get_user(self, key):
+        if key not in self.impl:
+            return None
+        return User(self.impl[key], key)
 
 
 class OrgsSection(Section):
     def enum_orgs(self):
-        return map(Org, self.impl.values())
+        return [Org(impl, key) for key, impl in self.impl.items()]
+
+    def get_org(self, key):
+        if key not in self.impl:
+            return None
+        return Org(self.impl[key], key)
 
 
 class RepositoriesSection(Section):
     def enum_repositories(self):
-        return self.impl.values()
+        # Yields (key, repository) pairs.
+        return self.impl.items()
+
+    def get_repository(self, key):
+        return self.impl.get(key)
 
 
 class Entity(ABC):
@@ -212,10 +483,11 @@ class Entity(ABC):
 
 
 class User(Entity):
-    def __init__(self, impl):
+    def __init__(self, impl, key=None):
         if "name" not in impl:
             raise ValueError("every user must have a 'name'")
         self._impl = impl
+        self.key = key
 
     @property
     def public_repos(self):
@@ -227,17 +499,19 @@ class User(Entity):
 
 
 class Org(Entity):
-    def __init__(self, impl):
+    def __init__(self, impl, key=None):
         if "name" not in impl:
             raise ValueError("every organization must have a 'name'")
         self._impl = impl
+        self.key = key
 
 
 class HostedRepo:
-    def __init__(self, impl):
+    def __init__(self, impl, key=None):
         if "id" not in impl:
             raise ValueError("every hosted repository must have 'id'")
         self._impl = impl
+        self.key = key
 
     @property
     def id(self):
@@ -247,6 +521,61 @@ class HostedRepo:
     def dir(self):
         return self._impl.get("dir")
 
+    @property
+    def pool(self):
+        return self._impl.get("pool")
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._clients = {}
+        # Connecting can take a while (authentication, etc.), so every key
+        # gets its own lock: a slow provider mustn't block the others.
+        self._connect_locks = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _get_existing(self, key):
+        with self._lock:
+            if key in self._clients:
+                self.reused += 1
+                return self._clients[key]
+            return None
+
+    def get(self, key, connect):
+        client = self._get_existing(key)
+        if client is not None:
+            return client
+        with self._lock:
+            connect_lock = self._connect_locks.setdefault(key, threading.Lock())
+        with connect_lock:
+            # Another thread might've connected in the meantime.
+            client = self._get_existing(key)
+            if client is not None:
+                return client
+            client = connect()
+            with self._lock:
+                self._clients[key] = client
+                self.created += 1
+            return client
+
+    def log_stats(self):
+        logging.info("API clients: %d created, %d reused", self.created, self.reused)
+        with self._lock:
+            clients = list(self._clients.items())
+        for (provider, username, _), client in clients:
+            name = provider if username is None else f"{provider}, {username}"
+            requests, connections = connection_stats(client.session)
+            logging.info(
+                "API connections (%s): %d request(s) over %d connection(s)",
+                name,
+                requests,
+                connections,
+            )
+            if client.limiter is not None:
+                client.limiter.log_stats(name)
+
 
 class Config:
     DEFAULT_PATH = "/etc/cgitize/cgitize.toml"
@@ -260,17 +589,83 @@ class Config:
         with open(self.path, "rb") as f:
             self.impl = tomli.load(f)
         self.main = MainSection(self.impl)
+        self.maintenance = MaintenanceSection(self.impl.get("maintenance", {}))
+        self.connections = ConnectionsSection(self.impl.get("connections", {}))
+        self.daemon = DaemonSection(self.impl.get("daemon", {}))
         self.repositories = RepositoriesSection(self.impl.get("repositories", {}))
         self.github = GitHubSection(self.impl.get("github", {}))
         self.bitbucket = BitbucketSection(self.impl.get("bitbucket", {}))
         self.gitlab = GitLabSection(self.impl.get("gitlab", {}))
+        self._api_cache = None
+        self._api_cache_lock = threading.Lock()
+        self.clients = ClientRegistry()
+
+    @property
+    def api_cache(self):
+        max_age = self.main.api_cache_max_age
+        if not max_age:
+            return None
+        with self._api_cache_lock:
+            if self._api_cache is None:
+                self._api_cache = ResponseCache(self.main.api_cache_dir, max_age)
+            return self._api_cache
+
+    def make_rate_limiter(self):
+        # Every client gets its own limiter: the quotas are per credentials.
+        return RateLimiter(self.main.api_max_wait)
+
+    def make_maintenance(self):
+        if not self.maintenance.enabled:
+            return None
+        return Maintenance(
+            time_budget=self.maintenance.time_budget,
+            max_packs=self.maintenance.max_packs,
+            max_loose_objects=self.maintenance.max_loose_objects,
+        )
+
+    def make_connection_limiter(self):
+        return ConnectionLimiter(
+            max_per_host=self.connections.max_per_host,
+            hosts=self.connections.hosts,
+        )
+
+    def make_ssh_multiplexer(self):
+        # Returns a context manager, which provides the environment to run
+        # the git processes with.
+        if not self.connections.ssh_multiplexing:
+            return nullcontext(GIT_ENV)
+        return SSHMultiplexer(self.connections.ssh_control_persist)
 
     def _parse_explicit_repositories(self):
-        for r in self.repositories.enum_repositories():
-            yield Repo.from_config(r, self)
+        for key, r in self.repositories.enum_repositories():
+            yield Repo.from_config(r, self, origin=Origin("config", "repository", key))
 
     def parse_repositories(self):
-        yield from self._parse_explicit_repositories()
-        yield from self.github.enum_repositories(self)
-        yield from self.bitbucket.enum_repositories(self)
-        yield from self.gitlab.enum_repositories(self)
+        # The providers are queried concurrently, and the repositories are
+        # yielded as soon as they're discovered, so that they can be updated
+        # while the rest of them are still being fetched.
+        yield from iterate_concurrently(
+            [
+                ("config", self._parse_explicit_repositories()),
+                ("github", self.github.enum_repositories(self)),
+                ("bitbucket", self.bitbucket.enum_repositories(self)),
+                ("gitlab", self.gitlab.enum_repositories(self)),
+            ]
+        )
+
+    def get_repository(self, origin):
+        # Finds a single repository using its origin, without enumerating
+        # everything. Returns None if the config no longer lists it.
+        if origin.provider == "config":
+            r = self.repositories.get_repository(origin.key)
+            if r is None:
+                return None
+            return Repo.from_config(r, self, origin=origin)
+        sections = {
+            "github": self.github,
+            "bitbucket": self.bitbucket,
+            "gitlab": self.gitlab,
+        }
+        if origin.provider not in sections:
+            return None
+        return sections[origin.provider].get_repository(self, origin)
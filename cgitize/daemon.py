@@ -0,0 +1,456 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import signal
+import sys
+import threading
+import time
+
+from cgitize.cgit import CGitRepositories, CGitServer
+from cgitize.config import Config
+from cgitize.git import GIT_ENV
+from cgitize.header import update as update_header
+from cgitize.metrics import REGISTRY, MetricsServer
+from cgitize.pools import ObjectPools
+from cgitize.state import State
+from cgitize.utils import log_tag, setup_logging
+from cgitize.webhooks import WebhookServer, get_url_key
+
+
+class Daemon:
+    # Stays resident & keeps the repositories up to date. The provider
+    # listings are refreshed every refresh_interval seconds using the same
+    # API clients (and so the same HTTP sessions & rate limit info). Every
+    # repository has its own schedule: it's updated as soon as it's
+    # discovered or changes upstream, and then every update_interval seconds.
+    # Failed updates are retried sooner, backing off up to update_interval.
+    # If the webhook listener is enabled, a push to a repository makes the
+    # daemon update it right away.
+
+    FIRST_RETRY = 5 * 60
+
+    # The repository list is rewritten at most this often while the
+    # repositories are being updated.
+    LIST_WRITE_INTERVAL = 60
+
+    # A push is followed by an update after this many seconds, so that a
+    # burst of pushes only causes a single update.
+    PUSH_DELAY = 5
+
+    def __init__(self, config_path, jobs=None, clock=time.monotonic):
+        self.config_path = config_path
+        self.config = Config.read(config_path)
+        self.jobs = jobs
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._reloading = False
+        self.output = None
+        # See SSHMultiplexer.
+        self.git_env = GIT_ENV
+        # Every repository that's been discovered, by their directory.
+        self.repos = {}
+        self._due = {}
+        self._failures = {}
+        self._running = set()
+        # Repositories that changed upstream while being updated.
+        self._rerun = set()
+        # Repositories that were pushed to, and so must be fetched even if
+        # the listings haven't caught up yet.
+        self._pushed = set()
+        # Repository directories by their URL keys (see get_url_key).
+        self._url_keys = {}
+        self.webhooks = None
+        self.metrics = None
+        self._refreshing = False
+        self._refresh_again = False
+        self._next_refresh = clock()
+        self._refresh_error = None
+        self._list_dirty = False
+        self._list_written_at = None
+        self.refreshes = 0
+        self.updates = 0
+        self.pushes = 0
+
+    def reload(self):
+        with self._lock:
+            self._reloading = True
+        self._wakeup.set()
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+        self._wakeup.set()
+
+    @property
+    def jobs_or_default(self):
+        if self.jobs is None:
+            return self.config.main.jobs
+        return self.jobs
+
+    def _make_output(self, config, state):
+        main = config.main
+        output = CGitRepositories(
+            main.output_dir,
+            CGitServer(main.clone_url),
+            state=state,
+            maintenance=config.make_maintenance(),
+            pools=ObjectPools(main.object_pools_dir),
+            seed=main.seed,
+            clone_timeout=main.clone_timeout,
+            fetch_timeout=main.fetch_timeout,
+            connections=config.make_connection_limiter(),
+            git_env=self.git_env,
+            metrics=config.daemon.metrics_port is not None,
+        )
+        # The existing mirrors are listed right away.
+        for repo in self.repos.values():
+            output.skip(repo)
+        return output
+
+    def _reload(self, state):
+        logging.info("Reloading configuration: %s", self.config_path)
+        try:
+            config = Config.read(self.config_path)
+        except Exception as e:
+            logging.error("Couldn't reload configuration: %s", e)
+            return
+        # The clients are keyed by their credentials, so they can be reused,
+        # unless the credentials were changed.
+        config.clients = self.config.clients
+        self.config = config
+        self.output = self._make_output(config, state)
+        self._list_dirty = True
+        # The repositories that were removed from the config are removed
+        # after the refresh. If one is running already, it uses the old
+        # config, so another one is started right after it.
+        self._refresh_again = self._refreshing
+        self._next_refresh = self._clock()
+
+    @staticmethod
+    def _get_key(repo):
+        # The repository is updated right away if any of these changes.
+        return (
+            repo.clone_url,
+            repo.pushed_at,
+            repo.desc,
+            repo.homepage,
+            repo.owner,
+            repo.pool,
+            repo.refs.refspecs,
+        )
+
+    @staticmethod
+    def _get_url_keys(repo):
+        # Bitbucket only sends the web page URL with its webhooks.
+        keys = {get_url_key(repo.clone_url), get_url_key(repo.homepage)}
+        keys.discard(None)
+        return keys
+
+    def _index(self, repo):
+        for key in self._get_url_keys(repo):
+            self._url_keys[key] = repo.dir
+
+    def _unindex(self, repo):
+        for key in self._get_url_keys(repo):
+            if self._url_keys.get(key) == repo.dir:
+                del self._url_keys[key]
+
+    def _discovered(self, repo):
+        old = self.repos.get(repo.dir)
+        self.repos[repo.dir] = repo
+        if old is not None and self._get_key(old) == self._get_key(repo):
+            return False
+        if old is not None:
+            self._unindex(old)
+        self._index(repo)
+        if old is None:
+            logging.info("New repository: %s", repo.url_path)
+            self.output.skip(repo)
+        else:
+            logging.info("Repository changed: %s", repo.url_path)
+        if repo.dir in self._running:
+            self._rerun.add(repo.dir)
+        else:
+            self._due[repo.dir] = self._clock()
+        return True
+
+    def _remove_missing(self, seen):
+        removed = [repo for dir, repo in self.repos.items() if dir not in seen]
+        for repo in removed:
+            # The mirror itself is left alone, same as in the regular runs.
+            logging.info("Repository removed: %s", repo.url_path)
+            del self.repos[repo.dir]
+            self._unindex(repo)
+            self._due.pop(repo.dir, None)
+            self._failures.pop(repo.dir, None)
+            self._rerun.discard(repo.dir)
+            self._pushed.discard(repo.dir)
+            self.output.repo_list.remove(repo)
+            REGISTRY.forget("repo", repo.url_path)
+        return len(removed)
+
+    def _refresh(self, config):
+        # Runs in a separate thread. New & changed repositories are scheduled
+        # as soon as they're enumerated.
+        seen = set()
+        changed = 0
+        error = None
+        try:
+            for repo in config.parse_repositories():
+                with self._lock:
+                    seen.add(repo.dir)
+                    if self._discovered(repo):
+                        changed += 1
+                        self._wakeup.set()
+        except Exception as e:
+            logging.exception(e)
+            error = e
+        with self._lock:
+            removed = 0
+            if error is None:
+                # If the enumeration failed, the repositories that weren't
+                # enumerated might still exist.
+                removed = self._remove_missing(seen)
+                # Keep the index up to date for `cgitize --repo`.
+                self.output.state.replace_sources(self.repos.values())
+            logging.info(
+                "Refreshed repository listings: %d repositories, %d new or changed, %d removed",
+                len(seen),
+                changed,
+                removed,
+            )
+            self._refresh_error = error
+            self._refreshing = False
+            self._list_dirty = True
+            if self._refresh_again:
+                self._refresh_again = False
+            else:
+                self._next_refresh = self._clock() + config.daemon.refresh_interval
+            self.refreshes += 1
+        config.clients.log_stats()
+        self._wakeup.set()
+
+    def _start_refresh(self):
+        self._refreshing = True
+        if self.output.maintenance is not None:
+            # Every refresh cycle gets its own maintenance time budget.
+            self.output.maintenance.log_stats()
+            self.output.maintenance = self.config.make_maintenance()
+        thread = threading.Thread(
+            target=self._refresh, args=(self.config,), name="refresh", daemon=True
+        )
+        thread.start()
+
+    def push(self, url_keys):
+        # Called by the webhook listener. Returns False if the repository is
+        # unknown.
+        with self._lock:
+            dirs = {self._url_keys[key] for key in url_keys if key in self._url_keys}
+            for dir in dirs:
+                logging.info("Pushed to: %s", self.repos[dir].url_path)
+                self.pushes += 1
+                self._pushed.add(dir)
+                if dir in self._running:
+                    # The pushes that arrive during an update cause a single
+                    # update after it's done.
+                    self._rerun.add(dir)
+                    continue
+                due = self._clock() + self.PUSH_DELAY
+                self._due[dir] = min(self._due.get(dir, due), due)
+        self._wakeup.set()
+        return bool(dirs)
+
+    def _get_secret(self, provider):
+        return getattr(self.config, provider).webhook_secret
+
+    def _start_webhooks(self):
+        port = self.config.daemon.webhook_port
+        if port is None:
+            return
+        self.webhooks = WebhookServer(
+            self.config.daemon.webhook_address, port, self._get_secret, self.push
+        )
+        self.webhooks.start()
+
+    def _start_metrics(self):
+        port = self.config.daemon.metrics_port
+        if port is None:
+            return
+        self.metrics = MetricsServer(self.config.daemon.metrics_address, port)
+        self.metrics.start()
+
+    def _get_retry_interval(self, failures):
+        interval = self.config.daemon.update_interval
+        if not failures:
+            return interval
+        return min(interval, self.FIRST_RETRY * 2 ** (failures - 1))
+
+    def _update(self, output, repo, full):
+        with log_tag(repo.url_path):
+            try:
+                success = output.update(repo, full=full)
+            except Exception as e:
+                logging.exception(e)
+                success = False
+        with self._lock:
+            self._running.discard(repo.dir)
+            self.updates += 1
+            self._list_dirty = True
+            if self.repos.get(repo.dir) is not None:
+                if success:
+                    self._failures.pop(repo.dir, None)
+                else:
+                    self._failures[repo.dir] = self._failures.get(repo.dir, 0) + 1
+                if repo.dir in self._rerun:
+                    self._rerun.discard(repo.dir)
+                    self._due[repo.dir] = self._clock()
+                else:
+                    interval = self._get_retry_interval(self._failures.get(repo.dir))
+                    self._due[repo.dir] = self._clock() + interval
+        self._wakeup.set()
+
+    def _write_status(self, force=False):
+        now = self._clock()
+        if not self._list_dirty:
+            return
+        if not force and self._list_written_at is not None:
+            if now - self._list_written_at < self.LIST_WRITE_INTERVAL:
+                return
+        self._list_dirty = False
+        self._list_written_at = now
+        self.output.repo_list.write(self.config.main.repo_list_path)
+        failed = sorted(
+            self.repos[dir].url_path for dir in self._failures if dir in self.repos
+        )
+        error = self._refresh_error
+        update_header(
+            self.config.main.error_header_path,
+            not failed and error is None,
+            error,
+            failed,
+        )
+
+    def _get_estimate(self, dir):
+        estimate = self.output.estimate(self.repos[dir], full=dir in self._pushed)
+        if estimate is None:
+            return float("inf")
+        return estimate
+
+    def _schedule(self, executor):
+        # Submits the updates that are due, and returns the number of seconds
+        # until the next thing to do.
+        now = self._clock()
+        if not self._refreshing and now >= self._next_refresh:
+            self._start_refresh()
+        due = [dir for dir, t in self._due.items() if t <= now]
+        # The longest updates first, like in the regular runs.
+        due.sort(key=self._get_estimate, reverse=True)
+        for dir in due:
+            del self._due[dir]
+            self._running.add(dir)
+            full = dir in self._pushed
+            self._pushed.discard(dir)
+            executor.submit(self._update, self.output, self.repos[dir], full)
+        # Write the list as soon as everything's done, and periodically while
+        # the updates are still running.
+        self._write_status(force=not self._refreshing and not self._running)
+        timeouts = []
+        if not self._refreshing:
+            timeouts.append(self._next_refresh - now)
+        if self._due:
+            timeouts.append(min(self._due.values()) - now)
+        if self._list_dirty:
+            timeouts.append(self.LIST_WRITE_INTERVAL)
+        return min(timeouts, default=None)
+
+    def run(self):
+        logging.info("Starting cgitize daemon")
+        # Changes to the SSH multiplexing settings require a restart.
+        with self.config.make_ssh_multiplexer() as git_env:
+            self.git_env = git_env
+            self._run()
+        logging.info("Stopped cgitize daemon")
+
+    def _run(self):
+        with State.open(self.config.main.state_dir) as state:
+            self.output = self._make_output(self.config, state)
+            self._start_webhooks()
+            self._start_metrics()
+            with ThreadPoolExecutor(
+                max_workers=self.jobs_or_default, thread_name_prefix="cgitize"
+            ) as executor:
+                while True:
+                    self._wakeup.clear()
+                    with self._lock:
+                        if self._stopping:
+                            break
+                        if self._reloading:
+                            self._reloading = False
+                            self._reload(state)
+                        timeout = self._schedule(executor)
+                    if timeout is not None:
+                        timeout = max(0, timeout)
+                    self._wakeup.wait(timeout)
+                logging.info("Stopping, waiting for the running updates to finish")
+                if self.webhooks is not None:
+                    self.webhooks.stop()
+                if self.metrics is not None:
+                    self.metrics.stop()
+                executor.shutdown(wait=True, cancel_futures=True)
+            with self._lock:
+                self._write_status(force=True)
+
+
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = ArgumentParser(prog="cgitize daemon")
+    parser.add_argument(
+        "--config",
+        "-c",
+        metavar="PATH",
+        default=Config.DEFAULT_PATH,
+        help="config file path",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        metavar="N",
+        type=int,
+        help="number of repositories to update in parallel",
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="verbose log output"
+    )
+    return parser.parse_args(argv)
+
+
+def _on_signal(action):
+    # The handlers run in the main thread, possibly while it's holding the
+    # daemon's lock, so the actual work is done in a separate thread.
+    def handler(signum, frame):
+        threading.Thread(target=action, daemon=True).start()
+
+    return handler
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with setup_logging(args.verbose):
+        daemon = Daemon(args.config, jobs=args.jobs)
+        signal.signal(signal.SIGHUP, _on_signal(daemon.reload))
+        signal.signal(signal.SIGTERM, _on_signal(daemon.stop))
+        signal.signal(signal.SIGINT, _on_signal(daemon.stop))
+        daemon.run()
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
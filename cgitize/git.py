@@ -4,175 +4,242 @@
 # Distributed under the MIT License.
 
 from contextlib import contextmanager
+import hashlib
+import logging
 import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
 
 from cgitize import utils
 
+SSH_COMMAND = "ssh -oBatchMode=yes -oLogLevel=QUIET -oStrictHostKeyChecking=no -oUserKnownHostsFile=/dev/null"
+
 GIT_ENV = os.environ.copy()
-GIT_ENV["GIT_SSH_COMMAND"] = (
-    "ssh -oBatchMode=yes -oLogLevel=QUIET -oStrictHostKeyChecking=no -oUserKnownHostsFile=/dev/null"
-)
+GIT_ENV["GIT_SSH_COMMAND"] = SSH_COMMAND
 
 
-class Config:
-    def __init__(self, path):
-        self.path = path
+class Git:
+    EXE = "git"
 
-    def exists(self):
-        return os.path.exists(self.path)
+    @staticmethod
+    def check(*args, env=GIT_ENV, **kwargs):
+        return utils.try_run(Git.EXE, *args, env=env, **kwargs)
 
-    def open(self, mode="r"):
-        return open(self.path, mode=mode, encoding="utf-8")
+    @staticmethod
+    def capture(*args, env=GIT_ENV, **kwargs):
+        return utils.try_capture(Git.EXE, *args, env=env, **kwargs)
 
-    def read(self):
-        with self.open(mode="r") as fd:
-            return fd.read()
+    @staticmethod
+    def auth_env(repo, env=GIT_ENV):
+        # The credentials are passed to a single git process using the
+        # GIT_CONFIG_COUNT/GIT_CONFIG_KEY_<n>/GIT_CONFIG_VALUE_<n> environment
+        # variables (see git-config(1)). This way, they are never written to
+        # disk, don't show up on the command line, and git processes using
+        # different credentials can run in parallel.
+        if not repo.url_auth:
+            return env
+        env = env.copy()
+        n = int(env.get("GIT_CONFIG_COUNT", 0))
+        env[f"GIT_CONFIG_KEY_{n}"] = f"url.{repo.clone_url_with_auth}.insteadOf"
+        env[f"GIT_CONFIG_VALUE_{n}"] = repo.clone_url
+        env["GIT_CONFIG_COUNT"] = str(n + 1)
+        return env
 
-    def write(self, contents):
-        with self.open(mode="w") as fd:
-            fd.write(contents)
+    @staticmethod
+    def hash_refs(repo_dir):
+        # Hash the refs as they're stored on disk, which is a lot cheaper than
+        # spawning `git for-each-ref`. The hash changes whenever any of the
+        # refs is updated.
+        h = hashlib.sha1()
+
+        def add_file(path):
+            try:
+                with open(path, "rb") as fd:
+                    contents = fd.read()
+            except FileNotFoundError:
+                return
+            h.update(os.path.relpath(path, repo_dir).encode())
+            h.update(b"\0")
+            h.update(contents)
+
+        add_file(os.path.join(repo_dir, "packed-refs"))
+        for root, dirs, files in os.walk(os.path.join(repo_dir, "refs")):
+            dirs.sort()
+            for name in sorted(files):
+                add_file(os.path.join(root, name))
+        return h.hexdigest()
+
+
+class SSHMultiplexer:
+    # Makes the git processes connecting to the same host over SSH share a
+    # single connection (see ControlMaster in ssh_config(5)), which saves a
+    # handshake per repository. The control sockets are kept in a temporary
+    # directory, and the master connections are closed when the run ends.
+    # The git processes must be run using the environment returned by
+    # start().
+
+    DEFAULT_CONTROL_PERSIST = 60
+
+    def __init__(self, control_persist=DEFAULT_CONTROL_PERSIST):
+        # An idle master connection exits after this many seconds.
+        self.control_persist = control_persist
+        self.dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def ssh_command(self):
+        # %C is a hash of the connection parameters: the socket paths are
+        # limited to ~100 characters.
+        control_path = os.path.join(self.dir, "%C")
+        return " ".join(
+            [
+                SSH_COMMAND,
+                "-oControlMaster=auto",
+                shlex.quote(f"-oControlPath={control_path}"),
+                f"-oControlPersist={self.control_persist}",
+            ]
+        )
+
+    def start(self):
+        self.dir = tempfile.mkdtemp(prefix="cgitize-ssh-")
+        logging.debug("SSH control sockets directory: %s", self.dir)
+        env = GIT_ENV.copy()
+        env["GIT_SSH_COMMAND"] = self.ssh_command
+        return env
+
+    def stop(self):
+        if self.dir is None:
+            return
+        dir, self.dir = self.dir, None
+        for name in os.listdir(dir):
+            self._exit(os.path.join(dir, name))
+        shutil.rmtree(dir, ignore_errors=True)
+
+    @staticmethod
+    def _exit(control_path):
+        # Asks the master to close the connection & exit. The host name is
+        # required, but isn't used.
+        args = ["ssh", f"-oControlPath={control_path}", "-Oexit", "cgitize"]
+        try:
+            subprocess.run(
+                args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=10,
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.warning("Couldn't stop SSH master %s: %s", control_path, e)
+
+
+class ConnectionLimiter:
+    # Caps the number of git processes talking to the same host at a time.
+    # OpenSSH servers only allow 10 sessions over a multiplexed connection by
+    # default (see MaxSessions in sshd_config(5)), and big hosts throttle
+    # clients opening too many connections.
+
+    DEFAULT_MAX_PER_HOST = 8
+
+    def __init__(self, max_per_host=None, hosts=None):
+        # None or 0 means no limit.
+        self.max_per_host = max_per_host
+        self.hosts = {host.lower(): n for host, n in (hosts or {}).items()}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _get_semaphore(self, host):
+        limit = self.hosts.get(host, self.max_per_host)
+        if not limit:
+            return None
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(limit)
+            return self._semaphores[host]
 
     @contextmanager
-    def backup(self):
-        old_contents = self.read()
+    def connect(self, url):
+        host = utils.url_get_host(url)
+        semaphore = None if host is None else self._get_semaphore(host)
+        if semaphore is None:
+            yield
+            return
+        if not semaphore.acquire(blocking=False):
+            logging.debug("Waiting for a connection slot to %s", host)
+            semaphore.acquire()
         try:
-            yield old_contents
+            yield
         finally:
-            self.write(old_contents)
-
-    # What follows is an exteremely loose interpretation of what the .gitconfig
-    # syntax is. The source was git-config(1).
-
-    class Section:
-        def __init__(self, name, variables):
-            Config.Section.validate_name(name)
-            self.name = name
-            self.variables = variables
-
-        @staticmethod
-        def validate_name(name):
-            if not name:
-                raise RuntimeError("section names cannot be empty")
-            for c in name:
-                if c.isalnum() or c == "-" or c == ".":
-                    continue
-                raise RuntimeError(
-                    f"section names must only contain alphanumeric characters, . or -: {name}"
-                )
-
-        @staticmethod
-        def format_name(name):
-            return name
-
-        def format(self):
-            result = f"[{self.format_name(self.name)}]\n"
-            result += "".join((var.format() for var in self.variables))
-            return result
-
-    class Subsection:
-        def __init__(self, section, name, variables):
-            Config.Section.validate_name(section)
-            Config.Subsection.validate_name(name)
-            self.section = section
-            self.name = name
-            self.variables = variables
-
-        @staticmethod
-        def validate_name(name):
-            if "\n" in name:
-                raise RuntimeError(f"subsection names cannot contain newlines: {name}")
-
-        def format_name(self):
-            name = self.name
-            # Escape the backslashes:
-            name = name.replace("\\", r"\\")
-            # Escape the quotes:
-            name = name.replace('"', r"\"")
-            # Put in quotes:
-            return f'"{name}"'
-
-        def format(self):
-            result = (
-                f"[{Config.Section.format_name(self.section)} {self.format_name()}]\n"
-            )
-            result += "".join((var.format() for var in self.variables))
-            return result
-
-    class Variable:
-        def __init__(self, name, value):
-            Config.Variable.validate_name(name)
-            Config.Variable.validate_value(value)
-            self.name = name
-            self.value = value
-
-        @staticmethod
-        def validate_name(name):
-            if not name:
-                raise RuntimeError("variable names cannot be empty")
-            for c in name:
-                if c.isalnum() or c == "-":
-                    continue
-                raise RuntimeError(
-                    f"variable name can only contain alphanumeric characters or -: {name}"
-                )
-            if not name[0].isalnum():
-                raise RuntimeError(
-                    f"variable name must start with an alphanumeric character: {name}"
-                )
-
-        @staticmethod
-        def validate_value(value):
-            pass
-
-        def format_name(self):
-            return self.name
-
-        def format_value(self):
-            value = self.value
-            # Escape the backslashes:
-            value = value.replace("\\", r"\\")
-            # Escape the supported escape sequences (\n, \t and \b):
-            value = value.replace("\n", r"\n")
-            value = value.replace("\t", r"\t")
-            value = value.replace("\b", r"\b")
-            # Escape the quotes:
-            value = value.replace('"', r"\"")
-            # Put in quotes:
-            value = f'"{value}"'
-            return value
-
-        def format(self):
-            return f"    {self.format_name()} = {self.format_value()}\n"
+            semaphore.release()
 
 
-class Git:
-    EXE = "git"
+class RefFilter:
+    # Selects the refs to mirror: the ones matching any of the include
+    # patterns, except for the ones matching any of the exclude patterns.
+    # The patterns are the same as in refspecs: a single '*' matches
+    # anything, including slashes. The filter is applied using refspecs
+    # (excludes become negative refspecs), so that the refs that are filtered
+    # out aren't even fetched.
 
-    @staticmethod
-    def check(*args, **kwargs):
-        return utils.try_run(Git.EXE, *args, env=GIT_ENV, **kwargs)
+    DEFAULT_INCLUDE = ("refs/*",)
 
     @staticmethod
-    def capture(*args, **kwargs):
-        return utils.try_capture(Git.EXE, *args, env=GIT_ENV, **kwargs)
+    def from_config(*impls):
+        # The most specific setting wins: pass the repository's settings
+        # first, then the user's/organization's, etc.
+        include = None
+        exclude = None
+        for impl in impls:
+            if include is None:
+                include = impl.get("refs")
+            if exclude is None:
+                exclude = impl.get("exclude_refs")
+        return RefFilter(include, exclude)
+
+    def __init__(self, include=None, exclude=None):
+        if include is None:
+            include = RefFilter.DEFAULT_INCLUDE
+        if exclude is None:
+            exclude = ()
+        for pattern in list(include) + list(exclude):
+            self._validate(pattern)
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
 
     @staticmethod
-    def get_global_config():
-        return Config(os.path.expanduser("~/.gitconfig"))
+    def _validate(pattern):
+        if not pattern.startswith("refs/"):
+            raise ValueError(f"ref pattern must start with 'refs/': {pattern}")
+        if pattern.count("*") > 1:
+            raise ValueError(f"ref pattern can't have multiple '*': {pattern}")
+
+    @property
+    def is_default(self):
+        return self.include == RefFilter.DEFAULT_INCLUDE and not self.exclude
+
+    @property
+    def refspecs(self):
+        return [f"+{p}:{p}" for p in self.include] + [f"^{p}" for p in self.exclude]
 
     @staticmethod
-    @contextmanager
-    def setup_auth(repo):
-        if not repo.url_auth:
-            yield
-            return
-        config = Git.get_global_config()
-        with utils.protected_file(config.path):
-            with config.backup() as old_contents:
-                variables = [Config.Variable("insteadOf", repo.clone_url)]
-                subsection = Config.Subsection(
-                    "url", repo.clone_url_with_auth, variables
-                )
-                new_contents = f"{old_contents}\n{subsection.format()}"
-                config.write(new_contents)
-                yield
+    def _match(pattern, ref):
+        if "*" not in pattern:
+            return pattern == ref
+        prefix, suffix = pattern.split("*")
+        return (
+            len(ref) >= len(prefix) + len(suffix)
+            and ref.startswith(prefix)
+            and ref.endswith(suffix)
+        )
+
+    def matches(self, ref):
+        return any(self._match(p, ref) for p in self.include) and not any(
+            self._match(p, ref) for p in self.exclude
+        )
@@ -3,20 +3,121 @@
 # For details, see https://github.com/egor-tensin/cgitize.
 # Distributed under the MIT License.
 
+from datetime import datetime
 import logging
+import threading
 
 from github import Auth, Github, GithubException
+from github.Requester import Requester
 
 from cgitize.repo import Repo, Visibility
+from cgitize.session import DEFAULT_RETRY, make_session
+
+
+class GraphQLOwner:
+    def __init__(self, data):
+        self.login = data["login"]
+        self.name = data.get("name")
+
+
+class GraphQLSource:
+    def __init__(self, data):
+        self.full_name = data["nameWithOwner"]
+
+
+class GraphQLRepository:
+    # Has the same attributes as PyGithub's Repository, at least the ones
+    # used by Repo.from_github.
+
+    FIELDS = """
+        name
+        nameWithOwner
+        description
+        url
+        sshUrl
+        pushedAt
+        isFork
+        diskUsage
+        parent { nameWithOwner }
+        owner {
+            login
+            ... on User { name }
+            ... on Organization { name }
+        }
+    """
+
+    def __init__(self, data):
+        self.name = data["name"]
+        self.full_name = data["nameWithOwner"]
+        self.description = data["description"]
+        self.html_url = data["url"]
+        self.clone_url = f"{data['url']}.git"
+        self.ssh_url = data["sshUrl"]
+        self.pushed_at = self._parse_timestamp(data["pushedAt"])
+        self.owner = GraphQLOwner(data["owner"])
+        self.fork = data["isFork"]
+        self.size = data.get("diskUsage")
+        # Unlike the REST API, GraphQL only has the immediate parent, not the
+        # root of the fork network. Forks of forks are rare enough though.
+        self.source = None
+        if data["parent"] is not None:
+            self.source = GraphQLSource(data["parent"])
+
+    @staticmethod
+    def _parse_timestamp(s):
+        if s is None:
+            return None
+        # Python 3.9 doesn't support the Z suffix.
+        return datetime.fromisoformat(s.replace("Z", "+00:00"))
 
 
 class GitHub:
-    def __init__(self, username, token):
+    # The number of repositories fetched using a single GraphQL query.
+    GRAPHQL_BATCH_SIZE = 100
+
+    def __init__(self, username, token, cache=None, limiter=None, base_url=None):
         self._username = username
+        self._authenticated = token is not None
+        # Owner login -> owner name. Listings only include the owners' logins,
+        # and getting the name of every one of them would cost a request per
+        # repository otherwise.
+        self._owners = {}
+        self._owners_lock = threading.Lock()
+        # Fork -> the forks listed in the same batch (see _list).
+        self._forks = {}
+        # Fork -> the repository it was forked from, fetched along with
+        # another fork from the same batch.
+        self._sources = {}
+        self._sources_lock = threading.Lock()
         auth = None
         if token is not None:
             auth = Auth.Token(token)
-        self._impl = Github(auth=auth)
+        kwargs = {}
+        if base_url is not None:
+            kwargs["base_url"] = base_url
+        self._impl = Github(auth=auth, **kwargs)
+        # PyGithub's default retry policy waits for the rate limit reset no
+        # matter how long it takes; RateLimiter takes care of that instead.
+        self.limiter = limiter
+        self.session = make_session(
+            cache, limiter, retry=DEFAULT_RETRY, provider="github"
+        )
+        self._use_session(self.session)
+
+    def _use_session(self, session):
+        # PyGithub doesn't allow passing a custom requests.Session, so the
+        # connection class of this particular instance is replaced with one
+        # that uses it.
+        session.auth = Requester.noopAuth
+        requester = self._impl.requester
+        base = requester._Requester__connectionClass
+
+        class Connection(base):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.session = session
+
+        requester._Requester__connectionClass = Connection
 
     def get_repo(self, repo):
         try:
@@ -25,6 +126,101 @@ class GitHub:
             logging.error("Couldn't fetch repository: %s", repo.id)
             raise
 
+    def get_repos(self, repos):
+        # The GraphQL API is only available to authenticated users.
+        if not self._authenticated:
+            for repo in repos:
+                yield repo, self.get_repo(repo)
+            return
+        for i in range(0, len(repos), self.GRAPHQL_BATCH_SIZE):
+            batch = repos[i : i + self.GRAPHQL_BATCH_SIZE]
+            yield from zip(batch, self._get_repos_batch([r.id for r in batch]))
+
+    def _get_repos_batch(self, ids):
+        # Fetch the repositories using a single GraphQL query, with an aliased
+        # field per repository.
+        params = []
+        fields = []
+        variables = {}
+        for i, id in enumerate(ids):
+            parts = id.split("/")
+            if len(parts) != 2:
+                raise ValueError(
+                    f"repository ID must be in the OWNER/NAME format: {id}"
+                )
+            variables[f"owner{i}"], variables[f"name{i}"] = parts
+            params.append(f"$owner{i}: String!, $name{i}: String!")
+            fields.append(
+                f"repo{i}: repository(owner: $owner{i}, name: $name{i}) {{ ...Fields }}"
+            )
+        query = f"""
+            query({", ".join(params)}) {{
+                {" ".join(fields)}
+            }}
+            fragment Fields on Repository {{
+                {GraphQLRepository.FIELDS}
+            }}
+        """
+        try:
+            _, data = self._impl.requester.graphql_query(query, variables)
+        except GithubException:
+            logging.error("Couldn't fetch repositories: %s", ", ".join(ids))
+            raise
+        data = data["data"]
+        return [GraphQLRepository(data[f"repo{i}"]) for i in range(len(ids))]
+
+    def _list(self, repos):
+        # The listings don't include the repositories the forks were forked
+        # from, and getting one using the REST API costs a request per fork.
+        # Instead, the listed repositories are grouped in batches, and the
+        # first time one of the forks in a batch is looked up, every fork in
+        # it is fetched using a single GraphQL query (see get_source).
+        if not self._authenticated:
+            # The GraphQL API is only available to authenticated users.
+            yield from repos
+            return
+        batch = []
+        for repo in repos:
+            batch.append(repo)
+            if len(batch) == self.GRAPHQL_BATCH_SIZE:
+                yield from self._add_forks(batch)
+                batch = []
+        yield from self._add_forks(batch)
+
+    def _add_forks(self, repos):
+        forks = [repo.full_name for repo in repos if repo.fork]
+        with self._sources_lock:
+            for fork in forks:
+                self._forks[fork] = forks
+        return repos
+
+    def get_source(self, repo):
+        # Returns the full name of the repository a fork was forked from.
+        if isinstance(repo, GraphQLRepository):
+            return None if repo.source is None else repo.source.full_name
+        name = repo.full_name
+        with self._sources_lock:
+            if name in self._sources:
+                return self._sources.pop(name)
+            forks = self._forks.pop(name, None)
+            for fork in forks or ():
+                self._forks.pop(fork, None)
+        batch = None
+        if forks is not None:
+            try:
+                batch = self._get_repos_batch(forks)
+            except GithubException:
+                # Some of the forks must've been deleted since.
+                pass
+        if batch is None:
+            # Careful: this costs an extra API request.
+            return repo.source.full_name
+        sources = {fork: self.get_source(src) for fork, src in zip(forks, batch)}
+        source = sources.pop(name)
+        with self._sources_lock:
+            self._sources.update(sources)
+        return source
+
     def get_user_repos(self, user, visibility=Visibility.ALL):
         visibility = visibility.to_github_arg()
 
@@ -40,20 +236,54 @@ class GitHub:
             if user.name == self._username:
                 # To get private repositories, get_user() must be called
                 # without arguments:
-                return self._impl.get_user().get_repos(affiliation="owner", **kwargs)
+                return self._list(
+                    self._impl.get_user().get_repos(affiliation="owner", **kwargs)
+                )
             else:
-                return self._impl.get_user(user.name).get_repos(**kwargs)
+                owner = self._impl.get_user(user.name)
+                self._add_owner(owner)
+                # Only public repositories of other users are listed, and
+                # /users/:username/repos doesn't take the visibility parameter.
+                return self._list(owner.get_repos())
         except GithubException:
             logging.error("Couldn't fetch user repositories: %s", user.name)
             raise
 
     def get_org_repos(self, org):
         try:
-            return self._impl.get_organization(org.name).get_repos()
+            owner = self._impl.get_organization(org.name)
+            self._add_owner(owner)
+            return self._list(owner.get_repos())
         except GithubException:
             logging.error("Couldn't fetch organization repositories: %s", org.name)
             raise
 
+    def _add_owner(self, owner):
+        # The user/organization object is already complete, remember its name.
+        with self._owners_lock:
+            self._owners[owner.login] = owner.name
+
+    def get_owner_name(self, owner):
+        login = owner.login
+        with self._owners_lock:
+            if login in self._owners:
+                return self._owners[login]
+        # For PyGithub objects, this fetches the owner (once per login).
+        name = owner.name
+        with self._owners_lock:
+            self._owners[login] = name
+        return name
+
     @staticmethod
-    def convert_repo(repo, *args, **kwargs):
-        return Repo.from_github(repo, *args, **kwargs)
+    def get_repo_id(repo):
+        return repo.full_name
+
+    def convert_repo(self, repo, config, *args, pool=None, **kwargs):
+        owner = self.get_owner_name(repo.owner)
+        source = None
+        if pool is None and config.main.object_pools and repo.fork:
+            # Only needed to detect the object pool.
+            source = self.get_source(repo)
+        return Repo.from_github(
+            repo, config, *args, owner=owner, pool=pool, source=source, **kwargs
+        )
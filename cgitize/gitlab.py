@@ -9,19 +9,31 @@ from gitlab import Gitlab
 from gitlab.exceptions import GitlabGetError
 
 from cgitize.repo import Repo, Visibility
+from cgitize.session import make_session
 
 
 class GitLab:
-    def __init__(self, token):
-        self._impl = Gitlab("https://gitlab.com", private_token=token)
+    DEFAULT_BASE_URL = "https://gitlab.com"
+
+    def __init__(self, token, cache=None, limiter=None, base_url=None):
+        if base_url is None:
+            base_url = GitLab.DEFAULT_BASE_URL
+        self.limiter = limiter
+        self.session = make_session(cache, limiter, provider="gitlab")
+        self._impl = Gitlab(base_url, private_token=token, session=self.session)
 
     def get_repo(self, repo):
         try:
-            return self._impl.projects.get(repo.id)
+            # The statistics include the repository size (see Repo.size).
+            return self._impl.projects.get(repo.id, statistics=True)
         except GitlabGetError:
             logging.error("Couldn't fetch repository: %s", repo.id)
             raise
 
+    def get_repos(self, repos):
+        for repo in repos:
+            yield repo, self.get_repo(repo)
+
     def get_user_repos(self, user, visibility=Visibility.ALL):
         visibility = visibility.to_gitlab_arg()
         try:
@@ -33,11 +45,19 @@ class GitLab:
                 raise RuntimeError(f"Couldn't find GitLab user: {user.name}")
             assert len(users) == 1
             user = users[0]
-            return user.projects.list(visibility=visibility)
+            # iterator=True fetches the pages lazily, as the projects are
+            # consumed (and doesn't stop after the first page).
+            return user.projects.list(
+                visibility=visibility, statistics=True, iterator=True
+            )
         except GitlabGetError:
             logging.error("Couldn't fetch user repositories: %s", user.name)
             raise
 
+    @staticmethod
+    def get_repo_id(repo):
+        return repo.path_with_namespace
+
     @staticmethod
     def convert_repo(repo, *args, **kwargs):
         return Repo.from_gitlab(repo, *args, **kwargs)
@@ -3,8 +3,15 @@
 # For details, see https://github.com/egor-tensin/cgitize.
 # Distributed under the MIT License.
 
+from html import escape
 
-def update(path, success, error=None):
+
+def _join(names):
+    # The names come from the provider APIs, so they're escaped.
+    return escape(", ".join(names))
+
+
+def update(path, success, error=None, failed=None, skipped=None):
     with open(path, "w") as file:
         contents = ""
         if not success:
@@ -12,7 +19,13 @@ def update(path, success, error=None):
                 """<p style="text-align: center; color: red; font-weight: bold;">"""
             )
             contents += """Some repositories couldn't be updated, please check application logs for details."""
+            if failed:
+                contents += f"""<br>Failed: {_join(failed)}"""
             if error is not None:
-                contents += f"""<br>{type(error).__name__}: {error}"""
+                contents += f"""<br>{type(error).__name__}: {escape(str(error))}"""
+            contents += """</p>\n"""
+        if skipped:
+            contents += """<p style="text-align: center; font-weight: bold;">"""
+            contents += f"""Skipped (out of time): {_join(skipped)}"""
             contents += """</p>\n"""
         file.write(contents)
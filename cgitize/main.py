@@ -6,10 +6,17 @@
 from argparse import ArgumentParser
 import logging
 import sys
+import time
 
+from cgitize import daemon
 from cgitize.cgit import CGitRepositories, CGitServer
 from cgitize.config import Config
 from cgitize.header import update as update_header
+from cgitize.metrics import REGISTRY, RUN_DURATION, RUN_REPOS, RUN_TIMESTAMP
+from cgitize.pool import Results, UpdatePool
+from cgitize.pools import ObjectPools
+from cgitize.state import State
+from cgitize.trace import Profiler, span, start_tracing, stop_tracing
 from cgitize.utils import setup_logging
 from cgitize.version import __version__
 
@@ -26,11 +33,46 @@ def parse_args(argv=None):
         help="config file path",
     )
     parser.add_argument(
-        "--repo", metavar="REPO_ID", nargs="*", dest="repos", help="repos to pull"
+        "--repo",
+        metavar="REPO_ID",
+        nargs="*",
+        dest="repos",
+        help="repos to pull (by name or path)",
     )
     parser.add_argument(
         "--force", "-f", action="store_true", help="overwrite existing repositories"
     )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="update every repository, even if it hasn't changed upstream",
+    )
+    parser.add_argument(
+        "--seed",
+        metavar="PATH",
+        help="directory with bundles or another output directory to seed new mirrors from",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        metavar="N",
+        type=int,
+        help="number of repositories to update in parallel",
+    )
+    parser.add_argument(
+        "--deadline",
+        metavar="SECONDS",
+        type=int,
+        help="skip the repositories that haven't been updated after this many seconds",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="write a timeline of the run in the Chrome trace event format",
+    )
+    parser.add_argument(
+        "--profile", metavar="PATH", help="profile the run & write pstats data"
+    )
     parser.add_argument(
         "--verbose", "-v", action="store_true", help="verbose log output"
     )
@@ -41,33 +83,144 @@ def parse_args(argv=None):
 
 
 def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["daemon"]:
+        return daemon.main(argv[1:])
     args = parse_args(argv)
     with setup_logging(args.verbose):
+        if args.trace is not None:
+            start_tracing(args.trace)
+        profiler = None
+        if args.profile is not None:
+            profiler = Profiler()
+            profiler.start()
+        try:
+            with span("run", "run"):
+                return run(args)
+        finally:
+            if profiler is not None:
+                profiler.stop(args.profile)
+            stop_tracing()
+
+
+def is_selected(repo, names):
+    return repo.name in names or repo.url_path in names
+
+
+def find_repos(config, state, names):
+    # Fetches the repositories using the sources recorded during the last
+    # full run, without enumerating everything. Returns None if some of them
+    # couldn't be found this way.
+    repos = {}
+    for name in names:
+        origins = state.find_sources(name)
+        if not origins:
+            logging.info("Repository %s isn't indexed", name)
+            return None
+        for origin in origins:
+            try:
+                repo = config.get_repository(origin)
+            except Exception as e:
+                logging.warning("Couldn't fetch repository %s: %s", name, e)
+                return None
+            if repo is None or not is_selected(repo, names):
+                # The config or the repository has changed since.
+                logging.info("Repository %s has moved", name)
+                return None
+            repos[repo.dir] = repo
+    return list(repos.values())
+
+
+def enum_repos(config, state, names):
+    if names is not None:
+        repos = find_repos(config, state, names)
+        if repos is not None:
+            yield from repos
+            return
+        logging.info("Enumerating every repository")
+    discovered = []
+    for repo in config.parse_repositories():
+        discovered.append(repo)
+        if names is None or is_selected(repo, names):
+            yield repo
+    # The enumeration has succeeded, update the index.
+    state.replace_sources(discovered)
+
+
+def run(args):
+    start = time.monotonic()
+    with span("config", "load", path=args.config):
         config = Config.read(args.config)
-        success = True
-        error = None
+    results = Results()
+    maintenance = config.make_maintenance()
+    error = None
+    ssh = config.make_ssh_multiplexer()
 
-        try:
+    try:
+        with State.open(config.main.state_dir) as state, ssh as git_env:
             cgit_server = CGitServer(config.main.clone_url)
             output = CGitRepositories(
-                config.main.output_dir, cgit_server, force=args.force
+                config.main.output_dir,
+                cgit_server,
+                state=state,
+                force=args.force,
+                full=args.full,
+                maintenance=maintenance,
+                pools=ObjectPools(config.main.object_pools_dir),
+                seed=args.seed or config.main.seed,
+                clone_timeout=config.main.clone_timeout,
+                fetch_timeout=config.main.fetch_timeout,
+                connections=config.make_connection_limiter(),
+                git_env=git_env,
+                metrics=config.main.metrics_path is not None,
             )
-            for repo in config.parse_repositories():
-                if args.repos is None or repo.name in args.repos:
-                    success = success and output.update(repo)
-        except Exception as e:
-            success = False
-            error = e
-
-        if success:
-            logging.info("All repositories were updated successfully")
-        else:
-            logging.warning("Some repositories couldn't be updated!")
-            if error is not None:
-                logging.warning("Error: %s", error)
-
-        update_header(config.main.error_header_path, success, error)
-        return int(not success)
+            jobs = args.jobs
+            if jobs is None:
+                jobs = config.main.jobs
+            deadline = args.deadline
+            if deadline is None:
+                deadline = config.main.deadline
+            pool = UpdatePool(output, jobs=jobs, deadline=deadline or None)
+            pool.run(enum_repos(config, state, args.repos), results)
+            if args.repos is None:
+                # Only some of the repositories were updated otherwise.
+                output.repo_list.write(config.main.repo_list_path)
+    except Exception as e:
+        error = e
+    config.clients.log_stats()
+    if maintenance is not None:
+        maintenance.log_stats()
+
+    success = results.success and error is None
+    if success:
+        logging.info("All repositories were updated successfully")
+    else:
+        logging.warning("Some repositories couldn't be updated!")
+        for name in results.failed_names:
+            logging.warning("Failed: %s", name)
+        if error is not None:
+            logging.warning("Error: %s", error)
+    for name in results.skipped_names:
+        logging.warning("Skipped: %s", name)
+
+    with span("header", "write"):
+        update_header(
+            config.main.error_header_path,
+            success,
+            error,
+            results.failed_names,
+            results.skipped_names,
+        )
+
+    RUN_DURATION.set(time.monotonic() - start)
+    RUN_TIMESTAMP.set(time.time())
+    RUN_REPOS.set(len(results.succeeded), result="success")
+    RUN_REPOS.set(len(results.failed), result="failure")
+    RUN_REPOS.set(len(results.skipped), result="skipped")
+    if config.main.metrics_path is not None:
+        REGISTRY.write(config.main.metrics_path)
+    return int(not success)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import logging
+import os
+import threading
+import time
+
+from cgitize.git import Git
+
+
+class Maintenance:
+    # Keeps the mirrors fast to serve: writes commit-graphs & multi-pack
+    # indexes with reachability bitmaps, and repacks the mirrors once they
+    # accumulate too many packs or loose objects. Every fetch adds a pack (or
+    # a bunch of loose objects), and nothing cleans them up otherwise.
+
+    DEFAULT_TIME_BUDGET = 10 * 60
+    DEFAULT_MAX_PACKS = 16
+    DEFAULT_MAX_LOOSE_OBJECTS = 1024
+
+    def __init__(
+        self,
+        time_budget=DEFAULT_TIME_BUDGET,
+        max_packs=DEFAULT_MAX_PACKS,
+        max_loose_objects=DEFAULT_MAX_LOOSE_OBJECTS,
+        clock=time.monotonic,
+    ):
+        self.max_packs = max_packs
+        self.max_loose_objects = max_loose_objects
+        self._clock = clock
+        # The budget is shared by every repository in the run. Once it's
+        # spent, no new maintenance tasks are started; the mirrors that were
+        # skipped are maintained during the next run.
+        self._deadline = clock() + time_budget
+        self._lock = threading.Lock()
+        self.deferred = 0
+
+    def _in_budget(self):
+        if self._clock() < self._deadline:
+            return True
+        with self._lock:
+            self.deferred += 1
+        return False
+
+    @staticmethod
+    def count_packs(repo_dir):
+        try:
+            names = os.listdir(os.path.join(repo_dir, "objects", "pack"))
+        except FileNotFoundError:
+            return 0
+        return sum(1 for name in names if name.endswith(".pack"))
+
+    @staticmethod
+    def count_loose_objects(repo_dir):
+        # Estimate the number of loose objects the same way `git gc --auto`
+        # does: the object names are uniformly distributed, so a single
+        # subdirectory holds roughly 1/256th of them.
+        try:
+            names = os.listdir(os.path.join(repo_dir, "objects", "17"))
+        except FileNotFoundError:
+            return 0
+        return 256 * sum(1 for name in names if len(name) == 38)
+
+    @staticmethod
+    def has_midx(repo_dir):
+        return os.path.exists(
+            os.path.join(repo_dir, "objects", "pack", "multi-pack-index")
+        )
+
+    @staticmethod
+    def has_alternates(repo_dir):
+        return os.path.exists(os.path.join(repo_dir, "objects", "info", "alternates"))
+
+    def needs_repack(self, repo_dir):
+        packs = self.count_packs(repo_dir)
+        # Local clones (or the ones below transfer.unpackLimit) consist of
+        # loose objects only, and a multi-pack index needs at least one pack.
+        # The members of an object pool may have no objects of their own.
+        return (
+            (packs == 0 and not self.has_alternates(repo_dir))
+            or packs > self.max_packs
+            or self.count_loose_objects(repo_dir) > self.max_loose_objects
+        )
+
+    def needs_midx(self, repo_dir, refs_changed):
+        # A member of an object pool may have no packs to index.
+        if not self.count_packs(repo_dir):
+            return False
+        return refs_changed or not self.has_midx(repo_dir)
+
+    def log_stats(self):
+        if self.deferred:
+            logging.info(
+                "Maintenance time budget exceeded, %d mirror(s) deferred to the next run",
+                self.deferred,
+            )
+
+    def run(self, repo_dir, refs_changed):
+        # Returns True if the mirror is fully maintained, False if some of
+        # the tasks were deferred or failed.
+        # A bitmap requires every reachable object to be in the packs it
+        # covers, which is never the case for a member of an object pool: it
+        # borrows the objects through objects/info/alternates.
+        bitmap = not self.has_alternates(repo_dir)
+        if self.needs_repack(repo_dir):
+            if not self._in_budget():
+                return False
+            logging.info("Repacking repository: %s", repo_dir)
+            # Geometric repacking only rolls up the small packs (and the
+            # loose objects), leaving the big ones alone.
+            if not Git.check(
+                "repack",
+                "-d",
+                # Don't copy the objects borrowed from an object pool.
+                "-l",
+                "--quiet",
+                "--geometric=2",
+                "--write-midx",
+                *(("--write-bitmap-index",) if bitmap else ()),
+                cwd=repo_dir,
+            ):
+                return False
+        elif self.needs_midx(repo_dir, refs_changed):
+            if not self._in_budget():
+                return False
+            if not Git.check(
+                "multi-pack-index",
+                "write",
+                *(("--bitmap",) if bitmap else ()),
+                "--no-progress",
+                cwd=repo_dir,
+            ):
+                return False
+        if refs_changed:
+            if not self._in_budget():
+                return False
+            # Changed-path Bloom filters speed up `git log -- <path>` & blame.
+            if not Git.check(
+                "commit-graph",
+                "write",
+                "--reachable",
+                "--split",
+                "--changed-paths",
+                "--no-progress",
+                cwd=repo_dir,
+            ):
+                return False
+        return True
@@ -0,0 +1,210 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+
+from cgitize.utils import replace_file
+
+
+class Metric:
+    # A single metric family in the Prometheus text exposition format. Only
+    # counters, gauges & summaries (without quantiles) are supported.
+
+    def __init__(self, name, type, help, labels=()):
+        self.name = name
+        self.type = type
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _get_key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"invalid labels for metric {self.name}: {labels}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def inc(self, value=1, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, value, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, value, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            total, count = self._values.get(key, (0, 0))
+            self._values[key] = (total + value, count + 1)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._get_key(labels))
+
+    def forget(self, name, value):
+        # Drops every series with the label set to the value (for example,
+        # the series of a repository that's no longer mirrored).
+        if name not in self.labels:
+            return
+        i = self.labels.index(name)
+        with self._lock:
+            for key in [key for key in self._values if key[i] == str(value)]:
+                del self._values[key]
+
+    @staticmethod
+    def _escape(value):
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    def _format_labels(self, key):
+        if not key:
+            return ""
+        pairs = [f'{name}="{self._escape(v)}"' for name, v in zip(self.labels, key)]
+        return "{" + ",".join(pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            labels = self._format_labels(key)
+            if self.type == "summary":
+                total, count = value
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+            else:
+                lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, *args, **kwargs):
+        metric = Metric(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(name, "counter", help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._add(name, "gauge", help, labels)
+
+    def summary(self, name, help, labels=()):
+        return self._add(name, "summary", help, labels)
+
+    def forget(self, name, value):
+        for metric in self._metrics:
+            metric.forget(name, value)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # For node-exporter's textfile collector, which requires the file to
+        # be replaced atomically.
+        replace_file(path, self.render())
+        logging.info("Wrote metrics: %s", path)
+
+
+REGISTRY = Registry()
+
+RUN_DURATION = REGISTRY.gauge(
+    "cgitize_run_duration_seconds", "Duration of the last run."
+)
+RUN_TIMESTAMP = REGISTRY.gauge(
+    "cgitize_run_timestamp_seconds", "Time when the last run finished."
+)
+RUN_REPOS = REGISTRY.gauge(
+    "cgitize_run_repositories",
+    "Number of repositories processed by the last run.",
+    ("result",),
+)
+
+REPO_UPDATES = REGISTRY.counter(
+    "cgitize_repo_updates_total",
+    "Repository updates (the ones skipped because nothing's changed included).",
+    ("repo", "result"),
+)
+REPO_FETCH_DURATION = REGISTRY.gauge(
+    "cgitize_repo_fetch_duration_seconds",
+    "Duration of the last clone/fetch of the repository.",
+    ("repo",),
+)
+REPO_RECEIVED_BYTES = REGISTRY.gauge(
+    "cgitize_repo_received_bytes",
+    "Growth of the repository's object store during the last clone/fetch.",
+    ("repo",),
+)
+AGEFILE_WRITES = REGISTRY.summary(
+    "cgitize_agefile_write_seconds", "Time spent updating the agefiles."
+)
+
+API_REQUESTS = REGISTRY.counter(
+    "cgitize_api_requests_total",
+    "API requests by HTTP status (retries included).",
+    ("provider", "status"),
+)
+API_LATENCY = REGISTRY.summary(
+    "cgitize_api_request_duration_seconds",
+    "API request latency (rate limit waits excluded).",
+    ("provider",),
+)
+API_RATE_LIMIT_REMAINING = REGISTRY.gauge(
+    "cgitize_api_rate_limit_remaining",
+    "API requests left until the rate limit reset.",
+    ("provider", "resource"),
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        logging.debug("Metrics: %s", fmt % args)
+
+
+class MetricsServer:
+    # Serves the metrics at /metrics.
+
+    def __init__(self, address, port, registry=REGISTRY):
+        self._server = ThreadingHTTPServer((address, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.registry = registry
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def start(self):
+        logging.info("Serving metrics on %s:%d", *self.address)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metrics", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
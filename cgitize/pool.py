@@ -0,0 +1,125 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import heapq
+import logging
+import threading
+import time
+
+from cgitize.trace import span
+from cgitize.utils import log_tag
+
+
+class Results:
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+        self.skipped = []
+
+    def add(self, repo, success):
+        if success:
+            self.succeeded.append(repo)
+        else:
+            self.failed.append(repo)
+
+    def skip(self, repo):
+        self.skipped.append(repo)
+
+    @property
+    def success(self):
+        return not self.failed
+
+    @property
+    def failed_names(self):
+        return sorted(repo.url_path for repo in self.failed)
+
+    @property
+    def skipped_names(self):
+        return sorted(repo.url_path for repo in self.skipped)
+
+
+class UpdatePool:
+    DEFAULT_JOBS = 1
+
+    def __init__(self, output, jobs=DEFAULT_JOBS, deadline=None, clock=time.monotonic):
+        if jobs < 1:
+            raise ValueError(f"number of jobs must be positive: {jobs}")
+        self.output = output
+        self.jobs = jobs
+        # Number of seconds since the start of the run after which no new
+        # updates are started. The rest of the repositories are skipped, so
+        # that the next run can start on schedule.
+        self.deadline = deadline
+        self._clock = clock
+        self._started_at = None
+        # The repositories waiting to be updated, the longest first.
+        self._queue = []
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    def _out_of_time(self):
+        if self.deadline is None:
+            return False
+        return self._clock() - self._started_at >= self.deadline
+
+    def _update(self, repo):
+        # Returns None if the repository was skipped.
+        with log_tag(repo.url_path), span(repo.url_path, "update"):
+            if self._out_of_time():
+                logging.warning("Run deadline exceeded, skipping")
+                self.output.skip(repo)
+                return None
+            try:
+                return self.output.update(repo)
+            except Exception as e:
+                logging.exception(e)
+                return False
+
+    def _estimate(self, repo):
+        estimate = self.output.estimate(repo)
+        if estimate is None:
+            # Most likely a new repository that has to be cloned.
+            return float("inf")
+        return estimate
+
+    def _enqueue(self, repo):
+        estimate = self._estimate(repo)
+        with self._lock:
+            # The counter keeps the enumeration order for equal estimates.
+            heapq.heappush(self._queue, (-estimate, self._queued, repo))
+            self._queued += 1
+
+    def _update_next(self):
+        # Updates the longest of the repositories enumerated so far, not
+        # necessarily the one this task was submitted for.
+        with self._lock:
+            _, _, repo = heapq.heappop(self._queue)
+        return repo, self._update(repo)
+
+    def run(self, repos, results):
+        # Repositories are submitted as soon as they're enumerated, so that
+        # the updates start while the rest of them are still being fetched
+        # from the APIs. The longest updates (judging by the previous runs)
+        # are started first: this minimizes the total duration of the run.
+        # If the enumeration fails, the updates that are already running are
+        # allowed to finish & are accounted for.
+        self._started_at = self._clock()
+        with ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="cgitize"
+        ) as executor:
+            futures = []
+            try:
+                for repo in repos:
+                    self._enqueue(repo)
+                    futures.append(executor.submit(self._update_next))
+            finally:
+                for future in as_completed(futures):
+                    repo, success = future.result()
+                    if success is None:
+                        results.skip(repo)
+                    else:
+                        results.add(repo, success)
+        return results
@@ -0,0 +1,108 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import hashlib
+import logging
+import os
+import threading
+from urllib.parse import quote
+
+from cgitize.git import Git
+
+
+class ObjectPools:
+    # Related repositories (forks of the same project) share their objects
+    # using a pool repository, which every member borrows objects from using
+    # git alternates (see gitrepository-layout(5)). New members are cloned
+    # with --reference to the pool, so only the objects missing from it are
+    # downloaded. After every update, the member's refs are fetched into the
+    # pool under refs/remotes/<member>/, so that the pool keeps every object
+    # any member might need. The pool is never pruned, since the members
+    # don't keep their own copies of the objects it has.
+
+    def __init__(self, dir):
+        self.dir = dir
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_path(self, key):
+        return os.path.join(self.dir, f"{quote(key, safe='')}.git")
+
+    def _get_lock(self, key):
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def get(self, repo):
+        # Returns the path to the repository's pool, or None if it doesn't
+        # belong to one.
+        if repo.pool is None:
+            return None
+        path = self.get_path(repo.pool)
+        with self._get_lock(repo.pool):
+            if os.path.isdir(path):
+                return path
+            if not repo.create_pool:
+                # Don't create a pool for a repository that has no forks.
+                return None
+            logging.info("Creating object pool: %s", path)
+            os.makedirs(self.dir, exist_ok=True)
+            if not Git.check("init", "--bare", "--quiet", path):
+                return None
+            return path
+
+    @staticmethod
+    def _get_member_id(repo):
+        return hashlib.sha1(repo.dir.encode()).hexdigest()
+
+    @staticmethod
+    def _get_alternates_path(repo_dir):
+        return os.path.join(repo_dir, "objects", "info", "alternates")
+
+    @staticmethod
+    def add_alternate(repo_dir, pool_dir):
+        path = ObjectPools._get_alternates_path(repo_dir)
+        objects_dir = os.path.join(pool_dir, "objects")
+        try:
+            with open(path) as fd:
+                if objects_dir in fd.read().splitlines():
+                    return
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as fd:
+            fd.write(f"{objects_dir}\n")
+
+    def update(self, repo, repo_dir):
+        pool_dir = self.get(repo)
+        if pool_dir is None:
+            return True
+        refs = f"refs/remotes/{self._get_member_id(repo)}"
+        with self._get_lock(repo.pool):
+            # Fetching from multiple members at once would compete for the
+            # pool's locks.
+            success, output = Git.capture(
+                "for-each-ref", "--count=1", "--format=%(refname)", refs, cwd=pool_dir
+            )
+            if not success:
+                return False
+            joining = not output
+            if joining:
+                logging.info("Adding repository '%s' to pool: %s", repo.name, pool_dir)
+                self.add_alternate(repo_dir, pool_dir)
+            if not Git.check(
+                "fetch",
+                "--quiet",
+                "--no-tags",
+                repo_dir,
+                f"+refs/*:{refs}/*",
+                cwd=pool_dir,
+            ):
+                return False
+        if joining:
+            # Drop the objects that are in the pool now.
+            return Git.check("repack", "-a", "-d", "-l", "--quiet", cwd=repo_dir)
+        return True
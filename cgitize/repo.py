@@ -6,6 +6,7 @@
 from enum import Enum
 import os.path
 
+from cgitize.git import RefFilter
 from cgitize.utils import url_remove_auth, url_replace_auth
 
 
@@ -61,9 +62,22 @@ class Visibility(Enum):
         raise NotImplementedError(f"not implemented visibility level: {self}")
 
 
+class Origin:
+    # Where a repository was found: the provider ("config" for the self-hosted
+    # repositories), the kind of the config entry that lists it (a
+    # "repository", a "user" or an "organization") & that entry's key, and
+    # the repository's ID at the provider.
+
+    def __init__(self, provider, kind, key, id=None):
+        self.provider = provider
+        self.kind = kind
+        self.key = key
+        self.id = id
+
+
 class Repo:
     @staticmethod
-    def from_config(src, config):
+    def from_config(src, config, origin=None):
         if "name" not in src:
             raise ValueError("every repository must have 'name'")
         name = src["name"]
@@ -74,19 +88,67 @@ class Repo:
             raise ValueError("every repository must have 'clone_url'")
         clone_url = src["clone_url"]
         subdir = src.get("dir")
+        pool = src.get("pool")
+        refs = RefFilter.from_config(src, config.main.impl)
         return Repo(
-            name, clone_url, owner=owner, desc=desc, homepage=homepage, subdir=subdir
+            name,
+            clone_url,
+            owner=owner,
+            desc=desc,
+            homepage=homepage,
+            subdir=subdir,
+            pool=pool,
+            refs=refs,
+            origin=origin,
         )
 
     @staticmethod
-    def from_github(src, config, subdir=None):
+    def _detect_pool(config, pool, provider, full_name, source):
+        # Returns the object pool key & whether the pool should be created.
+        # Explicitly configured pools are always created. Otherwise, forks
+        # share a pool with the repository they were forked from, which only
+        # joins it if some of its forks have created it.
+        if pool is not None:
+            return pool, True
+        if not config.main.object_pools:
+            return None, False
+        if source is not None:
+            return f"{provider}:{source.lower()}", True
+        return f"{provider}:{full_name.lower()}", False
+
+    @staticmethod
+    def from_github(
+        src,
+        config,
+        subdir=None,
+        owner=None,
+        pool=None,
+        refs=None,
+        origin=None,
+        source=None,
+    ):
+        # source is the full name of the repository it was forked from (see
+        # GitHub.get_source).
         name = src.name
         desc = src.description
         homepage = src.html_url
-        owner = src.owner.name
+        if owner is None:
+            # Careful: this costs an extra API request.
+            owner = src.owner.name
+        pushed_at = src.pushed_at
+        if pushed_at is not None:
+            pushed_at = pushed_at.isoformat()
+        pool, create_pool = Repo._detect_pool(
+            config, pool, "github", src.full_name, source
+        )
 
         https_url = src.clone_url
         ssh_url = src.ssh_url
+        # In KiB. Both the listings & the GraphQL queries include it, so this
+        # doesn't cost an extra API request.
+        size = src.size
+        if size is not None:
+            size *= 1024
 
         clone_url = ssh_url
         url_auth = None
@@ -102,14 +164,26 @@ class Repo:
             homepage=homepage,
             url_auth=url_auth,
             subdir=subdir,
+            pushed_at=pushed_at,
+            pool=pool,
+            create_pool=create_pool,
+            refs=refs,
+            origin=origin,
+            size=size,
         )
 
     @staticmethod
-    def from_bitbucket(src, config, subdir=None):
+    def from_bitbucket(src, config, subdir=None, pool=None, refs=None, origin=None):
         name = src.name
         desc = src.description
         homepage = src.get_link("html")
         owner = src.data["owner"]["display_name"]
+        source = src.data.get("parent")
+        if source is not None:
+            source = source["full_name"]
+        pool, create_pool = Repo._detect_pool(
+            config, pool, "bitbucket", src.data["full_name"], source
+        )
 
         https_urls = [
             link for link in src.data["links"]["clone"] if link["name"] == "https"
@@ -125,6 +199,7 @@ class Repo:
         if len(ssh_urls) != 1:
             raise RuntimeError(f"no ssh:// clone URL for repository '{name}'?!")
         ssh_url = ssh_urls[0]["href"]
+        size = src.data.get("size")
 
         clone_url = ssh_url
         url_auth = None
@@ -139,6 +214,9 @@ class Repo:
             # reason, Bitbucket leaves the relevant username in the API response.
             url_auth = api_auth[0], url_auth[1]
 
+        # Bitbucket doesn't report the time of the last push, and updated_on
+        # isn't reliably updated on every push, so it can't be used to skip
+        # the update: these repositories are always fetched.
         return Repo(
             name,
             clone_url,
@@ -147,17 +225,31 @@ class Repo:
             homepage=homepage,
             url_auth=url_auth,
             subdir=subdir,
+            pool=pool,
+            create_pool=create_pool,
+            refs=refs,
+            origin=origin,
+            size=size,
         )
 
     @staticmethod
-    def from_gitlab(src, config, subdir=None):
+    def from_gitlab(src, config, subdir=None, pool=None, refs=None, origin=None):
         name = src.name
         desc = src.description
         homepage = src.web_url
         owner = src.namespace["name"]
+        source = getattr(src, "forked_from_project", None)
+        if source is not None:
+            source = source["path_with_namespace"]
+        pool, create_pool = Repo._detect_pool(
+            config, pool, "gitlab", src.path_with_namespace, source
+        )
 
         https_url = src.http_url_to_repo
         ssh_url = src.ssh_url_to_repo
+        # Only included if requested (see GitLab.get_repo), and only for the
+        # projects the user is at least a Reporter in.
+        size = getattr(src, "statistics", {}).get("repository_size")
 
         clone_url = ssh_url
         url_auth = None
@@ -165,6 +257,9 @@ class Repo:
             clone_url = https_url
             url_auth = config.gitlab.url_auth
 
+        # GitLab doesn't report the time of the last push either.
+        # last_activity_at is only updated once an hour or so, so these
+        # repositories are always fetched as well.
         return Repo(
             name,
             clone_url,
@@ -173,6 +268,11 @@ class Repo:
             homepage=homepage,
             url_auth=url_auth,
             subdir=subdir,
+            pool=pool,
+            create_pool=create_pool,
+            refs=refs,
+            origin=origin,
+            size=size,
         )
 
     def __init__(
@@ -184,6 +284,12 @@ class Repo:
         homepage=None,
         url_auth=None,
         subdir=None,
+        pushed_at=None,
+        pool=None,
+        create_pool=True,
+        refs=None,
+        origin=None,
+        size=None,
     ):
         self._name = name
         self._desc = desc
@@ -192,6 +298,14 @@ class Repo:
         self._clone_url = clone_url
         self._url_auth = url_auth
         self._dir = subdir
+        self._pushed_at = pushed_at
+        self._pool = pool
+        self._create_pool = create_pool
+        if refs is None:
+            refs = RefFilter()
+        self._refs = refs
+        self._origin = origin
+        self._size = size
 
     @property
     def name(self):
@@ -227,6 +341,38 @@ class Repo:
     def url_auth(self):
         return self._url_auth
 
+    @property
+    def pushed_at(self):
+        # When the upstream repository was last pushed to, as reported by the
+        # hosting provider. If this didn't change since the last update,
+        # there's no need to fetch it.
+        return self._pushed_at
+
+    @property
+    def pool(self):
+        # Related repositories with the same key share an object pool.
+        return self._pool
+
+    @property
+    def create_pool(self):
+        return self._create_pool
+
+    @property
+    def refs(self):
+        return self._refs
+
+    @property
+    def origin(self):
+        # Where the repository was found (see Origin), if it was enumerated
+        # by Config.
+        return self._origin
+
+    @property
+    def size(self):
+        # The size of the upstream repository in bytes, as reported by the
+        # hosting provider (if it does).
+        return self._size
+
     @property
     def clone_url_with_auth(self):
         if not self.url_auth:
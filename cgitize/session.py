@@ -0,0 +1,424 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+from email.utils import parsedate_to_datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util import Retry
+
+from cgitize.metrics import API_LATENCY, API_RATE_LIMIT_REMAINING, API_REQUESTS
+from cgitize.trace import span
+
+
+class ResponseCache:
+    # On-disk cache of API responses. Every entry is a file with a line of
+    # JSON metadata (URL, validators, headers) followed by the response body.
+
+    DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+    # These identify the requester; different users can see different
+    # repositories at the same URL.
+    _AUTH_HEADERS = ("Authorization", "PRIVATE-TOKEN")
+
+    # These describe the body as it was transferred, not as it's stored.
+    _TRANSFER_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+    def __init__(self, dir, max_age=DEFAULT_MAX_AGE):
+        self.dir = dir
+        self.max_age = max_age
+        os.makedirs(self.dir, exist_ok=True)
+        self._expire()
+
+    def _expire(self):
+        now = time.time()
+        for entry in os.scandir(self.dir):
+            try:
+                if now - entry.stat().st_mtime > self.max_age:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _get_path(self, request):
+        h = hashlib.sha256(request.url.encode())
+        for name in self._AUTH_HEADERS:
+            h.update(b"\0")
+            h.update(request.headers.get(name, "").encode())
+        return os.path.join(self.dir, h.hexdigest())
+
+    def get(self, request):
+        path = self._get_path(request)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, "rb") as fd:
+                meta, body = fd.read().split(b"\n", 1)
+        except (FileNotFoundError, ValueError):
+            return None
+        meta = json.loads(meta)
+        if meta["url"] != request.url:
+            return None
+        return meta, body
+
+    def put(self, request, response):
+        headers = CaseInsensitiveDict(response.headers)
+        for name in self._TRANSFER_HEADERS:
+            headers.pop(name, None)
+        meta = {
+            "url": request.url,
+            "headers": dict(headers),
+        }
+        data = json.dumps(meta).encode() + b"\n" + response.content
+        path = self._get_path(request)
+        # Entries are replaced atomically, so that concurrent readers (the
+        # providers are queried in parallel) never see half-written files.
+        fd, tmp_path = tempfile.mkstemp(dir=self.dir, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def touch(self, request):
+        try:
+            os.utime(self._get_path(request))
+        except FileNotFoundError:
+            pass
+
+
+class Quota:
+    # Rate limit of a single API resource (GitHub has separate limits for the
+    # REST & GraphQL APIs), as last reported by the server.
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.used = 0
+        self.last_request = None
+
+    def update(self, limit, remaining, reset):
+        if self.remaining is not None and remaining is not None:
+            if reset is not None and self.reset is not None and reset > self.reset:
+                # A new window has started; whatever has been used in it was
+                # (most likely) used by us.
+                if limit is not None:
+                    self.used += max(0, limit - remaining)
+            else:
+                self.used += max(0, self.remaining - remaining)
+        if limit is not None:
+            self.limit = limit
+        if remaining is not None:
+            self.remaining = remaining
+        if reset is not None:
+            self.reset = reset
+
+
+class RateLimiter:
+    # Keeps track of the API quota using the rate limit headers the providers
+    # send with every response. Requests are spread evenly over the time left
+    # until the reset when the quota is running low, and if it's exhausted (or
+    # the server responds with 429 Too Many Requests), the limiter waits for
+    # the reset & retries, unless the wait would be longer than max_wait.
+
+    DEFAULT_MAX_WAIT = 5 * 60
+
+    # Start pacing requests when less than this share of the quota is left.
+    PACE_THRESHOLD = 0.1
+
+    MAX_RETRIES = 3
+
+    # GitHub & Bitbucket use the X-RateLimit-* headers, GitLab uses the
+    # RateLimit-* headers. Bitbucket doesn't report the remaining quota, so
+    # only the 429 responses with Retry-After can be handled for it.
+    _HEADERS = (
+        ("X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset"),
+        ("RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset"),
+    )
+
+    def __init__(self, max_wait=DEFAULT_MAX_WAIT, clock=time.time, sleep=time.sleep):
+        self.max_wait = max_wait
+        self.quotas = {}
+        self.waited = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_resource(request, response=None):
+        if response is not None and "X-RateLimit-Resource" in response.headers:
+            return response.headers["X-RateLimit-Resource"]
+        if requests.utils.urlparse(request.url).path.endswith("/graphql"):
+            return "graphql"
+        return "core"
+
+    def _get_quota(self, resource):
+        if resource not in self.quotas:
+            self.quotas[resource] = Quota()
+        return self.quotas[resource]
+
+    @staticmethod
+    def _parse_int(value):
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return None
+
+    def _parse_retry_after(self, value):
+        if value is None:
+            return None
+        try:
+            return max(0, int(value))
+        except ValueError:
+            pass
+        try:
+            return max(0, parsedate_to_datetime(value).timestamp() - self._clock())
+        except (TypeError, ValueError):
+            return None
+
+    def _get_delay(self, quota, now):
+        if quota.remaining is None or quota.reset is None:
+            return 0
+        left = quota.reset - now
+        if left <= 0:
+            return 0
+        if quota.remaining <= 0:
+            # The reset time is rounded down to seconds.
+            return left + 1
+        if quota.limit and quota.remaining < quota.limit * self.PACE_THRESHOLD:
+            if quota.last_request is not None:
+                interval = left / quota.remaining
+                return max(0, quota.last_request + interval - now)
+        return 0
+
+    def _wait(self, delay, reason, level=logging.INFO):
+        logging.log(level, "%s, waiting for %.1f second(s)", reason, delay)
+        with self._lock:
+            self.waited += delay
+        self._sleep(delay)
+
+    def before_request(self, request):
+        resource = self._get_resource(request)
+        with self._lock:
+            quota = self._get_quota(resource)
+            now = self._clock()
+            delay = self._get_delay(quota, now)
+            if delay > self.max_wait:
+                quota.last_request = now
+            else:
+                quota.last_request = now + delay
+            remaining, reset = quota.remaining, quota.reset
+        if delay <= 0:
+            return
+        if delay > self.max_wait:
+            # Let the request fail; the error is reported as usual.
+            logging.warning(
+                "API rate limit (%s) exhausted until %s",
+                resource,
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(reset)),
+            )
+            return
+        if remaining > 0:
+            self._wait(delay, f"API rate limit ({resource}) is low", logging.DEBUG)
+        else:
+            self._wait(delay, f"API rate limit ({resource}) exhausted")
+
+    def after_response(self, request, response):
+        # Returns the number of seconds to wait before retrying the request,
+        # or None if it shouldn't be retried.
+        for limit, remaining, reset in self._HEADERS:
+            if remaining in response.headers:
+                break
+        with self._lock:
+            quota = self._get_quota(self._get_resource(request, response))
+            quota.update(
+                self._parse_int(response.headers.get(limit)),
+                self._parse_int(response.headers.get(remaining)),
+                self._parse_int(response.headers.get(reset)),
+            )
+            now = self._clock()
+        if response.status_code not in (403, 429):
+            return None
+        delay = self._parse_retry_after(response.headers.get("Retry-After"))
+        if delay is None:
+            if quota.remaining != 0 or quota.reset is None:
+                # Not a rate limit error.
+                return None
+            delay = max(0, quota.reset - now) + 1
+        if delay > self.max_wait:
+            return None
+        return delay
+
+    def send(self, send, request):
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.before_request(request)
+            response = send(request)
+            delay = self.after_response(request, response)
+            if delay is None or attempt == self.MAX_RETRIES:
+                return response
+            response.close()
+            self._wait(delay, f"API rate limit hit ({response.status_code})")
+        return response
+
+    def get_remaining(self):
+        with self._lock:
+            return {
+                resource: quota.remaining
+                for resource, quota in self.quotas.items()
+                if quota.remaining is not None
+            }
+
+    def log_stats(self, name):
+        with self._lock:
+            quotas = sorted(self.quotas.items())
+            waited = self.waited
+        for resource, quota in quotas:
+            if quota.remaining is None:
+                continue
+            logging.info(
+                "API quota (%s, %s): %d used, %d of %s remaining",
+                name,
+                resource,
+                quota.used,
+                quota.remaining,
+                "?" if quota.limit is None else quota.limit,
+            )
+        if waited:
+            logging.info("API rate limit (%s): waited for %d second(s)", name, waited)
+
+
+class Adapter(HTTPAdapter):
+    # Revalidates cached GET responses using ETag/Last-Modified. If the server
+    # responds with 304 Not Modified, the cached response is returned instead.
+    # With GitHub, such requests don't count against the rate limit.
+    # All requests go through the rate limiter, if there's one.
+
+    def __init__(self, cache=None, limiter=None, provider=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.limiter = limiter
+        # Used to label the metrics.
+        self.provider = provider
+
+    def _record(self, response, duration):
+        if self.provider is None:
+            return
+        API_REQUESTS.inc(provider=self.provider, status=response.status_code)
+        API_LATENCY.observe(duration, provider=self.provider)
+
+    def _record_remaining(self):
+        if self.provider is None:
+            return
+        for resource, remaining in self.limiter.get_remaining().items():
+            API_RATE_LIMIT_REMAINING.set(
+                remaining, provider=self.provider, resource=resource
+            )
+
+    def _send(self, request, **kwargs):
+        def send(request):
+            start = time.monotonic()
+            with span(request.url, "api", provider=self.provider) as trace:
+                response = super(Adapter, self).send(request, **kwargs)
+                trace["status"] = response.status_code
+            self._record(response, time.monotonic() - start)
+            return response
+
+        if self.limiter is None:
+            return send(request)
+        response = self.limiter.send(send, request)
+        self._record_remaining()
+        return response
+
+    def send(self, request, **kwargs):
+        if self.cache is None or request.method != "GET":
+            return self._send(request, **kwargs)
+
+        cached = self.cache.get(request)
+        if cached is not None:
+            meta, body = cached
+            headers = CaseInsensitiveDict(meta["headers"])
+            request = request.copy()
+            if "ETag" in headers:
+                request.headers["If-None-Match"] = headers["ETag"]
+            if "Last-Modified" in headers:
+                request.headers["If-Modified-Since"] = headers["Last-Modified"]
+
+        response = self._send(request, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            logging.debug("Not modified: %s", request.url)
+            self.cache.touch(request)
+            return self._from_cache(request, response, headers, body)
+        if response.status_code == 200:
+            if "ETag" in response.headers or "Last-Modified" in response.headers:
+                self.cache.put(request, response)
+        return response
+
+    def _from_cache(self, request, not_modified, headers, body):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = not_modified.elapsed
+        # The fresh headers (like the rate limit info) take precedence.
+        response.headers = headers
+        for name, value in not_modified.headers.items():
+            if name.lower() not in ResponseCache._TRANSFER_HEADERS:
+                response.headers[name] = value
+        response.encoding = requests.utils.get_encoding_from_headers(headers)
+        response._content = body
+        return response
+
+
+# Retries connection errors & server-side failures. Rate limit errors are
+# handled by RateLimiter.
+DEFAULT_RETRY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=None,
+    raise_on_status=False,
+)
+
+
+def make_session(cache=None, limiter=None, retry=None, provider=None):
+    session = requests.Session()
+    kwargs = {}
+    if retry is not None:
+        kwargs["max_retries"] = retry
+    adapter = Adapter(cache, limiter, provider, **kwargs)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def connection_stats(session):
+    # Returns the number of requests made & connections opened by the session
+    # (the requests that reused a keep-alive connection didn't open one).
+    requests = 0
+    connections = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests += pool.num_requests
+            connections += pool.num_connections
+    return requests, connections
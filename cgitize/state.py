@@ -0,0 +1,233 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from cgitize.git import RefFilter
+from cgitize.repo import Origin
+
+
+class Mirror:
+    def __init__(self, row=None):
+        if row is None:
+            row = {}
+        self.dir = row.get("dir")
+        self.clone_url = row.get("clone_url")
+        self.pushed_at = row.get("pushed_at")
+        self.fetched_at = row.get("fetched_at")
+        self.fetch_duration = row.get("fetch_duration")
+        self.refs_hash = row.get("refs_hash")
+        self.last_error = row.get("last_error")
+        self.failures = row.get("failures", 0)
+        self.maintained_refs_hash = row.get("maintained_refs_hash")
+        # Mirrors recorded before ref filters were introduced have every ref.
+        refspecs = row.get("refspecs")
+        if refspecs is None:
+            self.refspecs = RefFilter().refspecs
+        else:
+            self.refspecs = refspecs.splitlines()
+
+    @property
+    def exists(self):
+        return self.dir is not None
+
+    @property
+    def healthy(self):
+        # If the last update succeeded, the mirror can be assumed to be a
+        # proper repository with the recorded upstream URL.
+        return self.exists and not self.failures
+
+    def is_current(self, repo):
+        # The upstream hasn't been pushed to since the last update.
+        return (
+            self.healthy
+            and repo.pushed_at is not None
+            and repo.pushed_at == self.pushed_at
+            and repo.clone_url == self.clone_url
+            and repo.refs.refspecs == self.refspecs
+        )
+
+
+class State:
+    # Every element upgrades the database schema from version N to N+1.
+    MIGRATIONS = [
+        """
+        CREATE TABLE mirrors (
+            dir TEXT PRIMARY KEY,
+            clone_url TEXT,
+            pushed_at TEXT,
+            fetched_at REAL,
+            fetch_duration REAL,
+            refs_hash TEXT,
+            last_error TEXT,
+            failures INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        ALTER TABLE mirrors ADD COLUMN maintained_refs_hash TEXT;
+        """,
+        """
+        ALTER TABLE mirrors ADD COLUMN refspecs TEXT;
+        """,
+        # Where every repository was found during the last full enumeration,
+        # so that a single repository can be fetched without enumerating
+        # everything.
+        """
+        CREATE TABLE sources (
+            dir TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            url_path TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            id TEXT
+        );
+        """,
+        """
+        CREATE INDEX sources_name ON sources (name);
+        """,
+        """
+        CREATE INDEX sources_url_path ON sources (url_path);
+        """,
+    ]
+
+    FILE_NAME = "state.sqlite"
+
+    @staticmethod
+    def open(dir):
+        os.makedirs(dir, exist_ok=True)
+        return State(os.path.join(dir, State.FILE_NAME))
+
+    @staticmethod
+    def in_memory():
+        return State(":memory:")
+
+    def __init__(self, path):
+        self.path = path
+        # The connection is shared between the threads updating repositories
+        # in parallel, with access serialized by the lock.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._migrate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _migrate(self):
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            for i in range(version, len(State.MIGRATIONS)):
+                logging.debug("Upgrading state database to version %d", i + 1)
+                self._conn.execute("BEGIN")
+                self._conn.execute(State.MIGRATIONS[i])
+                self._conn.execute(f"PRAGMA user_version={i + 1}")
+                self._conn.execute("COMMIT")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, repo):
+        rows = self._execute("SELECT * FROM mirrors WHERE dir = ?", (repo.dir,))
+        if not rows:
+            return Mirror()
+        return Mirror(dict(rows[0]))
+
+    def record_success(self, repo, duration, refs_hash):
+        self._execute(
+            """
+            INSERT INTO mirrors (
+                dir, clone_url, pushed_at, fetched_at, fetch_duration, refs_hash,
+                refspecs, last_error, failures
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, 0)
+            ON CONFLICT (dir) DO UPDATE SET
+                clone_url = excluded.clone_url,
+                pushed_at = excluded.pushed_at,
+                fetched_at = excluded.fetched_at,
+                fetch_duration = excluded.fetch_duration,
+                refs_hash = excluded.refs_hash,
+                refspecs = excluded.refspecs,
+                last_error = NULL,
+                failures = 0
+            """,
+            (
+                repo.dir,
+                repo.clone_url,
+                repo.pushed_at,
+                time.time(),
+                duration,
+                refs_hash,
+                "\n".join(repo.refs.refspecs),
+            ),
+        )
+
+    def record_failure(self, repo, error):
+        self._execute(
+            """
+            INSERT INTO mirrors (dir, last_error, failures) VALUES (?, ?, 1)
+            ON CONFLICT (dir) DO UPDATE SET
+                last_error = excluded.last_error,
+                failures = failures + 1
+            """,
+            (repo.dir, error),
+        )
+
+    def record_maintenance(self, repo, refs_hash):
+        self._execute(
+            "UPDATE mirrors SET maintained_refs_hash = ? WHERE dir = ?",
+            (refs_hash, repo.dir),
+        )
+
+    def replace_sources(self, repos):
+        # Only call this after a successful enumeration of every repository.
+        rows = [
+            (
+                repo.dir,
+                repo.name,
+                repo.url_path,
+                repo.origin.provider,
+                repo.origin.kind,
+                repo.origin.key,
+                repo.origin.id,
+            )
+            for repo in repos
+            if repo.origin is not None
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM sources")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def find_sources(self, name):
+        # The repositories with this name (or URL path) as of the last full
+        # enumeration.
+        rows = self._execute(
+            "SELECT * FROM sources WHERE name = ? OR url_path = ?", (name, name)
+        )
+        return [
+            Origin(row["provider"], row["kind"], row["key"], row["id"]) for row in rows
+        ]
@@ -0,0 +1,131 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import cProfile
+from contextlib import contextmanager
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+class Tracer:
+    # Records the phases of a run in the Chrome trace event format (load the
+    # file in chrome://tracing or https://ui.perfetto.dev). The events are
+    # written as soon as they end, one per line, so that the file is usable
+    # even if the run is interrupted (the closing bracket is optional).
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = open(path, "w")
+        self._fd.write("[\n")
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._start = time.perf_counter()
+        self._first = True
+
+    def _now(self):
+        return (time.perf_counter() - self._start) * 1e6
+
+    def _write(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            if self._fd is None:
+                return
+            if not self._first:
+                self._fd.write(",\n")
+            self._first = False
+            self._fd.write(line)
+            self._fd.flush()
+
+    @contextmanager
+    def span(self, name, cat, args):
+        # args can be updated inside the span (with the exit code, etc.).
+        start = self._now()
+        try:
+            yield args
+        finally:
+            self._write(
+                {
+                    "name": name,
+                    "cat": cat,
+                    "ph": "X",
+                    "ts": start,
+                    "dur": self._now() - start,
+                    "pid": self._pid,
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def close(self):
+        with self._lock:
+            self._fd.write("\n]\n")
+            self._fd.close()
+            self._fd = None
+        logging.info("Wrote trace: %s", self.path)
+
+
+_tracer = None
+
+
+def start_tracing(path):
+    global _tracer
+    _tracer = Tracer(path)
+
+
+def stop_tracing():
+    global _tracer
+    if _tracer is None:
+        return
+    tracer, _tracer = _tracer, None
+    tracer.close()
+
+
+@contextmanager
+def span(name, cat, **args):
+    # A no-op unless tracing is enabled.
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    with tracer.span(name, cat, args) as args:
+        yield args
+
+
+class Profiler:
+    # cProfile profiles every thread since Python 3.12. Before that, it only
+    # profiles the thread it's been enabled in, so every thread started
+    # afterwards gets its own profiler, and the results are merged.
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, *args):
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        self._start_thread()
+        if sys.version_info < (3, 12):
+            # This hook is called once in every new thread, and is replaced
+            # by the thread's profiler.
+            threading.setprofile(self._start_thread)
+
+    def stop(self, path):
+        threading.setprofile(None)
+        with self._lock:
+            profiles = list(self._profiles)
+        for profile in profiles:
+            profile.disable()
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(path)
+        logging.info("Wrote profile: %s", path)
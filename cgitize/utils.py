@@ -4,13 +4,68 @@
 # Distributed under the MIT License.
 
 from contextlib import contextmanager
+import contextvars
 import logging
 import os
-import stat
+import queue
+import re
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
 from urllib.parse import quote, urlsplit, urlunsplit
 
+from cgitize.trace import span
+
+_log_tag = contextvars.ContextVar("log_tag", default=None)
+
+
+class _LogTagFilter(logging.Filter):
+    def filter(self, record):
+        tag = _log_tag.get()
+        record.tag = "" if tag is None else f"{tag} | "
+        return True
+
+
+@contextmanager
+def log_tag(tag):
+    # Prefix every message logged in this context with the tag. Used to tell
+    # which repository a log line belongs to when they're updated in parallel.
+    token = _log_tag.set(tag)
+    try:
+        yield
+    finally:
+        _log_tag.reset(token)
+
+
+_errors = contextvars.ContextVar("errors", default=None)
+
+
+@contextmanager
+def collect_errors():
+    # Collect the errors of every process that failed in this context. The
+    # last line of its output is usually a good description of the error.
+    errors = []
+    token = _errors.set(errors)
+    try:
+        yield errors
+    finally:
+        _errors.reset(token)
+
+
+def _add_error(args, e):
+    errors = _errors.get()
+    if errors is None:
+        return
+    lines = [line for line in (e.output or "").splitlines() if line.strip()]
+    if isinstance(e, subprocess.TimeoutExpired):
+        errors.append(f"{args[0]} timed out after {e.timeout} seconds")
+    elif lines:
+        errors.append(lines[-1])
+    else:
+        errors.append(f"{args[0]} exited with code {e.returncode}")
+
 
 @contextmanager
 def setup_logging(verbose=False):
@@ -28,11 +83,11 @@ def setup_logging(verbose=False):
     logging.basicConfig(
         level=level,
         datefmt="%Y-%m-%d %H:%M:%S%z",
-        format="%(asctime)s | %(levelname)4s | %(message)s",
-        # Log to stdout, because that's where subprocess's output goes (so that
-        # they don't get interleaved).
+        format="%(asctime)s | %(levelname)4s | %(tag)s%(message)s",
         stream=sys.stdout,
     )
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(_LogTagFilter())
     try:
         yield
     except Exception as e:
@@ -40,23 +95,94 @@ def setup_logging(verbose=False):
         sys.exit(1)
 
 
-def run(*args, capture_output=False, **kwargs):
-    stdout = None
-    stderr = None
-    if capture_output:
-        stdout = subprocess.PIPE
-        stderr = subprocess.STDOUT
+def _strip_output(output):
+    if output and output[-1] == "\n":
+        return output[:-1]
+    return output
+
+
+def _log_output(output, log):
+    if not output:
+        return
+    for line in output.splitlines():
+        log("%s", line)
+
+
+def _kill(process):
+    # Kill the whole process group: git spawns ssh, git-remote-https, etc.,
+    # which would otherwise keep running (and holding the pipes open).
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
 
+def _traced_communicate(args, **kwargs):
+    with span(" ".join(args[:2]), "subprocess", argv=list(args)) as trace:
+        try:
+            output = _communicate(args, **kwargs)
+        except subprocess.TimeoutExpired as e:
+            trace["timeout"] = e.timeout
+            raise
+        except subprocess.CalledProcessError as e:
+            trace["exit_code"] = e.returncode
+            raise
+        trace["exit_code"] = 0
+        return output
+
+
+def _communicate(args, input=None, timeout=None, **kwargs):
+    stdin = None if input is None else subprocess.PIPE
+    with subprocess.Popen(
+        args,
+        stdin=stdin,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding="utf-8",
+        start_new_session=True,
+        **kwargs,
+    ) as process:
+        try:
+            output, _ = process.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            _kill(process)
+            e.output, _ = process.communicate()
+            raise
+        except BaseException:
+            _kill(process)
+            raise
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args, output)
+    return output
+
+
+def run(*args, capture_output=False, **kwargs):
+    # The output is always piped through the logging module, even if it's not
+    # captured. This way, the output of processes running in parallel doesn't
+    # get interleaved, and is tagged with the repository name.
     logging.debug("Running: %s", subprocess.list2cmdline(args))
-    result = subprocess.run(
-        args, check=True, stdout=stdout, stderr=stderr, encoding="utf-8", **kwargs
-    )
+    try:
+        output = _traced_communicate(args, **kwargs)
+    except subprocess.TimeoutExpired as e:
+        e.output = _strip_output(e.output)
+        _add_error(args, e)
+        if not capture_output:
+            _log_output(e.output, logging.error)
+        logging.error("%s timed out after %s seconds", args[0], e.timeout)
+        raise
+    except subprocess.CalledProcessError as e:
+        e.output = _strip_output(e.output)
+        _add_error(args, e)
+        if not capture_output:
+            _log_output(e.output, logging.error)
+        raise
 
-    if result.stdout is not None:
-        if result.stdout[-1] == "\n":
-            result.stdout = result.stdout[:-1]
-        logging.debug("%s", result.stdout)
-    return result.stdout
+    output = _strip_output(output)
+    if capture_output:
+        logging.debug("%s", output)
+        return output
+    _log_output(output, logging.info)
+    return None
 
 
 def try_run(*args, **kwargs):
@@ -65,6 +191,8 @@ def try_run(*args, **kwargs):
         return True
     except subprocess.CalledProcessError as e:
         return e.returncode == 0
+    except subprocess.TimeoutExpired:
+        return False
 
 
 def capture(*args, **kwargs):
@@ -76,37 +204,74 @@ def try_capture(*args, **kwargs):
         return True, run(*args, capture_output=True, **kwargs)
     except subprocess.CalledProcessError as e:
         return e.returncode == 0, e.output
+    except subprocess.TimeoutExpired as e:
+        return False, e.output
 
 
-@contextmanager
-def chdir(new_cwd):
-    old_cwd = os.getcwd()
-    os.chdir(new_cwd)
+def iterate_concurrently(iterables):
+    # Consume every (tag, iterable) pair in a separate thread, and yield the
+    # items as soon as any of them produces one. If some of them fail, the
+    # rest are still consumed; the first error is re-raised at the end.
+    done = object()
+    items = queue.Queue()
+    stop = threading.Event()
+    errors = []
+
+    def consume(tag, iterable):
+        try:
+            with log_tag(tag), span(tag, "enumerate"):
+                for item in iterable:
+                    if stop.is_set():
+                        return
+                    items.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            items.put(done)
+
+    threads = [
+        threading.Thread(target=consume, args=(tag, iterable), daemon=True)
+        for tag, iterable in iterables
+    ]
+    for thread in threads:
+        thread.start()
+
     try:
-        yield
+        remaining = len(threads)
+        while remaining:
+            item = items.get()
+            if item is done:
+                remaining -= 1
+                continue
+            yield item
     finally:
-        os.chdir(old_cwd)
+        stop.set()
 
+    for e in errors[1:]:
+        logging.error("%s: %s", type(e).__name__, e)
+    if errors:
+        raise errors[0]
 
-@contextmanager
-def protected_file(path):
-    # 0600:
-    new_permissions = stat.S_IRUSR | stat.S_IWUSR
-    if os.path.exists(path):
-        old_permissions = stat.S_IMODE(os.stat(path).st_mode)
-        os.chmod(path, new_permissions)
-        try:
-            yield
-        finally:
-            os.chmod(path, old_permissions)
-    else:
-        with open(path, mode="w"):
-            pass
-        os.chmod(path, new_permissions)
-        try:
-            yield
-        finally:
-            os.unlink(path)
+
+def replace_file(path, contents):
+    # Atomically replaces the file, so that readers never see it half-written.
+    # Returns False if the file already had these contents.
+    try:
+        with open(path, encoding="utf-8") as fd:
+            if fd.read() == contents:
+                return False
+    except FileNotFoundError:
+        pass
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+            tmp.write(contents)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
 
 
 def url_replace_auth(url, auth):
@@ -130,3 +295,12 @@ def url_remove_auth(url):
         netloc += f":{parts.port}"
     parts = parts._replace(netloc=netloc)
     return auth, urlunsplit(parts)
+
+
+def url_get_host(url):
+    # Works for scp-like URLs (git@host:path) as well. Returns None for local
+    # paths & file:// URLs.
+    m = re.match(r"^(?:[^@/]+@)?([^:/]+):(?!//)", url)
+    if m is not None:
+        return m.group(1).lower()
+    return urlsplit(url).hostname
@@ -0,0 +1,172 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import hashlib
+import hmac
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import re
+import threading
+from urllib.parse import urlsplit
+
+
+def get_url_key(url):
+    # Reduces the different URLs of a repository (https://, ssh://, scp-like
+    # git@host:path, the web page) to host/path, so that they can be matched.
+    if url is None:
+        return None
+    m = re.match(r"^(?:[^@/]+@)?([^:/]+):(?!//)(.*)$", url)
+    if m is not None:
+        host, path = m.groups()
+    else:
+        parts = urlsplit(url)
+        if parts.hostname is None:
+            # A local path.
+            return url.rstrip("/").removesuffix(".git")
+        host, path = parts.hostname, parts.path
+    path = path.strip("/").removesuffix(".git")
+    return f"{host}/{path}".lower()
+
+
+class Provider:
+    # Every provider signs its webhooks differently & uses its own payload
+    # format. A verifier returns False if the request doesn't come from the
+    # provider, a parser returns the repository URLs from a push event, or
+    # None if it's some other event.
+
+    def __init__(self, name, verify, parse):
+        self.name = name
+        self.verify = verify
+        self.parse = parse
+
+
+def _verify_hmac(header):
+    def verify(headers, body, secret):
+        signature = headers.get(header, "")
+        expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, f"sha256={expected}")
+
+    return verify
+
+
+def _verify_gitlab(headers, body, secret):
+    return hmac.compare_digest(headers.get("X-Gitlab-Token", ""), secret)
+
+
+def _parse_github(headers, payload):
+    if headers.get("X-GitHub-Event") != "push":
+        return None
+    repo = payload["repository"]
+    return [repo.get("clone_url"), repo.get("ssh_url"), repo.get("html_url")]
+
+
+def _parse_gitlab(headers, payload):
+    if payload.get("object_kind") not in ("push", "tag_push"):
+        return None
+    project = payload["project"]
+    return [
+        project.get("git_http_url"),
+        project.get("git_ssh_url"),
+        project.get("web_url"),
+    ]
+
+
+def _parse_bitbucket(headers, payload):
+    if headers.get("X-Event-Key") != "repo:push":
+        return None
+    # Bitbucket doesn't include the clone URLs.
+    return [payload["repository"]["links"]["html"]["href"]]
+
+
+PROVIDERS = {
+    p.name: p
+    for p in (
+        Provider("github", _verify_hmac("X-Hub-Signature-256"), _parse_github),
+        Provider("gitlab", _verify_gitlab, _parse_gitlab),
+        Provider("bitbucket", _verify_hmac("X-Hub-Signature"), _parse_bitbucket),
+    )
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # The webhooks are sent to /github, /gitlab & /bitbucket.
+
+    MAX_BODY_SIZE = 25 * 1024 * 1024
+
+    def _respond(self, status, message):
+        body = f"{message}\n".encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        provider = PROVIDERS.get(self.path.strip("/"))
+        if provider is None:
+            return self._respond(404, "Not Found")
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            return self._respond(411, "Length Required")
+        if length > self.MAX_BODY_SIZE:
+            return self._respond(413, "Payload Too Large")
+        body = self.rfile.read(length)
+
+        secret = server.get_secret(provider.name)
+        if secret is None:
+            logging.warning("No webhook secret for %s, rejecting", provider.name)
+            return self._respond(403, "Forbidden")
+        if not provider.verify(self.headers, body, secret):
+            logging.warning("Invalid %s webhook signature", provider.name)
+            return self._respond(403, "Forbidden")
+
+        try:
+            urls = provider.parse(self.headers, json.loads(body))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self._respond(400, "Bad Request")
+        if urls is None:
+            # Pings & the like.
+            return self._respond(200, "OK")
+        keys = {get_url_key(url) for url in urls if url}
+        if not server.on_push(keys):
+            return self._respond(404, "Unknown repository")
+        return self._respond(202, "Accepted")
+
+    def log_message(self, fmt, *args):
+        logging.debug("Webhook: %s", fmt % args)
+
+
+class WebhookServer:
+    # Accepts push webhooks & tells the daemon which repository to update.
+    # get_secret(provider) returns the secret the webhooks are signed with
+    # (or None), on_push(keys) is called with the URL keys of the pushed-to
+    # repository (see get_url_key) & returns False if it's unknown.
+
+    def __init__(self, address, port, get_secret, on_push):
+        self._server = ThreadingHTTPServer((address, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.get_secret = get_secret
+        self._server.on_push = on_push
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def start(self):
+        logging.info("Listening for webhooks on %s:%d", *self.address)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="webhooks", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
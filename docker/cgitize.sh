@@ -35,6 +35,12 @@ setup() {
 
 run() {
     cd -- "$src_dir"
+    if [ "${1-}" = daemon ]; then
+        # The daemon never exits; it reports the failures in error.html.
+        # exec it so that it receives the signals from tini.
+        rm -f -- "$fail_path"
+        exec python3 -m cgitize.main "$@"
+    fi
     python3 -m cgitize.main "$@"
     rm -f -- "$fail_path"
 }
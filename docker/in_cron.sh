@@ -33,6 +33,11 @@ setup_cron_task() {
         exec "$@"
     fi
 
+    if [ "$schedule" = daemon ]; then
+        # cgitize schedules the updates itself.
+        exec "$@" daemon
+    fi
+
     schedule="$( schedule_to_cron "$schedule" )"
 
     if [ -n "${SCHEDULE_ON_START:+x}" ]; then
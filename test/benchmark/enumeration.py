@@ -0,0 +1,182 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+# Measures how expensive it is to enumerate large users & organizations.
+# Points cgitize to local stand-ins for the GitHub, GitLab & Bitbucket APIs
+# (see providers.py), and times two runs of Config.parse_repositories:
+#     * cold: the API response cache is empty,
+#     * warm: every response is cached & revalidated using its ETag.
+# The number of API requests (by provider & status), the wall time & the peak
+# memory usage are reported for every run.
+#
+# Usage: python -m test.benchmark.enumeration --repos 10000
+
+from argparse import ArgumentParser
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from cgitize.config import Config
+
+from .providers import FakeBitbucket, FakeGitHub, FakeGitLab
+
+PROVIDERS = {
+    "github": FakeGitHub,
+    "gitlab": FakeGitLab,
+    "bitbucket": FakeBitbucket,
+}
+
+
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = ArgumentParser(description="Benchmark the repository enumeration.")
+    parser.add_argument(
+        "--repos",
+        type=int,
+        default=10000,
+        help="number of repositories of every user/organization",
+    )
+    parser.add_argument(
+        "--owners",
+        type=int,
+        default=1,
+        help="number of users (and organizations) per provider",
+    )
+    parser.add_argument(
+        "--explicit",
+        type=int,
+        default=100,
+        help="number of explicitly listed repositories per provider",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="artificial delay of every API response, in seconds",
+    )
+    parser.add_argument(
+        "--provider",
+        dest="providers",
+        action="append",
+        choices=PROVIDERS,
+        help="only use these providers (all of them by default)",
+    )
+    parser.add_argument(
+        "--dir", metavar="PATH", help="work directory (a temporary one by default)"
+    )
+    parser.add_argument("--json", metavar="PATH", help="write the results here")
+    args = parser.parse_args(argv)
+    if args.providers is None:
+        args.providers = list(PROVIDERS)
+    return args
+
+
+def write_config(path, dir, servers, args):
+    with open(path, "w") as fd:
+        fd.write(f'output_dir = "{os.path.join(dir, "output")}"\n')
+        fd.write(f'api_cache_dir = "{os.path.join(dir, "api-cache")}"\n')
+        for name, server in servers.items():
+            fd.write(f"[{name}]\n")
+            fd.write(f'base_url = "{server.url}"\n')
+            fd.write('token = "token"\n')
+            if name == "bitbucket":
+                fd.write('email = "bench@example.com"\n')
+            else:
+                fd.write('username = "bench"\n')
+            for i in range(args.owners):
+                fd.write(f"[{name}.users.user{i}]\n")
+                fd.write(f'name = "user{i}"\n')
+                fd.write(f'dir = "{name}/user{i}"\n')
+                if name == "github":
+                    fd.write(f"[{name}.organizations.org{i}]\n")
+                    fd.write(f'name = "org{i}"\n')
+                    fd.write(f'dir = "{name}/org{i}"\n')
+            for i in range(args.explicit):
+                fd.write(f"[{name}.repositories.repo{i}]\n")
+                fd.write(f'id = "explicit/repo{i}"\n')
+                fd.write(f'dir = "{name}/explicit"\n')
+
+
+def get_requests(servers):
+    return {name: server.get_requests() for name, server in servers.items()}
+
+
+def measure(config_path, servers):
+    before = get_requests(servers)
+    config = Config.read(config_path)
+    tracemalloc.start()
+    start = time.perf_counter()
+    repos = sum(1 for _ in config.parse_repositories())
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    requests = {}
+    for name, after in get_requests(servers).items():
+        requests[name] = {
+            str(status): count - before[name][status]
+            for status, count in sorted(after.items())
+            if count != before[name][status]
+        }
+    return {"repos": repos, "wall": wall, "peak": peak, "requests": requests}
+
+
+def report(name, result):
+    print(f"{name}: {result['wall']:.2f} s")
+    print(f"    {'repositories':<16} {result['repos']:>8}")
+    print(f"    {'peak memory':<16} {result['peak'] / 2**20:>8.1f} MiB")
+    for provider, requests in result["requests"].items():
+        total = sum(requests.values())
+        statuses = ", ".join(f"{n} x {status}" for status, n in requests.items())
+        print(f"    {provider + ' requests':<16} {total:>8} ({statuses})")
+
+
+def run(args, dir):
+    config_path = os.path.join(dir, "cgitize.toml")
+    servers = {
+        name: PROVIDERS[name](repos=args.repos, latency=args.latency)
+        for name in args.providers
+    }
+    for server in servers.values():
+        server.start()
+    try:
+        write_config(config_path, dir, servers, args)
+        results = {}
+
+        def bench(name):
+            results[name] = measure(config_path, servers)
+            report(name, results[name])
+
+        shutil.rmtree(os.path.join(dir, "api-cache"), ignore_errors=True)
+        bench("cold")
+        bench("warm")
+        return results
+    finally:
+        for server in servers.values():
+            server.stop()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Only the summary is of interest.
+    logging.disable(logging.INFO)
+    if args.dir is not None:
+        os.makedirs(args.dir)
+        results = run(args, os.path.abspath(args.dir))
+    else:
+        with tempfile.TemporaryDirectory() as dir:
+            results = run(args, dir)
+    if args.json is not None:
+        with open(args.json, "w") as fd:
+            json.dump({"args": vars(args), "results": results}, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+# Local stand-ins for the GitHub, GitLab & Bitbucket APIs, serving the
+# endpoints cgitize uses. Every user, organization & workspace has the same
+# number of repositories (they're generated on the fly, so 10k-repository
+# organizations are cheap). The responses are paginated like the real ones,
+# and have ETags & rate limit headers. The requests are counted by status.
+
+from collections import Counter
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+import zlib
+
+PUSHED_AT = "2026-01-01T00:00:00Z"
+
+
+def get_id(s):
+    # hash() is randomized between runs.
+    return zlib.crc32(s.encode())
+
+
+def get_size(s):
+    # Something that looks random-ish, in KiB.
+    return get_id(s) % 100000 + 10
+
+
+class RateLimit:
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.remaining = limit
+        self.reset = int(time.time()) + window
+        self._lock = threading.Lock()
+
+    def consume(self):
+        with self._lock:
+            self.remaining = max(0, self.remaining - 1)
+            return self.remaining
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive.
+    protocol_version = "HTTP/1.1"
+    # The headers & the body are written separately; don't let Nagle's
+    # algorithm delay the body until the headers are acknowledged.
+    disable_nagle_algorithm = True
+
+    def _handle(self, method):
+        fake = self.server.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = None
+        if "Content-Length" in self.headers:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        status, data, headers = fake.handle(method, parts, query, body)
+        self._send(status, data, headers)
+
+    def _send(self, status, data, headers):
+        fake = self.server.fake
+        body = json.dumps(data).encode()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status = 304
+        if status != 304 or fake.COUNT_NOT_MODIFIED:
+            remaining = fake.rate_limit.consume()
+        else:
+            remaining = fake.rate_limit.remaining
+        fake.count(status)
+        self.send_response(status)
+        for name, value in fake.get_rate_limit_headers(remaining).items():
+            self.send_header(name, str(value))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status == 304:
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if status == 200:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeServer:
+    # Whether 304 Not Modified responses count against the rate limit.
+    COUNT_NOT_MODIFIED = True
+
+    DEFAULT_PER_PAGE = 30
+    MAX_PER_PAGE = 100
+
+    def __init__(self, repos=1000, latency=0, rate_limit=5000, window=3600):
+        self.repos = repos
+        self.latency = latency
+        self.rate_limit = RateLimit(rate_limit, window)
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self.url = "http://127.0.0.1:%d" % self._server.server_port
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name=type(self).__name__, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def count(self, status):
+        with self._lock:
+            self.requests[status] += 1
+
+    def get_requests(self):
+        with self._lock:
+            return Counter(self.requests)
+
+    def _get_page(self, query, per_page="per_page"):
+        page = max(1, int(query.get("page", 1)))
+        per_page = int(query.get(per_page, self.DEFAULT_PER_PAGE))
+        per_page = max(1, min(per_page, self.MAX_PER_PAGE))
+        begin = (page - 1) * per_page
+        end = min(begin + per_page, self.repos)
+        last = max(1, -(-self.repos // per_page))
+        return page, per_page, range(begin, end), last
+
+    def _make_link(self, path, query, **params):
+        query = dict(query, **params)
+        return f"{self.url}{path}?{urlencode(query)}"
+
+    def _make_links(self, path, query, page, last):
+        links = []
+        if page < last:
+            links.append(("next", page + 1))
+        links.append(("last", last))
+        if page > 1:
+            links.append(("prev", page - 1))
+        links.append(("first", 1))
+        return ", ".join(
+            f'<{self._make_link(path, query, page=n)}>; rel="{rel}"' for rel, n in links
+        )
+
+    def get_rate_limit_headers(self, remaining):
+        return {}
+
+    def handle(self, method, parts, query, body):
+        return 404, {"message": "Not Found"}, {}
+
+
+class FakeGitHub(FakeServer):
+    # GitHub doesn't count conditional requests against the rate limit.
+    COUNT_NOT_MODIFIED = False
+
+    def __init__(self, *args, username="bench", **kwargs):
+        super().__init__(*args, **kwargs)
+        # The authenticated user.
+        self.username = username
+
+    def get_rate_limit_headers(self, remaining):
+        return {
+            "X-RateLimit-Limit": self.rate_limit.limit,
+            "X-RateLimit-Remaining": remaining,
+            "X-RateLimit-Reset": self.rate_limit.reset,
+            "X-RateLimit-Used": self.rate_limit.limit - remaining,
+            "X-RateLimit-Resource": "core",
+        }
+
+    def _make_owner(self, login, type):
+        kind = "users" if type == "User" else "orgs"
+        return {
+            "login": login,
+            "id": get_id(login),
+            "type": type,
+            "name": f"Name of {login}",
+            "url": f"{self.url}/{kind}/{login}",
+            "html_url": f"https://github.com/{login}",
+            "repos_url": f"{self.url}/{kind}/{login}/repos",
+            "public_repos": self.repos,
+        }
+
+    def _make_repo(self, owner, name):
+        full_name = f"{owner}/{name}"
+        return {
+            "id": get_id(full_name),
+            "node_id": f"R_{get_id(full_name)}",
+            "name": name,
+            "full_name": full_name,
+            "private": False,
+            "owner": {
+                "login": owner,
+                "type": "User",
+                "url": f"{self.url}/users/{owner}",
+            },
+            "html_url": f"https://github.com/{full_name}",
+            "description": f"Description of {name}",
+            "fork": False,
+            "url": f"{self.url}/repos/{full_name}",
+            "created_at": PUSHED_AT,
+            "updated_at": PUSHED_AT,
+            "pushed_at": PUSHED_AT,
+            "git_url": f"git://github.com/{full_name}.git",
+            "ssh_url": f"git@github.com:{full_name}.git",
+            "clone_url": f"https://github.com/{full_name}.git",
+            "homepage": None,
+            "size": get_size(full_name),
+            "stargazers_count": 0,
+            "language": "Python",
+            "forks_count": 0,
+            "archived": False,
+            "visibility": "public",
+            "default_branch": "main",
+        }
+
+    def _make_graphql_repo(self, owner, name):
+        return {
+            "name": name,
+            "nameWithOwner": f"{owner}/{name}",
+            "description": f"Description of {name}",
+            "url": f"https://github.com/{owner}/{name}",
+            "sshUrl": f"git@github.com:{owner}/{name}.git",
+            "pushedAt": PUSHED_AT,
+            "isFork": False,
+            "diskUsage": get_size(f"{owner}/{name}"),
+            "parent": None,
+            "owner": {"login": owner, "name": f"Name of {owner}"},
+        }
+
+    def _list_repos(self, path, owner, query):
+        page, _, items, last = self._get_page(query)
+        data = [self._make_repo(owner, f"repo{i}") for i in items]
+        return 200, data, {"Link": self._make_links(path, query, page, last)}
+
+    def _graphql(self, body):
+        variables = json.loads(body)["variables"]
+        data = {}
+        for i in range(len(variables) // 2):
+            owner, name = variables[f"owner{i}"], variables[f"name{i}"]
+            data[f"repo{i}"] = self._make_graphql_repo(owner, name)
+        return 200, {"data": data}, {}
+
+    def handle(self, method, parts, query, body):
+        path = "/" + "/".join(parts)
+        if method == "POST":
+            if parts == ["graphql"]:
+                return self._graphql(body)
+            return super().handle(method, parts, query, body)
+        if parts == ["user"]:
+            return 200, self._make_owner(self.username, "User"), {}
+        if parts == ["user", "repos"]:
+            return self._list_repos(path, self.username, query)
+        if len(parts) == 2 and parts[0] in ("users", "orgs"):
+            type = "User" if parts[0] == "users" else "Organization"
+            return 200, self._make_owner(parts[1], type), {}
+        if len(parts) == 3 and parts[0] in ("users", "orgs") and parts[2] == "repos":
+            return self._list_repos(path, parts[1], query)
+        if len(parts) == 3 and parts[0] == "repos":
+            return 200, self._make_repo(parts[1], parts[2]), {}
+        return super().handle(method, parts, query, body)
+
+
+class FakeGitLab(FakeServer):
+    DEFAULT_PER_PAGE = 20
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # User ID -> username, and vice versa.
+        self._users = {}
+        self._ids = {}
+
+    def get_rate_limit_headers(self, remaining):
+        return {
+            "RateLimit-Limit": self.rate_limit.limit,
+            "RateLimit-Remaining": remaining,
+            "RateLimit-Reset": self.rate_limit.reset,
+            "RateLimit-Observed": self.rate_limit.limit - remaining,
+        }
+
+    def _get_user_id(self, username):
+        with self._lock:
+            if username not in self._ids:
+                self._ids[username] = len(self._ids) + 1
+                self._users[self._ids[username]] = username
+            return self._ids[username]
+
+    def _make_user(self, username):
+        return {
+            "id": self._get_user_id(username),
+            "username": username,
+            "name": f"Name of {username}",
+            "state": "active",
+            "web_url": f"https://gitlab.com/{username}",
+        }
+
+    def _make_project(self, owner, name, statistics=False):
+        path = f"{owner}/{name}"
+        data = {
+            "id": get_id(path),
+            "name": name,
+            "path": name,
+            "name_with_namespace": f"Name of {owner} / {name}",
+            "path_with_namespace": path,
+            "description": f"Description of {name}",
+            "default_branch": "main",
+            "visibility": "public",
+            "web_url": f"https://gitlab.com/{path}",
+            "http_url_to_repo": f"https://gitlab.com/{path}.git",
+            "ssh_url_to_repo": f"git@gitlab.com:{path}.git",
+            "created_at": PUSHED_AT,
+            "last_activity_at": PUSHED_AT,
+            "namespace": {
+                "id": self._get_user_id(owner),
+                "name": f"Name of {owner}",
+                "path": owner,
+                "kind": "user",
+                "full_path": owner,
+            },
+            "forks_count": 0,
+            "star_count": 0,
+            "archived": False,
+        }
+        if statistics:
+            data["statistics"] = {"repository_size": get_size(path) * 1024}
+        return data
+
+    def _list_projects(self, path, user_id, query):
+        with self._lock:
+            owner = self._users.get(user_id)
+        if owner is None:
+            return super().handle("GET", [], query, None)
+        page, per_page, items, last = self._get_page(query)
+        statistics = query.get("statistics", "").lower() == "true"
+        data = [
+            self._make_project(owner, f"repo{i}", statistics=statistics) for i in items
+        ]
+        headers = {
+            "Link": self._make_links(path, query, page, last),
+            "X-Page": str(page),
+            "X-Per-Page": str(per_page),
+            "X-Total": str(self.repos),
+            "X-Total-Pages": str(last),
+        }
+        if page < last:
+            headers["X-Next-Page"] = str(page + 1)
+        return 200, data, headers
+
+    def handle(self, method, parts, query, body):
+        if method != "GET" or parts[:2] != ["api", "v4"]:
+            return super().handle(method, parts, query, body)
+        path = "/" + "/".join(parts)
+        parts = parts[2:]
+        if parts == ["users"] and "username" in query:
+            return 200, [self._make_user(query["username"])], {}
+        if len(parts) == 3 and parts[0] == "users" and parts[2] == "projects":
+            return self._list_projects(path, int(parts[1]), query)
+        if len(parts) == 2 and parts[0] == "projects":
+            owner, _, name = parts[1].rpartition("/")
+            statistics = query.get("statistics", "").lower() == "true"
+            return 200, self._make_project(owner, name, statistics=statistics), {}
+        return super().handle(method, parts, query, body)
+
+
+class FakeBitbucket(FakeServer):
+    DEFAULT_PER_PAGE = 10
+
+    def get_rate_limit_headers(self, remaining):
+        # Bitbucket doesn't report the remaining quota.
+        return {
+            "X-RateLimit-Limit": self.rate_limit.limit,
+            "X-RateLimit-Resource": "api",
+            "X-RateLimit-NearLimit": str(remaining < self.rate_limit.limit // 5),
+        }
+
+    def _make_workspace(self, slug):
+        api = f"{self.url}/2.0"
+        return {
+            "type": "workspace",
+            "uuid": "{%08x}" % get_id(slug),
+            "slug": slug,
+            "name": f"Name of {slug}",
+            "is_private": False,
+            "links": {
+                "self": {"href": f"{api}/workspaces/{slug}"},
+                "html": {"href": f"https://bitbucket.org/{slug}/"},
+                "repositories": {"href": f"{api}/repositories/{slug}"},
+                "projects": {"href": f"{api}/workspaces/{slug}/projects"},
+                "members": {"href": f"{api}/workspaces/{slug}/members"},
+            },
+        }
+
+    def _make_repo(self, workspace, slug):
+        full_name = f"{workspace}/{slug}"
+        api = f"{self.url}/2.0/repositories/{full_name}"
+        return {
+            "type": "repository",
+            "uuid": "{%08x}" % get_id(full_name),
+            "name": slug,
+            "slug": slug,
+            "full_name": full_name,
+            "description": f"Description of {slug}",
+            "is_private": False,
+            "scm": "git",
+            "size": get_size(full_name) * 1024,
+            "language": "python",
+            "created_on": PUSHED_AT,
+            "updated_on": PUSHED_AT,
+            "mainbranch": {"type": "branch", "name": "main"},
+            "owner": {
+                "type": "team",
+                "display_name": f"Name of {workspace}",
+                "username": workspace,
+            },
+            "links": {
+                "self": {"href": api},
+                "html": {"href": f"https://bitbucket.org/{full_name}"},
+                "clone": [
+                    {
+                        "name": "https",
+                        "href": f"https://bench@bitbucket.org/{full_name}.git",
+                    },
+                    {"name": "ssh", "href": f"git@bitbucket.org:{full_name}.git"},
+                ],
+            },
+        }
+
+    def _list_repos(self, path, workspace, query):
+        page, per_page, items, last = self._get_page(query, per_page="pagelen")
+        data = {
+            "pagelen": per_page,
+            "size": self.repos,
+            "page": page,
+            "values": [self._make_repo(workspace, f"repo{i}") for i in items],
+        }
+        if page < last:
+            data["next"] = self._make_link(path, query, page=page + 1)
+        return 200, data, {}
+
+    def handle(self, method, parts, query, body):
+        if method != "GET" or parts[:1] != ["2.0"]:
+            return super().handle(method, parts, query, body)
+        path = "/" + "/".join(parts)
+        parts = parts[1:]
+        if len(parts) == 2 and parts[0] == "workspaces":
+            return 200, self._make_workspace(parts[1]), {}
+        if len(parts) == 2 and parts[0] == "repositories":
+            return self._list_repos(path, parts[1], query)
+        if len(parts) == 3 and parts[0] == "repositories":
+            return 200, self._make_repo(parts[1], parts[2]), {}
+        return super().handle(method, parts, query, body)
@@ -0,0 +1,212 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+# Measures how long it takes to mirror & update a bunch of local repositories.
+# Generates the upstream repositories, and times three runs of cgitize:
+#     * cold: every repository is mirrored from scratch,
+#     * no change: nothing has changed upstream,
+#     * partial change: some of the upstream repositories have new commits.
+# Every run is traced (see --trace), and the time spent in every phase & the
+# number of git processes are reported.
+#
+# Usage: python -m test.benchmark.update --repos 100 --jobs 4
+
+from argparse import ArgumentParser
+from collections import defaultdict
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from cgitize.main import main as cgitize
+
+
+class Upstream:
+    def __init__(self, path, seed):
+        self.path = path
+        self.random = random.Random(seed)
+        self.commits = 0
+        subprocess.run(["git", "init", "--bare", "--quiet", path], check=True)
+
+    def _commit(self, stream, file_size, parent):
+        self.commits += 1
+        msg = f"commit {self.commits}\n".encode()
+        data = self.random.randbytes(file_size)
+        stream += b"commit refs/heads/main\n"
+        stream += f"mark :{self.commits}\n".encode()
+        timestamp = 1700000000 + self.commits
+        stream += f"committer Bench <b@example.com> {timestamp} +0000\n".encode()
+        stream += f"data {len(msg)}\n".encode() + msg
+        if parent is not None:
+            stream += f"from {parent}\n".encode()
+        # A handful of files, so that the trees change as well.
+        stream += f"M 644 inline file{self.commits % 16}\n".encode()
+        stream += f"data {len(data)}\n".encode() + data + b"\n"
+
+    def _import(self, stream):
+        subprocess.run(
+            ["git", "fast-import", "--quiet"],
+            input=bytes(stream),
+            cwd=self.path,
+            check=True,
+        )
+
+    def generate(self, commits, file_size, branches, tags):
+        stream = bytearray()
+        for i in range(commits):
+            self._commit(stream, file_size, f":{i}" if i else None)
+        # The branches & tags point to random commits in the history.
+        for i in range(branches):
+            mark = self.random.randint(1, commits)
+            stream += f"reset refs/heads/branch{i}\nfrom :{mark}\n\n".encode()
+        for i in range(tags):
+            mark = self.random.randint(1, commits)
+            stream += f"reset refs/tags/v{i}\nfrom :{mark}\n\n".encode()
+        self._import(stream)
+
+    def push(self, commits, file_size):
+        stream = bytearray()
+        for i in range(commits):
+            parent = "refs/heads/main^0" if i == 0 else None
+            self._commit(stream, file_size, parent)
+        self._import(stream)
+
+
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = ArgumentParser(description="Benchmark the git update pipeline.")
+    parser.add_argument("--repos", type=int, default=50, help="number of repositories")
+    parser.add_argument(
+        "--commits", type=int, default=100, help="commits per repository"
+    )
+    parser.add_argument(
+        "--file-size", type=int, default=4096, help="bytes added by every commit"
+    )
+    parser.add_argument(
+        "--branches", type=int, default=10, help="branches per repository"
+    )
+    parser.add_argument("--tags", type=int, default=20, help="tags per repository")
+    parser.add_argument(
+        "--changed",
+        type=float,
+        default=0.1,
+        help="share of repositories changed before the last run",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=4,
+        help="number of repositories to update in parallel",
+    )
+    parser.add_argument(
+        "--dir", metavar="PATH", help="work directory (a temporary one by default)"
+    )
+    parser.add_argument("--json", metavar="PATH", help="write the results here")
+    return parser.parse_args(argv)
+
+
+def write_config(path, output_dir, upstreams):
+    with open(path, "w") as fd:
+        fd.write(f'output_dir = "{output_dir}"\n')
+        for upstream in upstreams:
+            name = os.path.basename(upstream.path)
+            fd.write(f"[repositories.{name}]\n")
+            fd.write(f'name = "{name}"\n')
+            # file:// makes git transfer packs, like it would over the network.
+            fd.write(f'clone_url = "file://{upstream.path}"\n')
+
+
+def summarize(trace_path):
+    phases = defaultdict(lambda: [0, 0.0])
+    with open(trace_path) as fd:
+        events = json.load(fd)
+    for event in events:
+        if event["cat"] == "subprocess":
+            key = event["name"]
+        elif event["cat"] in ("update", "enumerate", "convert"):
+            key = event["cat"]
+        else:
+            key = f"{event['cat']} {event['name']}"
+        phases[key][0] += 1
+        phases[key][1] += event["dur"] / 1e6
+    return {
+        key: {"count": count, "seconds": seconds}
+        for key, (count, seconds) in phases.items()
+    }
+
+
+def measure(name, config_path, trace_path, jobs):
+    argv = ["--config", config_path, "--trace", trace_path, "--jobs", str(jobs)]
+    start = time.perf_counter()
+    rc = cgitize(argv)
+    wall = time.perf_counter() - start
+    if rc != 0:
+        raise RuntimeError(f"run '{name}' failed")
+    return {"wall": wall, "phases": summarize(trace_path)}
+
+
+def report(name, result):
+    print(f"{name}: {result['wall']:.2f} s")
+    phases = sorted(result["phases"].items(), key=lambda x: -x[1]["seconds"])
+    for key, phase in phases:
+        print(f"    {key:<32} {phase['count']:>8} {phase['seconds']:>10.3f} s")
+    processes = sum(phase["count"] for key, phase in phases if key.startswith("git "))
+    print(f"    {'git processes':<32} {processes:>8}")
+
+
+def run(args, dir):
+    upstream_dir = os.path.join(dir, "upstream")
+    output_dir = os.path.join(dir, "output")
+    config_path = os.path.join(dir, "cgitize.toml")
+
+    start = time.perf_counter()
+    upstreams = []
+    for i in range(args.repos):
+        upstream = Upstream(os.path.join(upstream_dir, f"repo{i:05}"), i)
+        upstream.generate(args.commits, args.file_size, args.branches, args.tags)
+        upstreams.append(upstream)
+    duration = time.perf_counter() - start
+    print(f"Generated {args.repos} repositories in {duration:.2f} s")
+    write_config(config_path, output_dir, upstreams)
+
+    results = {}
+
+    def bench(name):
+        trace_path = os.path.join(dir, f"{name.replace(' ', '-')}.json")
+        results[name] = measure(name, config_path, trace_path, args.jobs)
+        report(name, results[name])
+
+    bench("cold")
+    bench("no change")
+    changed = random.Random(0).sample(upstreams, int(args.repos * args.changed))
+    for upstream in changed:
+        upstream.push(5, args.file_size)
+    bench("partial change")
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Only the summary is of interest.
+    logging.disable(logging.INFO)
+    if args.dir is not None:
+        os.makedirs(args.dir)
+        results = run(args, os.path.abspath(args.dir))
+    else:
+        with tempfile.TemporaryDirectory() as dir:
+            results = run(args, dir)
+    if args.json is not None:
+        with open(args.json, "w") as fd:
+            json.dump({"args": vars(args), "results": results}, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import os
+import subprocess
+import tempfile
+import unittest
+
+from cgitize.cgit import CGitRepositories, CGitServer
+from cgitize.git import GIT_ENV, RefFilter
+from cgitize.maintenance import Maintenance
+from cgitize.pools import ObjectPools
+from cgitize.repo import Repo
+from cgitize.state import State
+
+
+def git(*args, cwd):
+    return subprocess.run(
+        ["git", "-c", "user.name=John Doe", "-c", "user.email=jdoe@example.com"]
+        + list(args),
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+    ).stdout.strip()
+
+
+class Upstream:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path)
+        git("init", "--quiet", "--initial-branch=main", cwd=path)
+        self.commit("first commit")
+
+    def commit(self, msg):
+        git("commit", "--quiet", "--allow-empty", "-m", msg, cwd=self.path)
+        return git("rev-parse", "HEAD", cwd=self.path)
+
+
+class CGitRepositoriesTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.upstream = Upstream(os.path.join(self.tmp, "upstream"))
+        self.output_dir = os.path.join(self.tmp, "output")
+        self.state = State.open(os.path.join(self.tmp, "state"))
+
+    def tearDown(self):
+        self.state.close()
+        self._tmp.cleanup()
+
+    def make_output(self, **kwargs):
+        return CGitRepositories(
+            self.output_dir, CGitServer(None), state=self.state, **kwargs
+        )
+
+    def make_repo(self, **kwargs):
+        return Repo("test", self.upstream.path, **kwargs)
+
+    def mirror_head(self, repo):
+        return git("rev-parse", "main", cwd=os.path.join(self.output_dir, repo.dir))
+
+
+class StateTests(CGitRepositoriesTestCase):
+    def test_success_is_recorded(self):
+        repo = self.make_repo()
+        self.assertTrue(self.make_output().update(repo))
+        mirror = self.state.get(repo)
+        self.assertTrue(mirror.healthy)
+        self.assertEqual(mirror.clone_url, repo.clone_url)
+        self.assertIsNotNone(mirror.fetched_at)
+        self.assertIsNotNone(mirror.refs_hash)
+
+    def test_failure_is_recorded(self):
+        repo = Repo("test", os.path.join(self.tmp, "nonexistent"))
+        output = self.make_output()
+        self.assertFalse(output.update(repo))
+        self.assertFalse(output.update(repo))
+        mirror = self.state.get(repo)
+        self.assertFalse(mirror.healthy)
+        self.assertEqual(mirror.failures, 2)
+        self.assertIn("does not exist", mirror.last_error)
+
+    def test_refs_hash(self):
+        repo = self.make_repo()
+        output = self.make_output()
+        self.assertTrue(output.update(repo))
+        old_hash = self.state.get(repo).refs_hash
+        self.assertTrue(output.update(repo))
+        self.assertEqual(self.state.get(repo).refs_hash, old_hash)
+        self.upstream.commit("second commit")
+        self.assertTrue(output.update(repo))
+        self.assertNotEqual(self.state.get(repo).refs_hash, old_hash)
+
+    def test_estimate(self):
+        output = self.make_output()
+        self.assertIsNone(output.estimate(self.make_repo(pushed_at="1")))
+        repo = self.make_repo(pushed_at="1", size=20 * 1024 * 1024)
+        self.assertEqual(output.estimate(repo), 2)
+        self.assertTrue(output.update(repo))
+        duration = self.state.get(repo).fetch_duration
+        # The update is going to be skipped.
+        self.assertEqual(output.estimate(repo), 0)
+        self.assertEqual(output.estimate(repo, full=True), duration)
+        repo = self.make_repo(pushed_at="2", size=20 * 1024 * 1024)
+        self.assertEqual(output.estimate(repo), duration)
+
+
+class GitEnvTests(CGitRepositoriesTestCase):
+    def test_git_env(self):
+        # The remotes are only reachable using the provided environment.
+        url = "https://example.invalid/test.git"
+        env = dict(GIT_ENV, GIT_CONFIG_COUNT="1")
+        env["GIT_CONFIG_KEY_0"] = f"url.{self.upstream.path}.insteadOf"
+        env["GIT_CONFIG_VALUE_0"] = url
+        output = self.make_output(git_env=env)
+        repo = Repo("test", url)
+        self.assertTrue(output.update(repo))
+        self.assertEqual(
+            self.mirror_head(repo), git("rev-parse", "HEAD", cwd=self.upstream.path)
+        )
+
+
+class PushedAtTests(CGitRepositoriesTestCase):
+    def test_unchanged_is_skipped(self):
+        output = self.make_output()
+        repo = self.make_repo(pushed_at="2026-01-01T00:00:00")
+        self.assertTrue(output.update(repo))
+        old_head = self.mirror_head(repo)
+
+        self.upstream.commit("second commit")
+        self.assertTrue(output.update(repo))
+        self.assertEqual(self.mirror_head(repo), old_head)
+
+    def test_changed_is_fetched(self):
+        output = self.make_output()
+        self.assertTrue(output.update(self.make_repo(pushed_at="2026-01-01T00:00:00")))
+
+        new_head = self.upstream.commit("second commit")
+        repo = self.make_repo(pushed_at="2026-01-02T00:00:00")
+        self.assertTrue(output.update(repo))
+        self.assertEqual(self.mirror_head(repo), new_head)
+
+    def test_full(self):
+        repo = self.make_repo(pushed_at="2026-01-01T00:00:00")
+        self.assertTrue(self.make_output().update(repo))
+
+        new_head = self.upstream.commit("second commit")
+        self.assertTrue(self.make_output(full=True).update(repo))
+        self.assertEqual(self.mirror_head(repo), new_head)
+
+    def test_unknown_is_fetched(self):
+        output = self.make_output()
+        repo = self.make_repo()
+        self.assertTrue(output.update(repo))
+
+        new_head = self.upstream.commit("second commit")
+        self.assertTrue(output.update(repo))
+        self.assertEqual(self.mirror_head(repo), new_head)
+
+
+class RepoListTests(CGitRepositoriesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.output_dir, "cgitrepos")
+
+    def read(self):
+        with open(self.path) as fd:
+            return fd.read()
+
+    def test_sections(self):
+        output = self.make_output()
+        upstream = self.upstream.path
+        repos = [
+            Repo("b", upstream, desc="B", subdir="sub"),
+            Repo("a", upstream, desc="A", owner="John Doe", subdir="sub"),
+            Repo("c", upstream, desc="line 1\nline 2", homepage="https://c"),
+        ]
+        for repo in repos:
+            self.assertTrue(output.update(repo))
+        output.repo_list.write(self.path)
+        dir = self.output_dir
+        self.assertEqual(
+            self.read(),
+            f"""# Generated by cgitize, do not edit.
+
+repo.url=c
+repo.path={dir}/c.git
+repo.desc=line 1 line 2
+repo.clone-url={upstream}
+repo.homepage=https://c
+
+section=sub
+
+repo.url=sub/a
+repo.path={dir}/sub/a.git
+repo.desc=A
+repo.owner=John Doe
+repo.clone-url={upstream}
+
+repo.url=sub/b
+repo.path={dir}/sub/b.git
+repo.desc=B
+repo.clone-url={upstream}
+""",
+        )
+
+    def test_unchanged(self):
+        output = self.make_output()
+        self.assertTrue(output.update(self.make_repo()))
+        output.repo_list.write(self.path)
+        os.utime(self.path, (0, 0))
+        self.assertTrue(output.update(self.make_repo()))
+        output.repo_list.write(self.path)
+        self.assertEqual(os.path.getmtime(self.path), 0)
+
+    def test_failed_is_listed(self):
+        self.assertTrue(self.make_output().update(self.make_repo()))
+        nonexistent = os.path.join(self.tmp, "nonexistent")
+        output = self.make_output()
+        # The old mirror is still there & can be served.
+        self.assertFalse(output.update(Repo("test", nonexistent)))
+        self.assertFalse(output.update(Repo("new", nonexistent)))
+        self.assertEqual(len(output.repo_list), 1)
+
+
+class MaintenanceTests(CGitRepositoriesTestCase):
+    def get_dir(self, repo):
+        return os.path.join(self.output_dir, repo.dir)
+
+    def add_packs(self, output, repo, n):
+        for i in range(n):
+            self.upstream.commit(f"commit {i}")
+            self.assertTrue(output.update(repo))
+            git("repack", "--quiet", cwd=self.get_dir(repo))
+
+    def test_repack(self):
+        repo = self.make_repo()
+        output = self.make_output()
+        self.assertTrue(output.update(repo))
+        self.add_packs(output, repo, 4)
+        repo_dir = self.get_dir(repo)
+        self.assertGreater(Maintenance.count_packs(repo_dir), 2)
+        self.assertTrue(Maintenance(max_packs=2).run(repo_dir, False))
+        self.assertLessEqual(Maintenance.count_packs(repo_dir), 2)
+        self.assertTrue(Maintenance.has_midx(repo_dir))
+
+    def test_state(self):
+        repo = self.make_repo()
+        output = self.make_output(maintenance=Maintenance())
+        self.assertTrue(output.update(repo))
+        repo_dir = self.get_dir(repo)
+        self.assertTrue(Maintenance.has_midx(repo_dir))
+        chain = os.path.join(
+            repo_dir, "objects", "info", "commit-graphs", "commit-graph-chain"
+        )
+        self.assertTrue(os.path.exists(chain))
+        mirror = self.state.get(repo)
+        self.assertEqual(mirror.maintained_refs_hash, mirror.refs_hash)
+
+    def test_time_budget(self):
+        repo = self.make_repo()
+        maintenance = Maintenance(time_budget=0)
+        output = self.make_output(maintenance=maintenance)
+        self.assertTrue(output.update(repo))
+        self.assertFalse(Maintenance.has_midx(self.get_dir(repo)))
+        self.assertEqual(maintenance.deferred, 1)
+        self.assertIsNone(self.state.get(repo).maintained_refs_hash)
+        # It's done during the next run, even though nothing has changed.
+        output = self.make_output(maintenance=Maintenance())
+        self.assertTrue(output.update(repo))
+        mirror = self.state.get(repo)
+        self.assertEqual(mirror.maintained_refs_hash, mirror.refs_hash)
+
+
+class ObjectPoolTests(CGitRepositoriesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pools = ObjectPools(os.path.join(self.tmp, "pools"))
+        for i in range(10):
+            self.upstream.commit(f"commit {i}")
+        self.fork = os.path.join(self.tmp, "fork")
+        git("clone", "--quiet", self.upstream.path, self.fork, cwd=self.tmp)
+        git("commit", "--quiet", "--allow-empty", "-m", "fork", cwd=self.fork)
+
+    def make_output(self, **kwargs):
+        return super().make_output(pools=self.pools, **kwargs)
+
+    def make_repos(self, **kwargs):
+        # file:// makes git transfer packs, like it would over the network.
+        return [
+            Repo("upstream", f"file://{self.upstream.path}", **kwargs),
+            Repo("fork", f"file://{self.fork}", **kwargs),
+        ]
+
+    def get_dir(self, repo):
+        return os.path.join(self.output_dir, repo.dir)
+
+    def count_objects(self, repo):
+        output = git("count-objects", "-v", cwd=self.get_dir(repo))
+        stats = dict(line.split(": ") for line in output.splitlines())
+        return int(stats["count"]) + int(stats["in-pack"])
+
+    def get_alternates(self, repo):
+        path = os.path.join(self.get_dir(repo), "objects", "info", "alternates")
+        if not os.path.exists(path):
+            return None
+        with open(path) as fd:
+            return fd.read()
+
+    def test_shared(self):
+        output = self.make_output()
+        upstream, fork = self.make_repos(pool="test")
+        self.assertTrue(output.update(upstream))
+        self.assertTrue(output.update(fork))
+        pool_objects = os.path.join(self.pools.get_path("test"), "objects")
+        for repo in (upstream, fork):
+            self.assertEqual(self.get_alternates(repo), f"{pool_objects}\n")
+            git("fsck", "--connectivity-only", cwd=self.get_dir(repo))
+        # Every object is in the pool now.
+        self.assertEqual(self.count_objects(upstream), 0)
+        self.assertEqual(self.count_objects(fork), 0)
+        self.assertEqual(
+            self.mirror_head(fork), git("rev-parse", "HEAD", cwd=self.fork)
+        )
+
+    def test_join(self):
+        upstream, fork = self.make_repos(pool="test")
+        self.assertTrue(super().make_output().update(upstream))
+        self.assertGreater(self.count_objects(upstream), 0)
+        # An existing mirror joins the pool.
+        self.assertTrue(self.make_output().update(upstream))
+        self.assertIsNotNone(self.get_alternates(upstream))
+        self.assertEqual(self.count_objects(upstream), 0)
+        git("fsck", "--connectivity-only", cwd=self.get_dir(upstream))
+
+    def get_bitmaps(self, repo):
+        pack_dir = os.path.join(self.get_dir(repo), "objects", "pack")
+        return [name for name in os.listdir(pack_dir) if name.endswith(".bitmap")]
+
+    def test_maintenance(self):
+        # Pool members can't have bitmaps: their packs aren't closed under
+        # reachability. Depending on the git version, writing one either
+        # fails or copies every object from the pool.
+        output = self.make_output(maintenance=Maintenance())
+        upstream, fork = self.make_repos(pool="test")
+        self.assertTrue(output.update(upstream))
+        self.assertTrue(output.update(fork))
+        for repo in (upstream, fork):
+            self.assertEqual(self.count_objects(repo), 0)
+            chain = os.path.join(
+                self.get_dir(repo),
+                "objects",
+                "info",
+                "commit-graphs",
+                "commit-graph-chain",
+            )
+            self.assertTrue(os.path.exists(chain))
+            mirror = self.state.get(repo)
+            self.assertEqual(mirror.maintained_refs_hash, mirror.refs_hash)
+        # A commit that isn't in the pool ends up in a pack of its own.
+        repo_dir = self.get_dir(upstream)
+        tree = git("rev-parse", "main^{tree}", cwd=repo_dir)
+        commit = git("commit-tree", "-p", "main", "-m", "local", tree, cwd=repo_dir)
+        git("update-ref", "refs/heads/local", commit, cwd=repo_dir)
+        git("repack", "-l", "--quiet", cwd=repo_dir)
+        self.assertTrue(Maintenance(max_packs=0).run(repo_dir, True))
+        self.assertTrue(Maintenance.has_midx(repo_dir))
+        self.assertEqual(self.get_bitmaps(upstream), [])
+        self.assertEqual(self.count_objects(upstream), 1)
+        git("fsck", "--connectivity-only", cwd=repo_dir)
+
+    def test_no_forks(self):
+        upstream, fork = self.make_repos(pool="test", create_pool=False)
+        self.assertTrue(self.make_output().update(upstream))
+        self.assertIsNone(self.get_alternates(upstream))
+        self.assertFalse(os.path.exists(self.pools.get_path("test")))
+
+
+class RefFilterTests(CGitRepositoriesTestCase):
+    def setUp(self):
+        super().setUp()
+        git("tag", "v1", cwd=self.upstream.path)
+        git("update-ref", "refs/pull/1/head", "HEAD", cwd=self.upstream.path)
+        git("symbolic-ref", "HEAD", "refs/heads/main", cwd=self.upstream.path)
+
+    def get_refs(self, repo):
+        repo_dir = os.path.join(self.output_dir, repo.dir)
+        return git("for-each-ref", "--format=%(refname)", cwd=repo_dir).splitlines()
+
+    def test_default(self):
+        repo = self.make_repo()
+        self.assertTrue(self.make_output().update(repo))
+        self.assertIn("refs/pull/1/head", self.get_refs(repo))
+
+    def test_clone(self):
+        repo = self.make_repo(refs=RefFilter(exclude=["refs/pull/*"]))
+        self.assertTrue(self.make_output().update(repo))
+        self.assertEqual(self.get_refs(repo), ["refs/heads/main", "refs/tags/v1"])
+        repo_dir = os.path.join(self.output_dir, repo.dir)
+        self.assertEqual(git("symbolic-ref", "HEAD", cwd=repo_dir), "refs/heads/main")
+        head = self.upstream.commit("second commit")
+        self.assertTrue(self.make_output().update(repo))
+        self.assertEqual(self.mirror_head(repo), head)
+
+    def test_migrate(self):
+        output = self.make_output()
+        self.assertTrue(output.update(self.make_repo()))
+        repo = self.make_repo(refs=RefFilter(["refs/heads/*"]))
+        self.assertTrue(output.update(repo))
+        self.assertEqual(self.get_refs(repo), ["refs/heads/main"])
+        self.assertEqual(self.state.get(repo).refspecs, repo.refs.refspecs)
+        # And back.
+        repo = self.make_repo()
+        self.assertTrue(output.update(repo))
+        self.assertEqual(
+            self.get_refs(repo),
+            ["refs/heads/main", "refs/pull/1/head", "refs/tags/v1"],
+        )
+
+
+class SeedTests(CGitRepositoriesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seed = os.path.join(self.tmp, "seed")
+        os.makedirs(self.seed)
+
+    def update(self, repo):
+        output = self.make_output(seed=self.seed)
+        with self.assertLogs(level="INFO") as logs:
+            self.assertTrue(output.update(repo))
+        return "\n".join(logs.output)
+
+    def check_mirror(self, repo, head):
+        repo_dir = os.path.join(self.output_dir, repo.dir)
+        self.assertEqual(self.mirror_head(repo), head)
+        url = git("config", "remote.origin.url", cwd=repo_dir)
+        self.assertEqual(url, repo.clone_url)
+
+    def test_bundle(self):
+        repo = self.make_repo(subdir="sub")
+        os.makedirs(os.path.join(self.seed, "sub"))
+        bundle = os.path.join(self.seed, "sub", "test.bundle")
+        git("bundle", "create", "--quiet", bundle, "--all", cwd=self.upstream.path)
+        head = self.upstream.commit("second commit")
+        self.assertIn(f"Seeding repository 'test' from: {bundle}", self.update(repo))
+        self.check_mirror(repo, head)
+
+    def test_output_dir(self):
+        repo = self.make_repo()
+        git(
+            "clone",
+            "--mirror",
+            "--quiet",
+            self.upstream.path,
+            os.path.join(self.seed, repo.dir),
+            cwd=self.tmp,
+        )
+        head = self.upstream.commit("second commit")
+        self.assertIn("Seeding repository 'test'", self.update(repo))
+        self.check_mirror(repo, head)
+
+    def test_broken(self):
+        repo = self.make_repo()
+        with open(os.path.join(self.seed, "test.bundle"), "w") as fd:
+            fd.write("garbage")
+        self.assertIn("Couldn't seed repository 'test'", self.update(repo))
+        self.check_mirror(repo, git("rev-parse", "HEAD", cwd=self.upstream.path))
+
+    def test_no_seed(self):
+        repo = self.make_repo()
+        self.assertNotIn("Seeding", self.update(repo))
+        self.check_mirror(repo, git("rev-parse", "HEAD", cwd=self.upstream.path))
@@ -0,0 +1,274 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+from http.server import ThreadingHTTPServer
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+import unittest
+
+from cgitize.config import ClientRegistry, Config
+from cgitize.git import GIT_ENV, SSHMultiplexer
+from cgitize.repo import Repo
+from cgitize.state import State
+
+from ..benchmark.providers import FakeGitLab
+from .test_github_stub import Handler
+
+
+class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def read_config(self, contents=""):
+        path = os.path.join(self.tmp, "cgitize.toml")
+        with open(path, "w") as fd:
+            fd.write(f'output_dir = "{self.tmp}"\n')
+            fd.write(contents)
+        return Config.read(path)
+
+
+class ClientRegistryTests(ConfigTestCase):
+    def test_reuse(self):
+        config = self.read_config()
+        github = config.github.connect_to_service(config)
+        self.assertIs(config.github.connect_to_service(config), github)
+        self.assertIsNot(config.gitlab.connect_to_service(config), github)
+        self.assertEqual(config.clients.created, 2)
+        self.assertEqual(config.clients.reused, 1)
+
+    def test_per_credentials(self):
+        config = self.read_config()
+        anonymous = config.github.connect_to_service(config)
+        config.github.impl["username"] = "user"
+        config.github.impl["token"] = "token"
+        self.assertIsNot(config.github.connect_to_service(config), anonymous)
+
+    def test_slow_connect(self):
+        # A slow provider doesn't block the others.
+        registry = ClientRegistry()
+        connecting = threading.Event()
+        proceed = threading.Event()
+        clients = []
+        waited = []
+
+        def connect_slow():
+            connecting.set()
+            # This times out if the other lookup is blocked.
+            waited.append(proceed.wait(5))
+            return "slow"
+
+        def get_slow():
+            clients.append(registry.get("slow", connect_slow))
+
+        threads = [threading.Thread(target=get_slow) for _ in range(2)]
+        threads[0].start()
+        self.assertTrue(connecting.wait(10))
+        threads[1].start()
+        self.assertEqual(registry.get("fast", lambda: "fast"), "fast")
+        proceed.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(waited, [True])
+        self.assertEqual(clients, ["slow", "slow"])
+        self.assertEqual(registry.created, 2)
+        self.assertEqual(registry.reused, 1)
+
+
+class BaseUrlTests(ConfigTestCase):
+    def test_default(self):
+        config = self.read_config()
+        gitlab = config.gitlab.connect_to_service(config)
+        self.assertEqual(gitlab._impl.url, "https://gitlab.com")
+        bitbucket = config.bitbucket.connect_to_service(config)
+        self.assertEqual(bitbucket._impl.url, "https://api.bitbucket.org/2.0")
+
+    def test_custom(self):
+        config = self.read_config(
+            "[github]\n"
+            'base_url = "http://localhost:8080/api/v3"\n'
+            "[gitlab]\n"
+            'base_url = "http://localhost:8081"\n'
+            "[bitbucket]\n"
+            'base_url = "http://localhost:8082/"\n'
+        )
+        github = config.github.connect_to_service(config)
+        self.assertEqual(
+            github._impl.requester.base_url, "http://localhost:8080/api/v3"
+        )
+        gitlab = config.gitlab.connect_to_service(config)
+        self.assertEqual(gitlab._impl.url, "http://localhost:8081")
+        bitbucket = config.bitbucket.connect_to_service(config)
+        self.assertEqual(bitbucket._impl.url, "http://localhost:8082/2.0")
+
+
+class ConnectionsTests(ConfigTestCase):
+    def test_default(self):
+        config = self.read_config()
+        limiter = config.make_connection_limiter()
+        self.assertEqual(limiter.max_per_host, 8)
+        self.assertEqual(limiter.hosts, {})
+        multiplexer = config.make_ssh_multiplexer()
+        self.assertIsInstance(multiplexer, SSHMultiplexer)
+        self.assertEqual(multiplexer.control_persist, 60)
+
+    def test_custom(self):
+        config = self.read_config(
+            "[connections]\n"
+            "max_per_host = 0\n"
+            'hosts = { "GitHub.com" = 4 }\n'
+            "ssh_multiplexing = false\n"
+        )
+        limiter = config.make_connection_limiter()
+        self.assertEqual(limiter.max_per_host, 0)
+        self.assertEqual(limiter.hosts, {"github.com": 4})
+        with config.make_ssh_multiplexer() as env:
+            self.assertIs(env, GIT_ENV)
+
+
+class SizeTests(ConfigTestCase):
+    def test_gitlab(self):
+        # The statistics are only included if requested.
+        with FakeGitLab(repos=2) as server:
+            config = self.read_config(
+                "[gitlab]\n"
+                f'base_url = "{server.url}"\n'
+                'username = "user"\n'
+                'token = "token"\n'
+                "[gitlab.users.user]\n"
+                'name = "user"\n'
+                "[gitlab.repositories.repo]\n"
+                'id = "explicit/repo"\n'
+            )
+            repos = list(config.parse_repositories())
+        self.assertEqual(len(repos), 3)
+        for repo in repos:
+            self.assertGreater(repo.size, 0)
+
+
+class PushedAtTests(ConfigTestCase):
+    # Only GitHub reports the time of the last push. The other providers'
+    # timestamps lag behind, and would make cgitize skip fresh pushes.
+
+    def test_gitlab(self):
+        src = SimpleNamespace(
+            name="repo",
+            description=None,
+            web_url="https://gitlab.com/user/repo",
+            namespace={"name": "user"},
+            last_activity_at="2026-01-01T00:00:00Z",
+            path_with_namespace="user/repo",
+            http_url_to_repo="https://gitlab.com/user/repo.git",
+            ssh_url_to_repo="git@gitlab.com:user/repo.git",
+        )
+        repo = Repo.from_gitlab(src, self.read_config())
+        self.assertIsNone(repo.pushed_at)
+
+    def test_bitbucket(self):
+        data = {
+            "full_name": "user/repo",
+            "owner": {"display_name": "User"},
+            "updated_on": "2026-01-01T00:00:00Z",
+            "links": {
+                "clone": [
+                    {"name": "https", "href": "https://bitbucket.org/user/repo.git"},
+                    {"name": "ssh", "href": "git@bitbucket.org:user/repo.git"},
+                ]
+            },
+        }
+        src = SimpleNamespace(
+            name="repo",
+            description=None,
+            get_link=lambda name: "https://bitbucket.org/user/repo",
+            data=data,
+        )
+        repo = Repo.from_bitbucket(src, self.read_config())
+        self.assertIsNone(repo.pushed_at)
+
+
+class RepositoryIndexTests(ConfigTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.server.requests = []
+        self.server.missing = set()
+        self.server.forks = set()
+        self.server.repo_count = 3
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.state = State.in_memory()
+
+    def tearDown(self):
+        self.state.close()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def read_config(self, skip=()):
+        return super().read_config(
+            "[repositories.local]\n"
+            'name = "local"\n'
+            'clone_url = "https://example.com/local.git"\n'
+            "[github]\n"
+            f'base_url = "{self.server.url}"\n'
+            'username = "user"\n'
+            'token = "token"\n'
+            "[github.users.someone]\n"
+            'name = "someone"\n'
+            'dir = "someone"\n'
+            f"skip = {list(skip)}\n"
+            "[github.organizations.org]\n"
+            'name = "org"\n'
+            'dir = "org"\n'
+            "[github.repositories.explicit]\n"
+            'id = "owner/explicit"\n'
+            'dir = "explicit"\n'
+        )
+
+    def index(self):
+        config = self.read_config()
+        repos = {repo.url_path: repo for repo in config.parse_repositories()}
+        self.state.replace_sources(repos.values())
+        self.server.requests.clear()
+        return repos
+
+    def find(self, config, name):
+        origins = self.state.find_sources(name)
+        self.assertEqual(len(origins), 1)
+        return config.get_repository(origins[0])
+
+    def test_find(self):
+        repos = self.index()
+        self.assertEqual(len(repos), 1 + 3 + 3 + 1)
+        config = self.read_config()
+        for url_path in ("local", "someone/repo1", "org/repo2", "explicit/explicit"):
+            repo = self.find(config, url_path)
+            self.assertEqual(repo.dir, repos[url_path].dir)
+            self.assertEqual(repo.clone_url, repos[url_path].clone_url)
+            self.assertEqual(repo.owner, repos[url_path].owner)
+        # A single request per hosted repository, nothing for the local one.
+        self.assertEqual(self.server.requests, [("POST", "/graphql")] * 3)
+
+    def test_missing(self):
+        self.index()
+        self.assertEqual(self.state.find_sources("missing"), [])
+        # Both the user & the organization have it.
+        self.assertEqual(len(self.state.find_sources("repo1")), 2)
+        # The repository is now skipped.
+        self.assertIsNone(self.find(self.read_config(skip=["repo1"]), "someone/repo1"))
+        # The user has been removed from the config.
+        config = self.read_config()
+        del config.github.users.impl["someone"]
+        self.assertIsNone(self.find(config, "someone/repo1"))
+
+    def test_replace(self):
+        self.index()
+        self.state.replace_sources([])
+        self.assertEqual(self.state.find_sources("local"), [])
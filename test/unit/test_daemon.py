@@ -0,0 +1,147 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+from cgitize.daemon import Daemon
+
+from .test_cgit import Upstream, git
+
+
+class DaemonTests(unittest.TestCase):
+    TIMEOUT = 30
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.output_dir = os.path.join(self.tmp, "output")
+        self.config_path = os.path.join(self.tmp, "cgitize.toml")
+        self.upstreams = {
+            name: Upstream(os.path.join(self.tmp, "upstream", name))
+            for name in ("a", "b")
+        }
+        self.thread = None
+
+    def tearDown(self):
+        if self.thread is not None:
+            self.daemon.stop()
+            self.thread.join(self.TIMEOUT)
+        self._tmp.cleanup()
+
+    def write_config(self, *names, update_interval=3600, webhooks=False):
+        with open(self.config_path, "w") as fd:
+            fd.write(f'output_dir = "{self.output_dir}"\n')
+            fd.write("[daemon]\n")
+            fd.write("refresh_interval = 3600\n")
+            fd.write(f"update_interval = {update_interval}\n")
+            if webhooks:
+                fd.write("webhook_port = 0\n")
+                fd.write("[github]\n")
+                fd.write('webhook_secret = "secret"\n')
+            for name in names:
+                fd.write(f"[repositories.{name}]\n")
+                fd.write(f'name = "{name}"\n')
+                fd.write(f'clone_url = "{self.upstreams[name].path}"\n')
+
+    def start(self):
+        self.daemon = Daemon(self.config_path, jobs=2)
+        self.thread = threading.Thread(target=self.daemon.run)
+        self.thread.start()
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + self.TIMEOUT
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("timed out")
+            time.sleep(0.05)
+
+    def mirror_head(self, name):
+        path = os.path.join(self.output_dir, f"{name}.git")
+        if not os.path.isdir(path):
+            return None
+        return git("rev-parse", "main", cwd=path)
+
+    def listed(self):
+        path = os.path.join(self.output_dir, "cgitrepos")
+        if not os.path.exists(path):
+            return None
+        with open(path) as fd:
+            return sorted(
+                line[len("repo.url=") :]
+                for line in fd.read().splitlines()
+                if line.startswith("repo.url=")
+            )
+
+    def test_update(self):
+        self.write_config("a", update_interval=0.1)
+        self.start()
+        self.wait_for(lambda: self.listed() == ["a"])
+        head = self.upstreams["a"].commit("second commit")
+        # The repository is updated on its own schedule, without refreshing
+        # the listings.
+        self.wait_for(lambda: self.mirror_head("a") == head)
+        self.assertEqual(self.daemon.refreshes, 1)
+
+    def test_reload(self):
+        self.write_config("a")
+        self.start()
+        self.wait_for(lambda: self.listed() == ["a"])
+        clients = self.daemon.config.clients
+        self.write_config("a", "b")
+        self.daemon.reload()
+        self.wait_for(lambda: self.listed() == ["a", "b"])
+        self.assertIs(self.daemon.config.clients, clients)
+        # Only the new repository was updated.
+        self.assertEqual(self.daemon.updates, 2)
+        self.write_config("b")
+        self.daemon.reload()
+        self.wait_for(lambda: self.listed() == ["b"])
+        self.assertEqual(self.daemon.updates, 2)
+        # The mirror itself isn't removed.
+        self.assertIsNotNone(self.mirror_head("a"))
+
+    def push(self, name):
+        body = json.dumps(
+            {"repository": {"clone_url": self.upstreams[name].path}}
+        ).encode()
+        signature = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+        headers = {
+            "X-GitHub-Event": "push",
+            "X-Hub-Signature-256": f"sha256={signature}",
+        }
+        url = "http://%s:%d/github" % self.daemon.webhooks.address
+        return requests.post(url, data=body, headers=headers).status_code
+
+    def test_push(self):
+        self.write_config("a", "b", webhooks=True)
+        self.start()
+        self.daemon.PUSH_DELAY = 0.5
+        self.wait_for(lambda: self.listed() == ["a", "b"])
+        self.assertEqual(self.daemon.updates, 2)
+        head = self.upstreams["a"].commit("second commit")
+        # A burst of pushes only causes a single update.
+        for _ in range(3):
+            self.assertEqual(self.push("a"), 202)
+        self.wait_for(lambda: self.mirror_head("a") == head)
+        self.wait_for(lambda: self.daemon.updates == 3)
+        self.assertEqual(self.daemon.pushes, 3)
+        self.assertEqual(self.daemon.refreshes, 1)
+
+    def test_retry_interval(self):
+        self.write_config()
+        daemon = Daemon(self.config_path)
+        self.assertEqual(daemon._get_retry_interval(None), 3600)
+        self.assertEqual(daemon._get_retry_interval(1), Daemon.FIRST_RETRY)
+        self.assertEqual(daemon._get_retry_interval(2), 2 * Daemon.FIRST_RETRY)
+        self.assertEqual(daemon._get_retry_interval(10), 3600)
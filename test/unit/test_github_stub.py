@@ -0,0 +1,333 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+# These test cgitize's GitHub wrapper against a local stub of the API.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import tempfile
+import threading
+import unittest
+from urllib.parse import parse_qs, urlsplit
+
+from github import GithubException
+
+from cgitize.config import Config, HostedRepo, Org, User
+from cgitize.github import GitHub
+from cgitize.session import connection_stats
+
+
+def make_repo(base_url, owner, name, fork=False):
+    repo = {
+        "id": abs(hash((owner, name))),
+        "name": name,
+        "full_name": f"{owner}/{name}",
+        "description": f"Description of {name}",
+        "html_url": f"https://github.com/{owner}/{name}",
+        "clone_url": f"https://github.com/{owner}/{name}.git",
+        "ssh_url": f"git@github.com:{owner}/{name}.git",
+        "pushed_at": "2026-01-01T00:00:00Z",
+        "size": 1024,
+        "fork": fork,
+        "owner": {
+            "login": owner,
+            "type": "User",
+            "url": f"{base_url}/users/{owner}",
+        },
+    }
+    return repo
+
+
+def get_parent(name):
+    # Every fork is forked from a repository with the same name.
+    return f"upstream/{name}"
+
+
+def make_owner(base_url, login, type="User"):
+    return {
+        "login": login,
+        "name": f"Name of {login}",
+        "type": type,
+        "url": f"{base_url}/users/{login}",
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive.
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_page(self, path, items):
+        query = parse_qs(urlsplit(self.path).query)
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["30"])[0])
+        begin = (page - 1) * per_page
+        headers = {}
+        if begin + per_page < len(items):
+            next = f"{self.server.url}{path}?page={page + 1}&per_page={per_page}"
+            headers["Link"] = f'<{next}>; rel="next"'
+        self._send_json(items[begin : begin + per_page], headers=headers)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+        path = urlsplit(self.path).path
+        parts = path.strip("/").split("/")
+        url = self.server.url
+        if len(parts) == 3 and parts[0] == "repos":
+            _, owner, name = parts
+            if name in self.server.missing:
+                return self._send_json({"message": "Not Found"}, status=404)
+            repo = make_repo(url, owner, name, fork=name in self.server.forks)
+            if repo["fork"]:
+                # Only the full repository includes these, not the listings.
+                parent = make_repo(url, *get_parent(name).split("/"))
+                repo["parent"] = repo["source"] = parent
+            return self._send_json(repo)
+        if parts == ["user"]:
+            return self._send_json(make_owner(url, "user"))
+        if parts == ["user", "repos"]:
+            return self._send_page(path, self._make_repos("user"))
+        if len(parts) == 2 and parts[0] in ("users", "orgs"):
+            type = "User" if parts[0] == "users" else "Organization"
+            return self._send_json(make_owner(url, parts[1], type=type))
+        if len(parts) == 3 and parts[0] in ("users", "orgs") and parts[2] == "repos":
+            return self._send_page(path, self._make_repos(parts[1]))
+        self._send_json({"message": "Not Found"}, status=404)
+
+    def _make_repos(self, owner):
+        return [
+            make_repo(
+                self.server.url, owner, f"repo{i}", fork=f"repo{i}" in self.server.forks
+            )
+            for i in range(self.server.repo_count)
+        ]
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path))
+        length = int(self.headers["Content-Length"])
+        variables = json.loads(self.rfile.read(length))["variables"]
+        data = {}
+        errors = []
+        for i in range(len(variables) // 2):
+            owner, name = variables[f"owner{i}"], variables[f"name{i}"]
+            if name in self.server.missing:
+                data[f"repo{i}"] = None
+                errors.append({"type": "NOT_FOUND", "message": f"{owner}/{name}"})
+                continue
+            data[f"repo{i}"] = {
+                "name": name,
+                "nameWithOwner": f"{owner}/{name}",
+                "description": f"Description of {name}",
+                "url": f"https://github.com/{owner}/{name}",
+                "sshUrl": f"git@github.com:{owner}/{name}.git",
+                "pushedAt": "2026-01-01T00:00:00Z",
+                "isFork": name in self.server.forks,
+                "parent": None,
+                "owner": {"login": owner, "name": f"Name of {owner}"},
+            }
+            if name in self.server.forks:
+                data[f"repo{i}"]["parent"] = {"nameWithOwner": get_parent(name)}
+        response = {"data": data}
+        if errors:
+            response["errors"] = errors
+        self._send_json(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class GitHubStubTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.server.requests = []
+        self.server.missing = set()
+        self.server.forks = set()
+        self.server.repo_count = 70
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def connect(self, token="token"):
+        return GitHub("user", token, base_url=self.server.url)
+
+
+class GetReposTests(GitHubStubTestCase):
+    def test_batches(self):
+        api = self.connect()
+        api.GRAPHQL_BATCH_SIZE = 2
+        repos = [HostedRepo({"id": f"owner/repo{i}"}) for i in range(5)]
+        result = list(api.get_repos(repos))
+        self.assertEqual([r for r, _ in result], repos)
+        self.assertEqual(
+            [src.name for _, src in result], [f"repo{i}" for i in range(5)]
+        )
+        self.assertEqual(self.server.requests, [("POST", "/graphql")] * 3)
+
+        src = result[0][1]
+        self.assertEqual(src.html_url, "https://github.com/owner/repo0")
+        self.assertEqual(src.clone_url, "https://github.com/owner/repo0.git")
+        self.assertEqual(src.ssh_url, "git@github.com:owner/repo0.git")
+        self.assertEqual(src.owner.login, "owner")
+        self.assertEqual(src.pushed_at.isoformat(), "2026-01-01T00:00:00+00:00")
+
+    def test_unauthenticated(self):
+        api = self.connect(token=None)
+        repos = [HostedRepo({"id": f"owner/repo{i}"}) for i in range(2)]
+        self.assertEqual(
+            [src.name for _, src in api.get_repos(repos)], ["repo0", "repo1"]
+        )
+        self.assertEqual(
+            self.server.requests,
+            [("GET", "/repos/owner/repo0"), ("GET", "/repos/owner/repo1")],
+        )
+
+    def test_missing(self):
+        self.server.missing.add("repo1")
+        repos = [HostedRepo({"id": f"owner/repo{i}"}) for i in range(2)]
+        with self.assertRaises(GithubException):
+            list(self.connect().get_repos(repos))
+
+    def test_invalid_id(self):
+        with self.assertRaises(ValueError):
+            list(self.connect().get_repos([HostedRepo({"id": "invalid"})]))
+
+
+class OwnerLookupTests(GitHubStubTestCase):
+    # Every repository in a listing has an owner, which only includes its
+    # login. Getting its name must not cost a request per repository.
+
+    def setUp(self):
+        super().setUp()
+        self._tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self._tmp.name, "cgitize.toml")
+        with open(path, "w") as fd:
+            fd.write(f'output_dir = "{self._tmp.name}"\n')
+        self.config = Config.read(path)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+        super().tearDown()
+
+    def convert(self, api, repos):
+        return [api.convert_repo(repo, self.config) for repo in repos]
+
+    def assertOwners(self, repos, name):
+        self.assertEqual(len(repos), self.server.repo_count)
+        self.assertEqual({repo.owner for repo in repos}, {name})
+
+    def test_user(self):
+        api = self.connect()
+        repos = self.convert(api, api.get_user_repos(User({"name": "someone"})))
+        self.assertOwners(repos, "Name of someone")
+        # The user itself + 3 pages of 30 repositories.
+        self.assertEqual(len(self.server.requests), 1 + 3)
+
+    def test_authenticated_user(self):
+        api = self.connect()
+        repos = self.convert(api, api.get_user_repos(User({"name": "user"})))
+        self.assertOwners(repos, "Name of user")
+        # 3 pages + the owner, once.
+        self.assertEqual(len(self.server.requests), 3 + 1)
+
+    def test_keep_alive(self):
+        api = self.connect()
+        self.convert(api, api.get_user_repos(User({"name": "someone"})))
+        self.convert(api, api.get_org_repos(Org({"name": "org"})))
+        requests, connections = connection_stats(api.session)
+        self.assertEqual(requests, len(self.server.requests))
+        self.assertEqual(connections, 1)
+
+    def test_org(self):
+        api = self.connect()
+        repos = self.convert(api, api.get_org_repos(Org({"name": "org"})))
+        self.assertOwners(repos, "Name of org")
+        # The organization itself + 3 pages.
+        self.assertEqual(len(self.server.requests), 1 + 3)
+
+    def test_explicit(self):
+        api = self.connect()
+        hosted = [HostedRepo({"id": f"owner/repo{i}"}) for i in range(3)]
+        repos = self.convert(api, (src for _, src in api.get_repos(hosted)))
+        self.assertEqual({repo.owner for repo in repos}, {"Name of owner"})
+        self.assertEqual(self.server.requests, [("POST", "/graphql")])
+
+
+class SourceLookupTests(GitHubStubTestCase):
+    # The listings don't include the repositories the forks were forked
+    # from. Getting them must not cost a request per fork.
+
+    def setUp(self):
+        super().setUp()
+        self._tmp = tempfile.TemporaryDirectory()
+        self.config = self.read_config("object_pools = true\n")
+        self.forks = {f"repo{i}" for i in range(0, self.server.repo_count, 3)}
+        self.server.forks.update(self.forks)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+        super().tearDown()
+
+    def read_config(self, contents=""):
+        path = os.path.join(self._tmp.name, "cgitize.toml")
+        with open(path, "w") as fd:
+            fd.write(f'output_dir = "{self._tmp.name}"\n')
+            fd.write(contents)
+        return Config.read(path)
+
+    def convert(self, api, repos):
+        return [api.convert_repo(repo, self.config) for repo in repos]
+
+    def assertPools(self, repos):
+        for repo in repos:
+            if repo.name in self.forks:
+                self.assertEqual(repo.pool, f"github:{get_parent(repo.name)}")
+                self.assertTrue(repo.create_pool)
+            else:
+                self.assertFalse(repo.create_pool)
+
+    def test_user(self):
+        api = self.connect()
+        api.GRAPHQL_BATCH_SIZE = 50
+        repos = self.convert(api, api.get_user_repos(User({"name": "someone"})))
+        self.assertEqual(len(repos), self.server.repo_count)
+        self.assertPools(repos)
+        # The user itself + 3 pages + a GraphQL query per 50 repositories.
+        self.assertEqual(len(self.server.requests), 1 + 3 + 2)
+        self.assertEqual(self.server.requests.count(("POST", "/graphql")), 2)
+
+    def test_explicit(self):
+        api = self.connect()
+        hosted = [HostedRepo({"id": f"owner/repo{i}"}) for i in range(3)]
+        repos = self.convert(api, (src for _, src in api.get_repos(hosted)))
+        self.assertPools(repos)
+        self.assertEqual(self.server.requests, [("POST", "/graphql")])
+
+    def test_unauthenticated(self):
+        # The GraphQL API is only available to authenticated users.
+        api = self.connect(token=None)
+        repos = self.convert(api, api.get_user_repos(User({"name": "someone"})))
+        self.assertPools(repos)
+        self.assertEqual(len(self.server.requests), 1 + 3 + len(self.forks))
+
+    def test_no_pools(self):
+        self.config = self.read_config()
+        api = self.connect()
+        repos = self.convert(api, api.get_user_repos(User({"name": "someone"})))
+        self.assertEqual({repo.pool for repo in repos}, {None})
+        self.assertEqual(len(self.server.requests), 1 + 3)
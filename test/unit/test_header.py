@@ -0,0 +1,46 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import os
+import tempfile
+import unittest
+
+from cgitize.header import update
+
+
+class HeaderTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, "header.html")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def read(self):
+        with open(self.path) as fd:
+            return fd.read()
+
+    def test_success(self):
+        update(self.path, True)
+        self.assertEqual(self.read(), "")
+
+    def test_escape(self):
+        update(
+            self.path,
+            False,
+            RuntimeError("<b>oops</b>"),
+            ["<script>alert(1)</script>", "a&b"],
+        )
+        contents = self.read()
+        self.assertNotIn("<script>", contents)
+        self.assertNotIn("<b>", contents)
+        self.assertIn(
+            "Failed: &lt;script&gt;alert(1)&lt;/script&gt;, a&amp;b", contents
+        )
+        self.assertIn("RuntimeError: &lt;b&gt;oops&lt;/b&gt;", contents)
+
+    def test_skipped(self):
+        update(self.path, True, skipped=["<i>repo</i>"])
+        self.assertIn("Skipped (out of time): &lt;i&gt;repo&lt;/i&gt;", self.read())
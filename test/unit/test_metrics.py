@@ -0,0 +1,101 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import unittest
+
+import requests
+
+from cgitize.metrics import (
+    REPO_FETCH_DURATION,
+    REPO_RECEIVED_BYTES,
+    REPO_UPDATES,
+    MetricsServer,
+    Registry,
+)
+from cgitize.repo import Repo
+
+from .test_cgit import CGitRepositoriesTestCase
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.updates = self.registry.counter(
+            "updates_total", "Updates.", ("repo", "result")
+        )
+        self.latency = self.registry.summary("latency_seconds", "Latency.")
+
+    def test_render(self):
+        self.updates.inc(repo="a", result="success")
+        self.updates.inc(repo="a", result="success")
+        self.updates.inc(repo='b"\n', result="failure")
+        self.latency.observe(0.5)
+        self.latency.observe(1.5)
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP updates_total Updates.\n"
+            "# TYPE updates_total counter\n"
+            'updates_total{repo="a",result="success"} 2\n'
+            'updates_total{repo="b\\"\\n",result="failure"} 1\n'
+            "# HELP latency_seconds Latency.\n"
+            "# TYPE latency_seconds summary\n"
+            "latency_seconds_sum 2.0\n"
+            "latency_seconds_count 2\n",
+        )
+
+    def test_invalid_labels(self):
+        with self.assertRaises(ValueError):
+            self.updates.inc(repo="a")
+
+    def test_forget(self):
+        self.updates.inc(repo="a", result="success")
+        self.updates.inc(repo="b", result="success")
+        self.registry.forget("repo", "a")
+        self.assertIsNone(self.updates.get(repo="a", result="success"))
+        self.assertEqual(self.updates.get(repo="b", result="success"), 1)
+
+    def test_server(self):
+        self.updates.inc(repo="a", result="success")
+        server = MetricsServer("127.0.0.1", 0, self.registry)
+        server.start()
+        try:
+            url = "http://%s:%d" % server.address
+            r = requests.get(f"{url}/metrics")
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.text, self.registry.render())
+            self.assertEqual(requests.get(f"{url}/").status_code, 404)
+        finally:
+            server.stop()
+
+
+class RepositoryMetricsTests(CGitRepositoriesTestCase):
+    def get_updates(self, repo, result):
+        return REPO_UPDATES.get(repo=repo.url_path, result=result) or 0
+
+    def test_update(self):
+        output = self.make_output(metrics=True)
+        repo = self.make_repo(pushed_at="1")
+        success = self.get_updates(repo, "success")
+        unchanged = self.get_updates(repo, "unchanged")
+        failure = self.get_updates(repo, "failure")
+
+        self.assertTrue(output.update(repo))
+        self.assertEqual(self.get_updates(repo, "success"), success + 1)
+        self.assertGreater(REPO_RECEIVED_BYTES.get(repo=repo.url_path), 0)
+        self.assertIsNotNone(REPO_FETCH_DURATION.get(repo=repo.url_path))
+
+        self.assertTrue(output.update(repo))
+        self.assertEqual(self.get_updates(repo, "unchanged"), unchanged + 1)
+
+        repo = Repo("test", f"{self.upstream.path}-missing", pushed_at="2")
+        self.assertFalse(output.update(repo))
+        self.assertEqual(self.get_updates(repo, "failure"), failure + 1)
+
+    def test_disabled(self):
+        output = self.make_output()
+        repo = Repo("disabled", self.upstream.path)
+        self.assertTrue(output.update(repo))
+        self.assertIsNone(REPO_RECEIVED_BYTES.get(repo=repo.url_path))
+        self.assertIsNotNone(REPO_FETCH_DURATION.get(repo=repo.url_path))
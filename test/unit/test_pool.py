@@ -0,0 +1,105 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import threading
+import unittest
+
+from cgitize.pool import Results, UpdatePool
+from cgitize.repo import Repo
+
+
+class FakeOutput:
+    def __init__(self, fail=(), estimates=None):
+        self.fail = fail
+        self.estimates = estimates or {}
+        self.lock = threading.Lock()
+        self.updated = []
+        self.skipped = []
+
+    def estimate(self, repo):
+        return self.estimates.get(repo.name, 0)
+
+    def update(self, repo):
+        if repo.name == "broken":
+            raise RuntimeError("oops")
+        with self.lock:
+            self.updated.append(repo.name)
+        return repo.name not in self.fail
+
+    def skip(self, repo):
+        self.skipped.append(repo.name)
+
+
+def make_repos(*names):
+    return [Repo(name, f"https://example.com/{name}.git") for name in names]
+
+
+class UpdatePoolTests(unittest.TestCase):
+    def test_all_updated(self):
+        output = FakeOutput()
+        results = UpdatePool(output, jobs=4).run(make_repos("a", "b", "c"), Results())
+        self.assertTrue(results.success)
+        self.assertEqual(sorted(output.updated), ["a", "b", "c"])
+
+    def test_failures_are_aggregated(self):
+        output = FakeOutput(fail=("b",))
+        repos = make_repos("a", "b", "broken", "c")
+        results = UpdatePool(output, jobs=2).run(repos, Results())
+        self.assertFalse(results.success)
+        self.assertEqual(results.failed_names, ["b", "broken"])
+        self.assertEqual(sorted(output.updated), ["a", "b", "c"])
+
+    def test_enumeration_error(self):
+        def repos():
+            yield from make_repos("a", "b")
+            raise RuntimeError("API is down")
+
+        output = FakeOutput()
+        results = Results()
+        with self.assertRaises(RuntimeError):
+            UpdatePool(output, jobs=2).run(repos(), results)
+        self.assertEqual(sorted(repo.name for repo in results.succeeded), ["a", "b"])
+
+    def test_deadline(self):
+        now = [0]
+
+        class SlowOutput(FakeOutput):
+            def update(self, repo):
+                now[0] += 5
+                return super().update(repo)
+
+        output = SlowOutput()
+        pool = UpdatePool(output, jobs=1, deadline=10, clock=lambda: now[0])
+        results = pool.run(make_repos("a", "b", "c", "d"), Results())
+        self.assertTrue(results.success)
+        self.assertEqual(output.updated, ["a", "b"])
+        self.assertEqual(results.skipped_names, ["c", "d"])
+        self.assertEqual(output.skipped, ["c", "d"])
+
+    def test_longest_first(self):
+        enumerated = threading.Event()
+
+        class BlockingOutput(FakeOutput):
+            def update(self, repo):
+                # Let the rest of the repositories queue up.
+                if repo.name == "first":
+                    enumerated.wait()
+                return super().update(repo)
+
+        def repos():
+            yield from make_repos("first", "small", "big", "new", "medium", "zero")
+            enumerated.set()
+
+        estimates = {"small": 1, "big": 100, "new": None, "medium": 10}
+        output = BlockingOutput(estimates=estimates)
+        results = UpdatePool(output, jobs=1).run(repos(), Results())
+        self.assertTrue(results.success)
+        self.assertEqual(
+            output.updated, ["first", "new", "big", "medium", "small", "zero"]
+        )
+
+    def test_invalid_jobs(self):
+        with self.assertRaises(ValueError):
+            UpdatePool(FakeOutput(), jobs=0)
@@ -0,0 +1,242 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from cgitize.metrics import API_LATENCY, API_RATE_LIMIT_REMAINING, API_REQUESTS
+from cgitize.session import RateLimiter, ResponseCache, make_session
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        etag = f'"{server.version}"'
+        if self.headers.get("If-None-Match") == etag:
+            server.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("X-RateLimit-Remaining", str(server.remaining))
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path, "version": server.version}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("X-RateLimit-Remaining", str(server.remaining))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        if server.throttle:
+            server.throttle -= 1
+            self.send_response(429)
+            self.send_header("Retry-After", str(server.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if server.remaining > 0:
+            server.remaining -= 1
+            status = 200
+        else:
+            status = 403
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.send_header("X-RateLimit-Limit", str(server.limit))
+        self.send_header("X-RateLimit-Remaining", str(server.remaining))
+        self.send_header("X-RateLimit-Reset", str(server.reset))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class CachingAdapterTests(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.requests = []
+        self.server.not_modified = 0
+        self.server.version = 1
+        self.server.remaining = 100
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self._tmp.name, "cache")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._tmp.cleanup()
+
+    def get(self, session, path, **kwargs):
+        r = session.get(f"{self.url}{path}", **kwargs)
+        r.raise_for_status()
+        return r
+
+    def test_not_modified(self):
+        session = make_session(ResponseCache(self.cache_dir))
+        self.assertEqual(self.get(session, "/repos?page=1").json()["version"], 1)
+        self.server.remaining = 99
+        r = self.get(session, "/repos?page=1")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), {"path": "/repos?page=1", "version": 1})
+        self.assertEqual(r.headers["X-RateLimit-Remaining"], "99")
+        self.assertEqual(self.server.not_modified, 1)
+
+    def test_modified(self):
+        session = make_session(ResponseCache(self.cache_dir))
+        self.get(session, "/repos")
+        self.server.version = 2
+        self.assertEqual(self.get(session, "/repos").json()["version"], 2)
+        self.assertEqual(self.server.not_modified, 0)
+        self.get(session, "/repos")
+        self.assertEqual(self.server.not_modified, 1)
+
+    def test_per_credentials(self):
+        session = make_session(ResponseCache(self.cache_dir))
+        self.get(session, "/repos", headers={"Authorization": "token a"})
+        self.get(session, "/repos", headers={"Authorization": "token b"})
+        self.assertEqual(self.server.not_modified, 0)
+        self.get(session, "/repos", headers={"Authorization": "token a"})
+        self.assertEqual(self.server.not_modified, 1)
+
+    def test_max_age(self):
+        session = make_session(ResponseCache(self.cache_dir))
+        self.get(session, "/repos")
+        session = make_session(ResponseCache(self.cache_dir, max_age=-1))
+        self.get(session, "/repos")
+        self.assertEqual(self.server.not_modified, 0)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+        self.on_sleep = None
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        if self.on_sleep is not None:
+            self.on_sleep()
+
+
+class RateLimiterTests(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitedHandler)
+        self.server.requests = 0
+        self.server.throttle = 0
+        self.server.retry_after = 3
+        self.server.limit = 100
+        self.server.remaining = 100
+        self.server.reset = 1060
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.clock = Clock()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_session(self, max_wait=RateLimiter.DEFAULT_MAX_WAIT, provider=None):
+        self.limiter = RateLimiter(max_wait, clock=self.clock, sleep=self.clock.sleep)
+        return make_session(limiter=self.limiter, provider=provider)
+
+    def get(self, session):
+        return session.get(f"{self.url}/repos")
+
+    def test_used(self):
+        session = self.make_session()
+        for _ in range(5):
+            self.assertEqual(self.get(session).status_code, 200)
+        quota = self.limiter.quotas["core"]
+        # The first response only tells how much is left.
+        self.assertEqual(quota.used, 4)
+        self.assertEqual(quota.remaining, 95)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_new_window(self):
+        session = self.make_session()
+        self.get(session)
+        self.get(session)
+        self.server.remaining = 100
+        self.server.reset = 1120
+        self.get(session)
+        self.assertEqual(self.limiter.quotas["core"].used, 2)
+
+    def test_pacing(self):
+        self.server.remaining = 6
+        session = self.make_session()
+        for _ in range(4):
+            self.get(session)
+        # 5 requests left for 60 seconds, then 4 left, etc.
+        self.assertEqual(len(self.clock.sleeps), 3)
+        self.assertAlmostEqual(self.clock.sleeps[0], 60 / 5)
+        self.assertLessEqual(self.clock.now, self.server.reset)
+
+    def test_exhausted(self):
+        self.server.remaining = 1
+        session = self.make_session()
+        self.assertEqual(self.get(session).status_code, 200)
+
+        def reset():
+            self.server.remaining = 100
+            self.server.reset += 3600
+
+        # The quota is exhausted: wait until the reset.
+        self.clock.on_sleep = reset
+        self.assertEqual(self.get(session).status_code, 200)
+        self.assertEqual(self.clock.sleeps, [61])
+
+    def test_exhausted_too_long(self):
+        self.server.remaining = 1
+        session = self.make_session(max_wait=10)
+        self.get(session)
+        self.assertEqual(self.get(session).status_code, 403)
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(self.server.requests, 2)
+
+    def test_too_many_requests(self):
+        self.server.throttle = 2
+        session = self.make_session()
+        self.assertEqual(self.get(session).status_code, 200)
+        self.assertEqual(self.clock.sleeps, [3, 3])
+        self.assertEqual(self.server.requests, 3)
+
+    def test_too_many_requests_too_long(self):
+        self.server.throttle = 1
+        self.server.retry_after = 3600
+        session = self.make_session()
+        self.assertEqual(self.get(session).status_code, 429)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_metrics(self):
+        self.server.throttle = 1
+        session = self.make_session(provider="test")
+        self.get(session)
+        self.get(session)
+        self.assertEqual(API_REQUESTS.get(provider="test", status=429), 1)
+        self.assertEqual(API_REQUESTS.get(provider="test", status=200), 2)
+        self.assertEqual(API_LATENCY.get(provider="test")[1], 3)
+        remaining = API_RATE_LIMIT_REMAINING.get(provider="test", resource="core")
+        self.assertEqual(remaining, 98)
@@ -0,0 +1,82 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import json
+import os
+import pstats
+import tempfile
+import unittest
+
+from cgitize.main import main
+from cgitize.trace import span, start_tracing, stop_tracing
+
+from .test_cgit import Upstream
+
+
+class TraceTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.trace_path = os.path.join(self.tmp, "trace.json")
+
+    def tearDown(self):
+        stop_tracing()
+        self._tmp.cleanup()
+
+    def read_trace(self):
+        with open(self.trace_path) as fd:
+            return json.load(fd)
+
+    def test_span(self):
+        with span("ignored", "test"):
+            pass
+        start_tracing(self.trace_path)
+        with span("outer", "test", x=1):
+            with span("inner", "test") as args:
+                args["y"] = 2
+        stop_tracing()
+        inner, outer = self.read_trace()
+        self.assertEqual(inner["name"], "inner")
+        self.assertEqual(inner["args"], {"y": 2})
+        self.assertEqual(outer["args"], {"x": 1})
+        self.assertEqual(outer["ph"], "X")
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["dur"], inner["dur"])
+
+    def test_run(self):
+        upstream = Upstream(os.path.join(self.tmp, "upstream"))
+        config_path = os.path.join(self.tmp, "cgitize.toml")
+        with open(config_path, "w") as fd:
+            fd.write(f'output_dir = "{os.path.join(self.tmp, "output")}"\n')
+            fd.write("[repositories.test]\n")
+            fd.write('name = "test"\n')
+            fd.write(f'clone_url = "{upstream.path}"\n')
+        profile_path = os.path.join(self.tmp, "profile")
+        argv = ["--config", config_path, "--trace", self.trace_path]
+        argv += ["--profile", profile_path]
+        self.assertEqual(main(argv), 0)
+
+        events = self.read_trace()
+        phases = {(event["cat"], event["name"]) for event in events}
+        for phase in [
+            ("run", "run"),
+            ("load", "config"),
+            ("enumerate", "config"),
+            ("update", "test"),
+            ("subprocess", "git clone"),
+            ("write", "cgitrc"),
+            ("write", "agefile"),
+            ("write", "repo list"),
+            ("write", "header"),
+        ]:
+            self.assertIn(phase, phases)
+        clone = next(e for e in events if e["name"] == "git clone")
+        self.assertEqual(clone["args"]["exit_code"], 0)
+        self.assertIn(upstream.path, clone["args"]["argv"])
+
+        stats = pstats.Stats(profile_path)
+        self.assertTrue(
+            any(func[2] == "_update" for func in stats.stats),
+        )
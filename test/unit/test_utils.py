@@ -0,0 +1,80 @@
+# Copyright (c) 2026 Egor Tensin <egor@tensin.name>
+# This file is part of the "cgitize" project.
+# For details, see https://github.com/egor-tensin/cgitize.
+# Distributed under the MIT License.
+
+import threading
+import time
+import unittest
+
+from cgitize.utils import (
+    collect_errors,
+    iterate_concurrently,
+    try_capture,
+    try_run,
+    url_get_host,
+)
+
+
+class IterateConcurrentlyTests(unittest.TestCase):
+    def test_all_items(self):
+        items = iterate_concurrently([("a", range(3)), ("b", range(10, 13))])
+        self.assertEqual(sorted(items), [0, 1, 2, 10, 11, 12])
+
+    def test_streaming(self):
+        # The first source is blocked until an item from the second one is
+        # consumed; this deadlocks unless the items are streamed.
+        unblock = threading.Event()
+
+        def slow():
+            unblock.wait(timeout=5)
+            yield "slow"
+
+        items = iterate_concurrently([("slow", slow()), ("fast", iter(["fast"]))])
+        self.assertEqual(next(items), "fast")
+        unblock.set()
+        self.assertEqual(next(items), "slow")
+
+    def test_error(self):
+        def broken():
+            yield 1
+            raise RuntimeError("oops")
+
+        consumed = []
+        with self.assertRaises(RuntimeError):
+            for item in iterate_concurrently([("a", broken()), ("b", range(2, 4))]):
+                consumed.append(item)
+        self.assertEqual(sorted(consumed), [1, 2, 3])
+
+
+class RunTests(unittest.TestCase):
+    def test_output(self):
+        self.assertEqual(try_capture("sh", "-c", "echo 1; echo 2 >&2"), (True, "1\n2"))
+        self.assertEqual(try_capture("sh", "-c", "echo 1; exit 1"), (False, "1"))
+        self.assertEqual(try_capture("cat", input="input\n"), (True, "input"))
+
+    def test_timeout(self):
+        # The background process keeps the output pipe open, so this would
+        # hang unless the whole process group is killed.
+        start = time.monotonic()
+        with self.assertLogs(level="ERROR"):
+            with collect_errors() as errors:
+                self.assertFalse(
+                    try_run("sh", "-c", "sleep 30 & echo started; wait", timeout=0.5)
+                )
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(errors, ["sh timed out after 0.5 seconds"])
+
+
+class UrlTests(unittest.TestCase):
+    def test_get_host(self):
+        self.assertEqual(url_get_host("https://GitHub.com/user/repo.git"), "github.com")
+        self.assertEqual(
+            url_get_host("https://user:pw@example.com:8443/r"), "example.com"
+        )
+        self.assertEqual(
+            url_get_host("ssh://git@example.com:2222/r.git"), "example.com"
+        )
+        self.assertEqual(url_get_host("git@github.com:user/repo.git"), "github.com")
+        self.assertIsNone(url_get_host("/srv/git/repo.git"))
+        self.assertIsNone(url_get_host("file:///srv/git/repo.git"))